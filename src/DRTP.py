@@ -1,43 +1,185 @@
 import socket       # For socket programming
-import datetime     # For timestamp
+import asyncio      # For the concurrent server
+import multiprocessing  # For the worker processes of the server
+import time         # For retransmission timers
 import os           # For file operations
+import struct       # For the handshake options
+import queue        # For handing received payloads to the writer thread
+import threading    # For writing the file while receiving
+import select       # For waiting on a socket before reading a batch of packets
+import sys          # For writing the messages
+import atexit       # For writing the last messages on exit
+import json         # For exporting the metrics
+import csv          # For exporting the metrics timeline
+import bisect       # For finding the record of a packet in a session
+import zlib         # For compressing the payloads
+import lzma         # For compressing the payloads
+import hashlib      # For telling if a file has changed since its checkpoint, and the signatures of a delta
+import math         # For the block size of a delta
+import mmap         # For matching the blocks of a delta
+import errno        # For telling a kernel without segmentation offload from a failed send
 from config import *    # Import the configuration
 
 print("\n")
 
+# Levels of the messages, a message is printed if its level is at most the log level
+SUMMARY, EVENT, DEBUG = 0, 1, 2
+log_levels = {"summary": SUMMARY, "event": EVENT, "debug": DEBUG}
+
+"""
+Description:
+    Class to print the messages of the transfer without slowing it down
+    # NOTE: The messages are kept in a list and written together, so a packet does not wait for the terminal.
+    # Check logger.events or logger.packets before formatting a message in the packet loops,
+    # so that nothing is formatted when the message is not printed
+Parameters:
+    level: str - The log level, "summary", "event" or "debug"
+    stream: file - The stream to write to
+"""
+class Logger:
+    """
+    Description:
+        Function to initialize the logger
+    Parameters:
+        level: str - The log level, "summary", "event" or "debug"
+        stream: file - The stream to write to, None for stdout
+    Return:
+        None
+    """
+    def __init__(self, level=log_level, stream=None):
+        self.stream = stream
+        self.records = []
+        self.lock = threading.Lock()
+        self.start = time.monotonic()   # Timestamps are seconds since the start, from the monotonic clock
+        self.last_write = self.start
+        self.timer = None   # Writes the kept messages after log_interval, so an idle process does not keep them
+        self.set_level(level)
+
+    """
+    Description:
+        Function to set the log level
+    Parameters:
+        level: str - The log level, "summary", "event" or "debug"
+    Return:
+        None
+    """
+    def set_level(self, level):
+        self.level = log_levels[level]
+        self.events = self.level >= EVENT   # Connection events and retransmissions are printed
+        self.packets = self.level >= DEBUG  # Every packet is printed
+
+    """
+    Description:
+        Function to print a message if its level is enabled
+    Parameters:
+        level: int - The level of the message, SUMMARY, EVENT or DEBUG
+        message: str - The message
+        timed: bool - Print the time since the start in front of the message
+        prefix: str - Printed in front of the message and the time, such as the name of the connection
+    Return:
+        None
+    """
+    def log(self, level, message, timed=False, prefix=""):
+        if level > self.level:
+            return
+        now = time.monotonic()
+        if timed:
+            message = f"{prefix}{now - self.start:.6f} -- {message}"
+        elif prefix:
+            message = f"{prefix}{message}"
+        # NOTE: The messages are added under the lock, flush swaps the list from another thread
+        with self.lock:
+            self.records.append(message)
+            write = level == SUMMARY or len(self.records) >= log_batch or now - self.last_write >= log_interval
+            if not write and self.timer is None:
+                self.timer = threading.Timer(log_interval, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+        if write:
+            self.flush()
+
+    """
+    Description:
+        Function to write the kept messages
+    Parameters:
+        None
+    Return:
+        None
+    """
+    def flush(self):
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            records, self.records = self.records, []
+            self.last_write = time.monotonic()
+            if records:
+                stream = self.stream or sys.stdout
+                stream.write("\n".join(records) + "\n")
+                stream.flush()
+
+logger = Logger()
+atexit.register(logger.flush)
+
+"""
+Description:
+    Function to print a message with the logger
+Parameters:
+    message: str - The message
+    level: int - The level of the message, SUMMARY, EVENT or DEBUG
+    timed: bool - Print the time since the start in front of the message
+Return:
+    None
+"""
+def log(message, level=EVENT, timed=False):
+    logger.log(level, message, timed)
+
 """
 Description:
-    Function to print the header of a packet if debug is enabled
+    Function to print the header of a packet if the log level is debug
 Parameters:
     header: bytes - The header of the packet
     sent: bool - If the packet was sent or received
+    header_struct: struct.Struct - The header format of the connection
 Return:
     None - Print the header
 """
-def print_header(header, sent):
-    if debug:
+def print_header(header, sent, header_struct=DRTP_struct):
+    if logger.packets:
         if sent:
-            seq_num, ack_num, flags = unpack_header(header)
-            print(f"seq_num: {seq_num}, ack_num: {ack_num}, flags: {flags}")
+            seq_num, ack_num, flags = unpack_header(header, header_struct)
+            log(f"seq_num: {seq_num}, ack_num: {ack_num}, flags: {flags}", DEBUG)
         else:
-            seq_num, ack_num, flags = unpack_header(header)
-            print(f"{'' : <70}", end=f"seq_num: {seq_num}, ack_num: {ack_num}, flags: {flags}" + "\n")
+            seq_num, ack_num, flags = unpack_header(header, header_struct)
+            log(f"{'' : <70}seq_num: {seq_num}, ack_num: {ack_num}, flags: {flags}", DEBUG)
 
 """
 Description:
     Function to set the flags in the header in a way that is easier then bit manipulation
 Parameters:
-    # NOTE: The flags are in the order of SYN, ACK, FIN, RST
+    # NOTE: The flags are in the order of SYN, ACK, FIN, RST, SACK, COMPRESSED, SIGNATURE, PARITY
     # The flags are set to 1 if the flag is set, else 0
     syn: bool - If the SYN flag is set
     ack: bool - If the ACK flag is set
     fin: bool - If the FIN flag is set
     rst: bool - If the RST flag is set
+    sack: bool - If the SACK flag is set, the ACK packet has SACK blocks in the payload
+    compressed: bool - If the COMPRESSED flag is set, the payload of the data packet is compressed
+    signature: bool - If the SIGNATURE flag is set, the packet requests or carries the block signatures of a delta transfer
+    parity: bool - If the PARITY flag is set, the payload is the XOR of a group of data packets, see ParityEncoder
 Return:
     flags: int - The flags in the header
 """
-def set_flags(syn, ack, fin, rst):
+def set_flags(syn, ack, fin, rst, sack=0, compressed=0, signature=0, parity=0):
     flags = 0
+    if parity:
+        flags |= (1 << 7)  # 1 << 7 = 1000 0000
+    if signature:
+        flags |= (1 << 6)  # 1 << 6 = 100 0000
+    if compressed:
+        flags |= (1 << 5)  # 1 << 5 = 10 0000
+    if sack:
+        flags |= (1 << 4)  # 1 << 4 = 1 0000
     if syn:
         flags |= (1 << 3)  # 1 << 3 = 1000
     if ack:
@@ -58,13 +200,21 @@ Return:
     ack: int - If the ACK flag is set
     fin: int - If the FIN flag is set
     rst: int - If the RST flag is set
+    sack: int - If the SACK flag is set
+    compressed: int - If the COMPRESSED flag is set
+    signature: int - If the SIGNATURE flag is set
+    parity: int - If the PARITY flag is set
 """
 def parse_flags(flags):
     syn = int(bool(flags & (1 << 3)))
     ack = int(bool(flags & (1 << 2)))
     fin = int(bool(flags & (1 << 1)))
     rst = int(bool(flags & (1 << 0)))
-    return (syn, ack, fin, rst)
+    sack = int(bool(flags & (1 << 4)))
+    compressed = int(bool(flags & (1 << 5)))
+    signature = int(bool(flags & (1 << 6)))
+    parity = int(bool(flags & (1 << 7)))
+    return (syn, ack, fin, rst, sack, compressed, signature, parity)
 
 """
 Description:
@@ -73,390 +223,4482 @@ Parameters:
     seq_num: int - The sequence number of the packet
     ack_num: int - The acknowledgment number of the packet
     flags: int - The flags of the packet
+    header_struct: struct.Struct - The header format of the connection, DRTP_struct or DRTP_extended_struct
 Return:
     header: bytes - The header of the packet # format: seq_num(0000 0000 0000 0001), ack_num(0000 0000 0000 0010), flags(0000 0000 0000 0100)
 """
-def pack_header(seq_num, ack_num, flags):
-    return DRTP_struct.pack(seq_num, ack_num, flags)
+def pack_header(seq_num, ack_num, flags, header_struct=DRTP_struct):
+    return header_struct.pack(seq_num, ack_num, flags)
 
 """
 Description:
     Function to unpack the header of a packet to get the sequence number, acknowledgment number, and flags
 Parameters:
     header: bytes - The header of the packet
+    header_struct: struct.Struct - The header format of the connection, DRTP_struct or DRTP_extended_struct
 Return:
     seq_num: int - The sequence number of the packet
     ack_num: int - The acknowledgment number of the packet
     flags: int - The flags of the packet
 """
-def unpack_header(header):
-    seq_num, ack_num, flags = DRTP_struct.unpack(header)
+def unpack_header(header, header_struct=DRTP_struct):
+    seq_num, ack_num, flags = header_struct.unpack(header)
     return (seq_num, ack_num, parse_flags(flags))
 
+# Options that can be sent in the payload of the SYN and SYN-ACK packets, format: {name: (code, struct format)}
+# NOTE: Old peers ignore the payload of the SYN packet and send a SYN-ACK packet without options,
+# so an option is only used when the SYN-ACK packet has it as well
+option_formats = {
+    "seq32": (1, "!B"),  # Use DRTP_extended_struct with 32-bit sequence and acknowledgment numbers
+    "range": (2, "!QQQ"),   # Send only a part of the file, format: (offset, length, size of the whole file)
+    "sack": (3, "!B"),      # Use cumulative and delayed ACKs with SACK blocks
+    "session": (4, "!B"),   # Send several files as records in one stream, see SessionReader
+    "compress": (5, "!BI"), # Payloads may be compressed, format: (method, largest size of a payload after decompression)
+    "resume": (6, "!QQ8s"), # The server keeps a checkpoint of the file, format: (size, mtime in nanoseconds, hash), see FileReader.identity
+    "delta": (7, None),     # Send the file as a delta against the server's copy, the value is the filename
+    "signatures": (8, "!IQ"),   # The server has a copy of the file and sends its signatures, format: (block size, size of the copy)
+    "fec": (9, "!BB"),      # Parity packets are sent with the data packets, format: (data packets in a group, parity packets in a group)
+    "payload": (10, "!H"),  # Size of the payloads, the client offers the size it wants to send and the server may lower it
+    "pad": (11, None),      # Ignored, pads the SYN packet to the size of the packets the client wants to send
+    "file": (12, None),     # Length of the name, size and name of a single file, the server allocates the file before it is written
+    "early": (13, "!B"),    # The client sends the first window with the SYN packet, the server answers if it accepts the data
+    "rwnd": (14, "!H"),     # The server advertises its receive window in its ACKs, the client offers 1 and the server answers with its window
+}
+option_names = {code: name for name, (code, _) in option_formats.items()}
+
+"""
+Description:
+    Function to pack the options of a SYN or SYN-ACK packet
+Parameters:
+    options: dict - The options to pack, format: {name: value} # value is a tuple for options with more than one field
+Return:
+    payload: bytes - The options, each as code(1 byte), length(1 byte) and value
+"""
+def pack_options(options):
+    payload = b''
+    for name, value in options.items():
+        code, option_format = option_formats[name]
+        if option_format:
+            value = struct.pack(option_format, *value) if isinstance(value, tuple) else struct.pack(option_format, value)
+        payload += struct.pack("!BB", code, len(value)) + value
+    return payload
+
+"""
+Description:
+    Function to unpack the options of a SYN or SYN-ACK packet, unknown options are skipped
+Parameters:
+    payload: bytes - The payload of the packet after the header
+Return:
+    options: dict - The options in the payload, format: {name: value}
+"""
+def unpack_options(payload):
+    options = {}
+    offset = 0
+    while offset + 2 <= len(payload):
+        code, length = struct.unpack_from("!BB", payload, offset)
+        value = bytes(payload[offset + 2:offset + 2 + length])
+        offset += 2 + length
+        if code in option_names:
+            name = option_names[code]
+            option_format = option_formats[name][1]
+            if option_format:
+                value = struct.unpack(option_format, value)
+                value = value[0] if len(value) == 1 else value
+            options[name] = value
+    return options
+
+"""
+Description:
+    Function to pad the options of a SYN packet with pad options, so the SYN packet is as large as the data packets
+    # NOTE: The options go first, a server with small receive buffers still reads them from the cut off packet
+Parameters:
+    payload: bytes - The packed options
+    size: int - The size of the padded options
+Return:
+    payload: bytes - The options followed by pad options of at most 255 bytes
+"""
+def pad_options(payload, size):
+    code = option_formats["pad"][0]
+    while len(payload) + 2 < size:
+        length = min(255, size - len(payload) - 2)
+        payload += struct.pack("!BB", code, length) + bytes(length)
+    return payload
+
+"""
+Description:
+    Function to get the largest payload that fits into one IP packet on the route of a connected socket, from the MTU the kernel knows
+    # NOTE: Only Linux tells the MTU of a route, other systems use payload_size
+Parameters:
+    sock: socket.socket - The connected UDP socket
+Return:
+    size: int - The payload size after the IP, UDP and DRTP headers and the meta of a parity packet, at most max_payload_size
+"""
+def route_payload_size(sock):
+    if not sys.platform.startswith("linux"):
+        return payload_size
+    try:
+        mtu = sock.getsockopt(socket.IPPROTO_IP, getattr(socket, "IP_MTU", 14))
+    except OSError:
+        return payload_size
+    return max(min_payload_size, min(mtu - 28 - DRTP_extended_struct.size - 2, max_payload_size))
+
+"""
+Description:
+    Function to parse a payload size setting
+Parameters:
+    value: str - "auto" or a number of bytes
+Return:
+    size: str - "auto", or the size as an int, raises ValueError if it is not between min_payload_size and max_payload_size
+"""
+def parse_payload_size(value):
+    if value == "auto":
+        return value
+    size = int(value)
+    if not min_payload_size <= size <= max_payload_size:
+        raise ValueError(f"the size must be between {min_payload_size} and {max_payload_size}")
+    return size
+
 """
 Description:
-    Function to pack a file into data payloads to send, with the filename is the first payload
+    Function to get the memory the kernel counts against the receive buffer for a queued packet, its truesize
+    # NOTE: Linux allocates the data of a packet rounded up to a power of two, next to its sk_buff
 Parameters:
-    filename: str - The name of the file to pack
+    size: int - The size of the UDP payload, the DRTP header and payload
 Return:
-    payload: list - The list of payloads to send # format: [filename, data1, data2, ...] # payloads are without the header
+    truesize: int - The bytes of the receive buffer the packet takes
 """
-def pack_file(filename):
+def packet_truesize(size):
+    return (1 << (size + socket_packet_overhead - 1).bit_length()) + socket_packet_overhead
+
+"""
+Description:
+    Function to set the size of the kernel receive buffer of the server socket, the packets that arrive while the server is busy wait in it
+    Without a size the buffer is sized for receive_buffers packets of the largest payload, as far as net.core.rmem_max allows it
+    # NOTE: Linux doubles the size for its own bookkeeping and caps it at net.core.rmem_max. Only a size that is given uses SO_RCVBUFFORCE,
+    # which goes above the cap for root, the default stays within the cap the admin has set
+Parameters:
+    sock: socket.socket - The socket
+    size: int - The size in bytes, None for receive_buffers packets of the largest payload
+Return:
+    actual: int - The size of the buffer the socket got, as the kernel counts it
+"""
+def set_receive_buffer(sock, size):
+    wanted = size or receive_buffers * packet_truesize(DRTP_extended_struct.size + 2 + max_payload_size)
+    force = size is not None and sys.platform.startswith("linux")
     try:
-        # Array to store the payload
-        payload = []
+        sock.setsockopt(socket.SOL_SOCKET, getattr(socket, "SO_RCVBUFFORCE", 33) if force else socket.SO_RCVBUF, wanted)
+    except OSError:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, wanted)
+    actual = sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+    if actual < wanted:
+        log(f"The receive buffer is {actual} bytes instead of {wanted}, raise net.core.rmem_max for a larger one", SUMMARY)
+    return actual
+
+"""
+Description:
+    Function to pack the SACK blocks of an ACK packet, the numbers have the width of the sequence numbers of the connection
+Parameters:
+    blocks: list - The ranges of received out-of-order packets, format: [(first seq_num, last seq_num + 1)]
+    header_struct: struct.Struct - The header format of the connection
+Return:
+    payload: bytes - The packed SACK blocks
+"""
+def pack_sack_blocks(blocks, header_struct=DRTP_struct):
+    block_format = header_struct.format[1] * 2
+    return struct.pack("!" + block_format * len(blocks), *[number for block in blocks for number in block])
+
+"""
+Description:
+    Function to unpack the SACK blocks of an ACK packet
+Parameters:
+    payload: bytes - The payload of the ACK packet
+    header_struct: struct.Struct - The header format of the connection
+Return:
+    blocks: list - The ranges of received out-of-order packets, format: [(first seq_num, last seq_num + 1)]
+"""
+def unpack_sack_blocks(payload, header_struct=DRTP_struct):
+    block_struct = struct.Struct("!" + header_struct.format[1] * 2)
+    return list(block_struct.iter_unpack(payload[:len(payload) - len(payload) % block_struct.size]))
 
+"""
+Description:
+    Class to read a file to send in chunks on demand instead of loading the whole file into memory
+    The filename is sent in the first payload, followed by the file data and an empty payload to mark the end
+    # NOTE: Chunks are read with positional reads, so a packet can be read again for retransmission without keeping it in memory
+Parameters:
+    filename: str - The name of the file to read
+    offset: int - The offset of the part of the file to send
+    length: int - The length of the part of the file to send, None for the rest of the file
+"""
+class FileReader:
+    """
+    Description:
+        Open the file and calculate the number of packets needed to send it
+    Parameters:
+        filename: str - The name of the file to read
+        offset: int - The offset of the part of the file to send
+        length: int - The length of the part of the file to send, None for the rest of the file
+    Return:
+        None
+    """
+    def __init__(self, filename, offset=0, length=None):
         # Encode the filename
         encoded_filename = filename.encode()
         # Pad the filename with null bytes to make it max_filename_length bytes long
-        encoded_filename = encoded_filename.ljust(max_filename_length, b'\0')
+        self.encoded_filename = encoded_filename.ljust(max_filename_length, b'\0')
 
-        # Open the file and send it in chunks of 1024 bytes
-        with open(filename, 'rb') as f:
+        # Open the file, filesize is the size of the part to send
+        self.file = open(filename, 'rb')
+        self.offset = offset
+        self.filesize = os.fstat(self.file.fileno()).st_size - offset if length is None else length
+        if logger.packets:
+            log(f"Reading from {filename}", DEBUG)
 
-            # Name of the file
-            if debug:
-                print(f"Reading from {filename}")
+        self.set_payload_size(payload_size)
 
-            # Loop until the end of the file
-            first_packet = True
-            while True:
+    """
+    Description:
+        Function to set the size of the payloads and calculate the number of packets, the client sets the size accepted by the server
+    Parameters:
+        size: int - The size of the payloads, the first payload holds the filename as well
+    Return:
+        None
+    """
+    def set_payload_size(self, size):
+        self.payload_size = size
+        self.first_payload_size = size - max_filename_length
 
-                # Add the filename to the first packet and read the first chunk of the file
-                if first_packet:
-                    file_raw_data = encoded_filename + f.read(chunk_size - DRTP_struct.size - max_filename_length)
-                    first_packet = False
+        # First packet + data packets + empty packet to mark the end of the file
+        remaining = max(0, self.filesize - self.first_payload_size)
+        self.total_packets = 2 + (remaining + size - 1) // size
 
-                # Read the next chunks of the file
-                else:
-                    file_raw_data = f.read(chunk_size - DRTP_struct.size)
-                
-                # Append the packet to the list
-                payload.append(file_raw_data)
-                if not file_raw_data:
-                    break
-        
         # Print the number of packets
-        if debug:
-            print(f"Total packets to send {len(payload)}")
+        if logger.packets:
+            log(f"Total packets to send {self.total_packets}", DEBUG)
 
-        # Print the first 2 packets
-        if show_packets:
-            print(f"First packet: {payload[0]}")
-            print(f"Second packet: {payload[1]}")
+    """
+    Description:
+        Function to read the payload of a packet from the file
+    Parameters:
+        seq_num: int - The sequence number of the packet, starting at 1
+    Return:
+        payload: bytes - The payload of the packet without the header # empty for the last packet
+    """
+    def read(self, seq_num):
+        if seq_num == 1:
+            payload = self.encoded_filename + os.pread(self.file.fileno(), min(self.first_payload_size, self.filesize), self.offset)
+        else:
+            offset = self.first_payload_size + (seq_num - 2) * self.payload_size
+            size = max(0, min(self.payload_size, self.filesize - offset))
+            payload = os.pread(self.file.fileno(), size, self.offset + offset) if size else b''
 
-        # Return the packets
+        # Print the first 2 packets
+        if show_packets and seq_num <= 2:
+            log(f"Packet {seq_num}: {payload}")
         return payload
-    
-    # Handle file errors
-    except FileNotFoundError as e:
-        print(f"Error: {e}")
-        exit(1)
-    except Exception as e:
-        print(f"Error: {e}")
-        exit(1)
+
+    """
+    Description:
+        Function to read a part of the file, the offsets are relative to the part that is sent
+    Parameters:
+        start: int - The offset in the part
+        end: int - The end of the data to read
+    Return:
+        data: bytes - The data
+    """
+    def read_stream(self, start, end):
+        return os.pread(self.file.fileno(), end - start, self.offset + start) if end > start else b''
+
+    """
+    Description:
+        Function to get what tells the whole file apart from other files and from older versions of it
+        # NOTE: Only the start and the end of the file are hashed, so a large file is not read twice, the size and mtime cover the rest
+    Parameters:
+        None
+    Return:
+        identity: tuple - format: (size, mtime in nanoseconds, 8-byte hash)
+    """
+    def identity(self):
+        stat = os.fstat(self.file.fileno())
+        digest = hashlib.blake2b(digest_size=8)
+        digest.update(os.pread(self.file.fileno(), resume_hash_size, 0))
+        if stat.st_size > resume_hash_size:
+            digest.update(os.pread(self.file.fileno(), resume_hash_size, max(resume_hash_size, stat.st_size - resume_hash_size)))
+        return (stat.st_size, stat.st_mtime_ns, digest.digest())
+
+    """
+    Description:
+        Function to close the file
+    Parameters:
+        None
+    Return:
+        None
+    """
+    def close(self):
+        self.file.close()
+
+"""
+Description:
+    Class to read several files as one stream of records, so that a session sends them over one connection
+    Each file is a record of its path, its size and its data, and the records follow each other in the payloads
+    without waiting for the previous file, so many small files share packets
+    # NOTE: The first payload starts with an empty filename field, as the first payload of a FileReader, and the last payload is empty
+Parameters:
+    paths: list - The files and directories to send, the files in a directory are sent with the directory name in front
+"""
+class SessionReader:
+    """
+    Description:
+        Find the files, lay out the records and calculate the number of packets
+    Parameters:
+        paths: list - The files and directories to send
+    Return:
+        None
+    """
+    def __init__(self, paths):
+        self.encoded_filename = b'\0' * max_filename_length
+
+        # The records in the stream, format: [(offset in the stream, record header or path of the file, size, offset in the file)]
+        self.files = []
+        self.segments = []
+        offset = 0
+        for path, name in session_files(paths):
+            size = os.path.getsize(path)
+            encoded_name = name.encode()
+            header = session_record_struct.pack(len(encoded_name), size) + encoded_name
+            self.segments.append((offset, header, len(header), 0))
+            offset += len(header)
+            self.segments.append((offset, path, size, 0))
+            offset += size
+            self.files.append(name)
+        self.starts = [segment[0] for segment in self.segments]
+        self.filesize = offset
+        self.open_files = {}    # Files kept open for reading, format: {path: file descriptor}
+        if logger.packets:
+            log(f"Sending {len(self.files)} files, {self.filesize} bytes with the records", DEBUG)
+
+        self.set_payload_size(payload_size)
+
+    """
+    Description:
+        Function to set the size of the payloads and calculate the number of packets, the client sets the size accepted by the server
+    Parameters:
+        size: int - The size of the payloads, the first payload holds the filename as well
+    Return:
+        None
+    """
+    def set_payload_size(self, size):
+        self.payload_size = size
+        self.first_payload_size = size - max_filename_length
+
+        # First packet + data packets + empty packet to mark the end of the stream
+        remaining = max(0, self.filesize - self.first_payload_size)
+        self.total_packets = 2 + (remaining + size - 1) // size
+
+    """
+    Description:
+        Function to read a part of the stream of records
+    Parameters:
+        start: int - The offset in the stream
+        end: int - The end of the part
+    Return:
+        data: bytes - The part of the stream
+    """
+    def read_stream(self, start, end):
+        parts = []
+        index = bisect.bisect_right(self.starts, start) - 1
+        while start < end and index < len(self.segments):
+            offset, source, size, position = self.segments[index]
+            length = min(end, offset + size) - start
+            if length > 0:
+                if isinstance(source, bytes):
+                    parts.append(source[start - offset:start - offset + length])
+                else:
+                    data = os.pread(self.open_file(source), length, position + start - offset)
+                    if len(data) != length:
+                        raise OSError(f"{source} has changed while it is sent")
+                    parts.append(data)
+                start += length
+            index += 1
+        return b''.join(parts)
+
+    """
+    Description:
+        Function to get an open file, the oldest file is closed when too many are open
+        # NOTE: A retransmission may read a file that is already sent, so the files are not closed when their last packet is read
+    Parameters:
+        path: str - The file
+    Return:
+        fd: int - The file descriptor
+    """
+    def open_file(self, path):
+        fd = self.open_files.pop(path, None)
+        if fd is None:
+            if len(self.open_files) >= session_open_files:
+                os.close(self.open_files.pop(next(iter(self.open_files))))
+            fd = os.open(path, os.O_RDONLY)
+        self.open_files[path] = fd
+        return fd
+
+    """
+    Description:
+        Function to read the payload of a packet from the stream of records
+    Parameters:
+        seq_num: int - The sequence number of the packet, starting at 1
+    Return:
+        payload: bytes - The payload of the packet without the header # empty for the last packet
+    """
+    def read(self, seq_num):
+        if seq_num == 1:
+            return self.encoded_filename + self.read_stream(0, min(self.first_payload_size, self.filesize))
+        offset = self.first_payload_size + (seq_num - 2) * self.payload_size
+        return self.read_stream(offset, min(offset + self.payload_size, self.filesize))
+
+    """
+    Description:
+        Function to close the open files
+    Parameters:
+        None
+    Return:
+        None
+    """
+    def close(self):
+        for fd in self.open_files.values():
+            os.close(fd)
+        self.open_files.clear()
 
 """
 Description:
-    Function to unpack the payloads of a file to write the file
+    Function to find the files to send in a session, the directories are walked in sorted order
 Parameters:
-    payload: list - The list of payloads to unpack
+    paths: list - The files and directories
 Return:
-    None - Write the file to the output directory
+    files: list - The files and the names they are written with on the server, format: [(path, name)]
 """
-def unpack_file(payload):
-    try:
-        # Create a new file
-        filename = payload[:max_filename_length].decode().strip('\0')
+def session_files(paths):
+    files = []
+    for path in paths:
+        if not os.path.isdir(path):
+            files.append((path, os.path.basename(path)))
+            continue
+        parent = os.path.dirname(os.path.abspath(path))
+        for directory, directories, filenames in os.walk(path):
+            directories.sort()
+            for filename in sorted(filenames):
+                file_path = os.path.join(directory, filename)
+                if os.path.isfile(file_path):
+                    files.append((file_path, os.path.relpath(os.path.abspath(file_path), parent).replace(os.sep, "/")))
+    return files
 
-        print(f"Filename: {filename}")
-        # Print the size of the file
-        if debug:
-            print(f"size of iceland_safiqul.jpg: {os.path.getsize(filename)}")
-        
-        filename = os.path.join("output", filename)
-        # Create directory if it doesn't exist
-        os.makedirs(os.path.dirname(filename), exist_ok=True)
-        with open(filename, 'wb') as f:
-            f.write(payload[max_filename_length:])
-            print(f"File is written to {filename}")
+"""
+Description:
+    Function to get the path a received file is written to in the output directory
+    # NOTE: The name comes from the client, so it can not leave the output directory, absolute names are made relative
+    # and a name with .. is written with only its last part
+Parameters:
+    name: str - The name of the file sent by the client
+Return:
+    path: str - The path in the output directory
+"""
+def output_path(name):
+    parts = [part for part in name.replace("\\", "/").split("/") if part not in ("", ".")]
+    if ".." in parts:
+        parts = [part for part in parts[-1:] if part != ".."]
+    return os.path.join("output", *(parts or ["unnamed"]))
 
-        # Print the size of the file
-        if debug:
-            print(f"size of output/iceland_safiqul.jpg: {os.path.getsize(str(filename))}")
-    except Exception as e:
-        print(f"Error: {e}")
+# Kinds of the instructions of a delta, each is a delta_instruction_struct, format: (kind, offset, length)
+# NOTE: A copy has the offset and length in the server's copy of the file, a literal is followed by length bytes of data,
+# and the end has the size of the new file as the offset and is followed by its hash, so the server can check the file it rebuilt
+delta_copy, delta_literal, delta_end = 0, 1, 2
+delta_hash_size = 16
 
 """
 Description:
-    Send a packet with the given sequence number, acknowledgment number, flags, and optional payload
+    Function to get the block size of the signatures of a file, about the square root of its size as in rsync
+    # NOTE: Larger blocks give fewer signatures to send, smaller blocks send less of the file again around a change
 Parameters:
-    seq_num: int - The sequence number of the packet
-    ack_num: int - The acknowledgment number of the packet
-    flags: int - The flags of the packet
-    payload: bytes - The payload of the packet (optional)
+    size: int - The size of the file
 Return:
-    packet: bytes - The packet to send
+    block_size: int - The block size
 """
-def send_packet(seq_num, ack_num, flags, payload=None):
-    if not payload:
-        packet = pack_header(seq_num, ack_num, flags)
-    else:
-        packet = pack_header(seq_num, ack_num, flags) + payload
-    return packet
+def delta_block_size(size):
+    return max(delta_block, math.isqrt(size))
 
 """
 Description:
-    Function to run the server to receive the file
+    Function to get the rolling checksum of a block, the same as zlib.adler32
 Parameters:
-    ip: str - The IP address of the server
-    port: int - The port of the server
-    discard: int - The packet to discard
+    data: bytes - The block
 Return:
-    None - Run the server
+    checksum: int - The checksum
+"""
+def rolling_checksum(data):
+    return zlib.adler32(data)
+
+"""
+Description:
+    Function to get the strong hash of a block, checked when the rolling checksum of a block matches
+Parameters:
+    data: bytes - The block
+Return:
+    digest: bytes - The 8-byte hash
+"""
+def strong_hash(data):
+    return hashlib.blake2b(data, digest_size=8).digest()
+
+"""
+Description:
+    Function to get the signatures of the blocks of a file on the server, the last block may be shorter
+Parameters:
+    path: str - The file
+Return:
+    signatures: bytes - The signature of each block, format: delta_signature_struct * blocks, None if there is no file to send a delta against
+    block_size: int - The block size
+    size: int - The size of the file
 """
-def run_server(ip, port, discard):
+def file_signatures(path):
     try:
-        # Start connection
-        server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        server_socket.bind((ip, port))
-        print("Server is listening...\n")
+        with open(path, "rb") as file:
+            size = os.fstat(file.fileno()).st_size
+            if size == 0:
+                return None, 0, 0
+            block_size = delta_block_size(size)
+            signatures = bytearray()
+            while block := file.read(block_size):
+                signatures += delta_signature_struct.pack(rolling_checksum(block), strong_hash(block))
+    except OSError:
+        return None, 0, 0
+    return bytes(signatures), block_size, size
 
-        # Receive SYN packet
-        packet, client_address = server_socket.recvfrom(DRTP_struct.size)
-        ack_num , _, flags = unpack_header(packet)
-        print("SYN packet is received")
-        print_header(packet[:6], False)
+"""
+Description:
+    Function to find the blocks of the server's copy in a file and get the instructions to rebuild the file from the copy
+    The rolling checksum of the block at each offset is updated from the one before it, so a block that has moved is found as well,
+    and the strong hash is only calculated when the rolling checksum matches a block of the copy
+    # NOTE: The checksum only rolls over the data that does not match, a file with a few changes is hashed about one block at a time.
+    # Rolling takes a Python step for every byte, so after delta_search bytes without a match it only rolls over one block in every
+    # delta_resync blocks and checks the blocks in between at once, a block that has moved is then found at most delta_resync blocks late
+Parameters:
+    data: bytes - The file, a memory map
+    signatures: bytes - The signatures of the server's copy, see file_signatures
+    block_size: int - The block size of the signatures
+    basis_size: int - The size of the server's copy
+Return:
+    instructions: list - The copies and literals, format: [(delta_copy, offset in the copy, length) or (delta_literal, offset in the file, length)]
+"""
+def delta_instructions(data, signatures, block_size, basis_size):
+    size = len(data)
+    blocks = {}     # The blocks of the copy with each rolling checksum, format: {checksum: [(block index, strong hash)]}
+    for index, (checksum, digest) in enumerate(delta_signature_struct.iter_unpack(signatures)):
+        blocks.setdefault(checksum, []).append((index, digest))
+    last_block = len(signatures) // delta_signature_struct.size - 1
+    last_size = basis_size - last_block * block_size
 
-        # Send SYN-ACK packet
-        seq_num = 0
-        if flags[0] == 1:
-            packet = send_packet(seq_num, ack_num + 1, set_flags(1, 1, 0, 0))
-            server_socket.sendto(packet, client_address)
-            print("SYN-ACK packet is sent")
-            print_header(packet[:6], True)
-        else:
-            socket.error("SYN packet is not received")
+    instructions = []
+    def add(kind, offset, length):
+        if instructions and instructions[-1][0] == kind and instructions[-1][1] + instructions[-1][2] == offset:
+            instructions[-1] = (kind, instructions[-1][1], instructions[-1][2] + length)
+        elif length:
+            instructions.append((kind, offset, length))
 
-        # Receive ACK packet
-        packet, _ = server_socket.recvfrom(DRTP_struct.size)
-        ack_num, seq_num, flags = unpack_header(packet)
-        if ack_num == seq_num + 1 and flags[1] == 1:
-            print("ACK packet is received")
-            print_header(packet[:6], False)
-        else:
-            socket.error("ACK packet is not received")
+    literal = 0     # Start of the data that is not matched yet
+    position = 0
+    checksum = None
+    while position + block_size <= size:
+        if checksum is None:
+            checksum = rolling_checksum(data[position:position + block_size])
+            a, b = checksum & 0xFFFF, checksum >> 16
+        match = None
+        if checksum in blocks:
+            digest = strong_hash(data[position:position + block_size])
+            match = next((index for index, block_digest in blocks[checksum]
+                          if block_digest == digest and (index < last_block or last_size == block_size)), None)
+        if match is not None:
+            add(delta_literal, literal, position - literal)
+            add(delta_copy, match * block_size, block_size)
+            position += block_size
+            literal = position
+            checksum = None
+            continue
 
-        # Connection established
-        print("Connection established\n")   
+        # Move the block one byte, the same as zlib.adler32 of the next block, or a whole block in a long run of data that does not match
+        unmatched = position - literal
+        if unmatched >= delta_search and unmatched // block_size % delta_resync:
+            position += block_size
+            checksum = None
+            continue
+        if position + block_size == size:
+            break
+        removed, added = data[position], data[position + block_size]
+        a = (a - removed + added) % 65521
+        b = (b - block_size * removed + a - 1) % 65521
+        checksum = (b << 16) | a
+        position += 1
 
-        # Start receiving the file
-        server_socket.settimeout(timeout * 10)
-        start_time = datetime.datetime.now()
+    # The shorter last block of the copy can only match at the end of the file
+    if last_size < block_size and size - last_size >= literal:
+        tail = data[size - last_size:]
+        if rolling_checksum(tail) in blocks and any(index == last_block and digest == strong_hash(tail) for index, digest in blocks[rolling_checksum(tail)]):
+            add(delta_literal, literal, size - last_size - literal)
+            add(delta_copy, last_block * block_size, last_size)
+            literal = size
+    add(delta_literal, literal, size - literal)
+    return instructions
 
-        # Receive file and send ACKs
-        excpected_ack_num = 1
-        packets = []
-        while True:
-            packet, _ = server_socket.recvfrom(chunk_size)
-            ack_num, seq_num, flags = unpack_header(packet[:DRTP_struct.size])
+"""
+Description:
+    Class to read a file as a delta against the server's copy of it, the data the server has is sent as copy instructions
+    The instructions are laid out as the records of a session, the literal data is read from the file when it is sent
+    # NOTE: The first payload starts with the filename, as the first payload of a FileReader, and the last payload is empty
+Parameters:
+    filename: str - The file to send
+    signatures: bytes - The signatures of the server's copy, see file_signatures
+    block_size: int - The block size of the signatures
+    basis_size: int - The size of the server's copy
+"""
+class DeltaReader(SessionReader):
+    """
+    Description:
+        Find the blocks the server has and lay out the instructions
+    Parameters:
+        See the class description
+    Return:
+        None
+    """
+    def __init__(self, filename, signatures, block_size, basis_size):
+        self.encoded_filename = filename.encode().ljust(max_filename_length, b'\0')
+        self.open_files = {}
 
-            # Discard the packet
-            if ack_num == discard and flags[2] == 0:
-                discard = None
-                continue
+        # Match the blocks in a memory map of the file, an empty file has no blocks to match
+        with open(filename, "rb") as file:
+            size = os.fstat(file.fileno()).st_size
+            if size:
+                with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    instructions = delta_instructions(data, signatures, block_size, basis_size)
+                    digest = hashlib.blake2b(data, digest_size=delta_hash_size).digest()
+            else:
+                instructions = []
+                digest = hashlib.blake2b(digest_size=delta_hash_size).digest()
 
-            print_header(packet[:6], False)
+        # The instructions in the stream, format: [(offset in the stream, instruction or filename, size, offset in the file)]
+        self.segments = []
+        self.literal_bytes = 0
+        offset = 0
+        for kind, position, length in instructions:
+            header = delta_instruction_struct.pack(kind, position if kind == delta_copy else 0, length)
+            self.segments.append((offset, header, len(header), 0))
+            offset += len(header)
+            if kind == delta_literal:
+                self.segments.append((offset, filename, length, position))
+                offset += length
+                self.literal_bytes += length
+        end = delta_instruction_struct.pack(delta_end, size, 0) + digest
+        self.segments.append((offset, end, len(end), 0))
+        offset += len(end)
+        self.starts = [segment[0] for segment in self.segments]
+        self.filesize = offset
+        self.size = size
+        if logger.packets:
+            log(f"Delta of {filename}: {len(instructions)} instructions, {self.filesize} bytes", DEBUG)
+        self.set_payload_size(payload_size)
 
-            # Send ACK for the received packet
-            if ack_num <= excpected_ack_num and not flags[2] == 1: # Will send ack for packets in order and any previous
-                print(f"{datetime.datetime.now().strftime('%H:%M:%S.%f')} -- packet {ack_num} is received")
-                # add the payload to the list if the packet is not a duplicate
-                if ack_num == excpected_ack_num:
-                    packets.append(packet)
-                else:
-                    print(f"{datetime.datetime.now().strftime('%H:%M:%S.%f')} -- duplicate packet {ack_num} is received")
-                packet = send_packet(seq_num, ack_num + 1, set_flags(0, 1, 0, 0))
-                server_socket.sendto(packet, client_address)
-                excpected_ack_num += 1
-                print(f"{datetime.datetime.now().strftime('%H:%M:%S.%f')} -- sending ack for the received {ack_num}")
-                print_header(packet[:6], True)
-            
-            # FIN packet is received
-            elif flags[2] == 1:
-                print("\nFIN packet is received")
-                print_header(packet[:6], False)
-
-                # Send FIN-ACK packet
-                packet = send_packet(seq_num, ack_num + 1, set_flags(0, 1, 1, 0))
-                server_socket.sendto(packet, client_address)
-                print("FIN-ACK packet is sent\n")
-                print_header(packet[:6], True)
-                server_socket.close()
-                break
+"""
+Description:
+    Function to get the signatures of the server's copy of the file, after the handshake and before the data
+    The client requests the packets of signatures it is missing, up to delta_window at a time in requests of delta_batch packets,
+    and the server sends each packet with its index as the sequence number
+    # NOTE: A request has the first index as the sequence number and the number of packets as the acknowledgment number
+Parameters:
+    client_socket: socket.socket - The connected socket of the client
+    header_struct: struct.Struct - The header format of the connection
+    rtt: RTTEstimator - The RTT of the connection, for the timeout of the requests
+    blocks: int - The number of blocks of the server's copy
+Return:
+    signatures: bytes - The signatures, raises socket.timeout if the server stops responding
+"""
+def fetch_signatures(client_socket, header_struct, rtt, blocks):
+    per_packet = payload_size // delta_signature_struct.size
+    packets = -(-blocks // per_packet)
+    received = {}
+    retries = 0
+    while len(received) < packets:
+        # Request the missing packets, the runs of missing packets are requested together
+        missing = [index for index in range(packets) if index not in received][:delta_window]
+        runs = []
+        for index in missing:
+            if runs and runs[-1][0] + runs[-1][1] == index and runs[-1][1] < delta_batch:
+                runs[-1][1] += 1
             else:
-                print(f"{datetime.datetime.now().strftime('%H:%M:%S.%f')} -- out-of-order packet {ack_num} is received")
-    
-        # Elapsed time
-        elapsed_time = datetime.datetime.now() - start_time
-
-        # Calculate throughput
-        total_data = sum(map(len, packets)) # Total data with filename in bytes
-        time_in_seconds = elapsed_time.total_seconds()
-        throughput = (total_data / time_in_seconds) * 8
-        if throughput > 1_000_000:
-            throughput = float(throughput) / 1_000_000
-            print(f"The throughput is {throughput:.2f} Mbps")
-        elif throughput > 1_000:
-            throughput = float(throughput) / 1_000
-            print(f"The throughput is {throughput:.2f} Kbps")
-        else:
-            print(f"The throughput is {throughput:.2f} bps")
-        
-        print("Connection Closes\n")
+                runs.append([index, 1])
+        for first, count in runs:
+            client_socket.send(send_packet(first, count, set_flags(0, 0, 0, 0, signature=1), header_struct=header_struct))
 
-        if debug:
-            print(f"total_data: {total_data}")
-            print(f"time_in_seconds: {time_in_seconds}")
+        # Receive until the requested packets are in or the timer expires
+        requested = set(missing)
+        deadline = time.monotonic() + rtt.timeout()
+        while requested and time.monotonic() < deadline:
+            try:
+                for packet in receive_waiting(client_socket, socket_batch, chunk_size, deadline - time.monotonic()):
+                    index, _, flags = unpack_header(packet[:header_struct.size], header_struct)
+                    if flags[6] == 1 and index in requested:
+                        received[index] = packet[header_struct.size:]
+                        requested.discard(index)
+            except socket.timeout:
+                break
+        if requested:
+            rtt.on_timeout()
+            retries = 0 if len(requested) < len(missing) else retries + 1
+            if retries > max_retries:
+                raise socket.timeout("the server is not sending the signatures")
+            log(f"{len(requested)} packets of signatures are lost, requesting them again", EVENT, timed=True)
+    return b''.join(received[index] for index in range(packets))[:blocks * delta_signature_struct.size]
 
-        # get payload and Write the file
-        payload = b''.join([packet[DRTP_struct.size:] for packet in packets])
-        unpack_file(payload)
+# Methods of the compress option, format: {name: code}
+compression_methods = {"zlib": 1, "lzma": 2}
+compression_names = {code: name for name, code in compression_methods.items()}
+# NOTE: lzma sends raw LZMA2 data without the .xz container, so a packet has no header of its own, and the dictionary
+# does not need to be larger than the data of one packet
+lzma_filters = [{"id": lzma.FILTER_LZMA2, "preset": compress_level, "dict_size": max(compress_block, 4096)}]
 
-    # Exit on keyboard interrupt
-    except KeyboardInterrupt:
-        print("Server is stopped")
-    
-    # Handle socket errors
-    except socket.error as e:
-        print(f"Error: {e}")
+"""
+Description:
+    Function to compress the data of a payload
+Parameters:
+    method: str - The compression method, a key of compression_methods
+    data: bytes - The data to compress
+Return:
+    payload: bytes - The compressed data
+"""
+def compress_payload(method, data):
+    if method == "zlib":
+        return zlib.compress(data, compress_level)
+    return lzma.compress(data, lzma.FORMAT_RAW, filters=lzma_filters)
 
 """
 Description:
-    Function to run the client to send the file
+    Function to decompress a compressed payload
+    # NOTE: The size is limited, so a payload from the network can not make the server allocate more than max_size bytes
 Parameters:
-    ip: str - The IP address of the server
-    port: int - The port of the server
-    filename: str - The name of the file to send
-    window_size: int - The size of the sliding window
+    method: str - The compression method, a key of compression_methods
+    payload: bytes - The compressed payload
+    max_size: int - The largest size of the data
 Return:
-    None - Run the client
+    data: bytes - The data, raises ValueError if the payload is not valid or too large
 """
-def run_client(ip, port, filename, window_size):
+def decompress_payload(method, payload, max_size):
     try:
-        # Start connection
-        client_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        client_socket.connect((ip, port))
-        seq_num = 0
-        print("Connection Establisht Phase:\n")
-
-        # Send SYN packet
-        packet = send_packet(seq_num, 0, set_flags(1, 0, 0, 0))
-        client_socket.send(packet)
-        print("SYN packet is sent")
-        print_header(packet[:6], True)
-
-        # Receive SYN-ACK packet
-        packet = client_socket.recv(DRTP_struct.size)
-        ack_num, seq_num, flags = unpack_header(packet)
-        if flags[0] == 1 and flags[1] == 1:
-            print("SYN-ACK packet is received")
-            print_header(packet[:6], False)
+        if method == "zlib":
+            decompressor = zlib.decompressobj()
         else:
-            print("SYN-ACK packet is not received")
-            socket.error("SYN-ACK packet is not received")
+            decompressor = lzma.LZMADecompressor(lzma.FORMAT_RAW, filters=lzma_filters)
+        data = decompressor.decompress(payload, max_size)
+    except (zlib.error, lzma.LZMAError) as e:
+        raise ValueError(str(e))
+    if not decompressor.eof:
+        raise ValueError(f"the payload is cut or larger than {max_size} bytes")
+    return data
 
-        # Send ACK packet
-        ack_num += 1
-        packet = send_packet(seq_num, ack_num, set_flags(0, 1, 0, 0))
-        client_socket.send(packet)
-        print("ACK packet is sent")
-        print_header(packet[:6], True)
+"""
+Description:
+    Class to compress the payloads of a file or a session ahead of the sliding window, in a thread
+    A compressed payload holds as much of the stream as fits into one packet after compression, so the file is sent in fewer packets,
+    and the packet is sent with the COMPRESSED flag. Data that does not compress is sent in payloads as the reader would send it
+    # NOTE: A sample at the start of every compress_skip bytes is compressed first, and the data after a sample that does not compress,
+    # such as a JPEG, is sent without compressing it. A packet that does not compress below its size stops the compression as well
+    # NOTE: The payloads are read once and in order, the sender keeps them in the sliding window for retransmission
+Parameters:
+    reader: FileReader - The reader of the file or the session, with encoded_filename, filesize and read_stream(start, end)
+    method: str - The compression method, a key of compression_methods
+    max_size: int - The largest part of the stream in a compressed payload, accepted by the server
+"""
+class CompressedReader:
+    """
+    Description:
+        Start the thread that compresses the payloads
+    Parameters:
+        See the class description
+    Return:
+        None
+    """
+    def __init__(self, reader, method, max_size=compress_block):
+        self.reader = reader
+        self.method = method
+        self.max_size = max_size
+        self.payload_size = reader.payload_size
+        self.encoded_filename = reader.encoded_filename
+        self.filesize = reader.filesize
+        self.size = max_filename_length + reader.filesize   # The filename field and the data, as in the payloads of the reader
 
-        # Connection established
-        print("Connection established\n")
+        # total_packets is one more than the payloads made so far, until the last payload is made
+        # NOTE: It is set before a payload is queued, so the sender never sees all the packets acknowledged before the last one
+        self.total_packets = 1
+        self.compressed = {}    # Sizes before compression of the compressed payloads that are not acknowledged, format: {seq_num: size}
+        self.sent_bytes = 0     # Bytes of the payloads made so far
+        self.compressed_packets = 0
+        self.queue = queue.Queue(compress_ahead)
+        self.stopped = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
 
-        # Send file
-        filesize = os.path.getsize(filename)
-        print("Data Transfer:\n")
+    """
+    Description:
+        Function to read a part of the filename field and the data
+    Parameters:
+        start: int - The offset, the data starts at max_filename_length
+        end: int - The end of the part
+    Return:
+        data: bytes - The part
+    """
+    def read_stream(self, start, end):
+        data = self.reader.read_stream(max(start - max_filename_length, 0), max(end - max_filename_length, 0))
+        if start < max_filename_length:
+            data = self.encoded_filename[start:end] + data
+        return data
 
-        if debug:
-            filesize = os.path.getsize(filename)
-            print(f"Filesize: {filesize}")
+    """
+    Description:
+        Function to check if a sample of the data at an offset compresses
+    Parameters:
+        position: int - The offset of the sample
+    Return:
+        compressible: bool - True if the sample compresses at least compress_min_ratio times with fast zlib
+    """
+    def compressible(self, position):
+        sample = self.read_stream(position, min(position + compress_sample, self.size))
+        return len(sample) >= compress_min_ratio * len(zlib.compress(sample, 1))
 
-        # Pack the file without the header
-        payload = pack_file(filename)
+    """
+    Description:
+        Function to compress the largest part of the data at an offset that fits into one payload
+        # NOTE: The size is guessed from the last compressed payload and made smaller until the payload fits
+    Parameters:
+        position: int - The offset of the data
+        guess: int - The size of the data that is expected to fit
+    Return:
+        payload: bytes - The compressed payload, None if the data does not compress below the payload size
+        length: int - The size of the data in the payload
+    """
+    def compress_packet(self, position, guess):
+        length = min(guess, self.max_size, self.size - position)
+        data = self.read_stream(position, position + length)
+        while length > self.payload_size:
+            payload = compress_payload(self.method, data[:length])
+            if len(payload) <= self.payload_size:
+                return payload, length
+            length = length * self.payload_size // len(payload) * 15 // 16
+        return None, 0
 
-        # Send the packets with GBN
-        client_socket.settimeout(timeout)
+    """
+    Description:
+        Function run by the thread to make the payloads in order and queue them for the sender
+    Parameters:
+        None
+    Return:
+        None
+    """
+    def run(self):
+        position = 0
+        seq_num = 1
+        sampled_until = 0   # The data before this offset is sampled
+        raw_until = 0       # The data before this offset is sent without compressing it
+        guess = self.max_size
+        try:
+            while position < self.size:
+                # Sample the data at the start of each compress_skip bytes
+                if position >= sampled_until:
+                    sampled_until = position + compress_skip
+                    if not self.compressible(position):
+                        raw_until = sampled_until
 
-        # Set variables
-        seq_num = 0
-        slidding_window = []
-        exspected_ack = 2
+                payload = None
+                if position >= raw_until:
+                    payload, length = self.compress_packet(position, guess)
+                    if payload is None:
+                        raw_until = sampled_until = position + compress_skip
+                if payload is None:
+                    length = min(self.payload_size, self.size - position)
+                    payload = self.read_stream(position, position + length)
+                else:
+                    self.compressed[seq_num] = length
+                    self.compressed_packets += 1
+                    guess = max(self.payload_size + 1, length * self.payload_size // len(payload) * 15 // 16)
 
-        while True:
-            # Send the packets
-            while(len(slidding_window) < window_size and seq_num < len(payload)):
+                position += length
+                self.sent_bytes += len(payload)
+                self.total_packets = seq_num + 1
+                if not self.put(payload):
+                    return
                 seq_num += 1
-                slidding_window.append(seq_num)
-                if seq_num > len(payload):
-                    break
-                packet = send_packet(seq_num, ack_num, set_flags(0, 0, 0, 0), payload[seq_num - 1])
-                client_socket.send(packet)
-                print(f"{datetime.datetime.now().strftime('%H:%M:%S.%f')} -- packet with seq = {seq_num} is sent, sliding window = {slidding_window}")
-                print_header(packet[:6], True)
 
-            # Receive the ACKs
+            # The empty payload marks the end of the file, total_packets is already its sequence number
+            self.put(b'')
+        except OSError as e:
+            self.put(e)
+
+    """
+    Description:
+        Function to queue a payload for the sender, waits while compress_ahead payloads are queued
+    Parameters:
+        payload: bytes - The payload, or the error that stopped the thread
+    Return:
+        queued: bool - False if the reader is closed
+    """
+    def put(self, payload):
+        while not self.stopped:
             try:
-                packet = client_socket.recv(DRTP_struct.size)
-                _, check_ack_num, flags = unpack_header(packet)
-                if check_ack_num == exspected_ack:
-                    slidding_window.pop(0)
-                    exspected_ack += 1
-                    print(f"{datetime.datetime.now().strftime('%H:%M:%S.%f')} -- ACK for packet = {check_ack_num - 1} is received")
-                    print_header(packet[:6], False)
-                else:
-                    while check_ack_num != exspected_ack:
-                        slidding_window.pop(0)
-                        print(f"{datetime.datetime.now().strftime('%H:%M:%S.%f')} -- Did not receive ACK for packet = {exspected_ack - 1}, skipping to {check_ack_num - 1}")
-                        exspected_ack += 1
-                    print_header(packet[:6], False)
+                self.queue.put(payload, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
 
-            # Resend window on timeout
-            except socket.timeout:
-                print(f"{datetime.datetime.now().strftime('%H:%M:%S.%f')} -- RTO occured")
-                for seq_num in slidding_window:
-                    if seq_num > len(payload):
-                        break
-                    packet = send_packet(seq_num, ack_num, set_flags(0, 0, 0, 0), payload[seq_num - 1])
-                    client_socket.send(packet)
-                    print(f"{datetime.datetime.now().strftime('%H:%M:%S.%f')} -- retransmitting packet with seq = {seq_num}")
-            
-            # Send FIN packet after sending all the packets
-            if len(slidding_window) == 0 and seq_num == len(payload):
-                packet = send_packet(check_ack_num, ack_num, set_flags(0, 0, 1, 0))
-                client_socket.send(packet)
-                print("\nDATA Finished\n\nConnection Teardown:\n\nFIN packet is sent")
-                print_header(packet[:6], True)
+    """
+    Description:
+        Function to get the next payload, the payloads must be read in order
+    Parameters:
+        seq_num: int - The sequence number of the packet, starting at 1
+    Return:
+        payload: bytes - The payload of the packet without the header # empty for the last packet
+    """
+    def read(self, seq_num):
+        payload = self.queue.get()
+        if isinstance(payload, OSError):
+            raise payload
+        if show_packets and seq_num <= 2:
+            log(f"Packet {seq_num}: {payload}")
+        return payload
 
-                # Receive FIN-ACK packet
-                packet = client_socket.recv(DRTP_struct.size)
-                _, check_ack_num, flags = unpack_header(packet)
-                if flags[2] == 1 and flags[1] == 1:
-                    print("FIN-ACK packet is received\nConnection Closes")
-                    print_header(packet[:6], False)
-                    client_socket.close()
-                    break
-                else:
-                    print("FIN-ACK packet is not received")
-                    print_header(packet[:6], False)
-                    socket.error("FIN-ACK packet is not received")
-                
-    # Exit on keyboard interrupt
-    except KeyboardInterrupt:
-        print("Client is stopped")
+    """
+    Description:
+        Function to stop the thread and close the reader
+    Parameters:
+        None
+    Return:
+        None - Print how much the data is compressed
+    """
+    def close(self):
+        self.stopped = True
+        self.thread.join()
+        self.reader.close()
+        if logger.events and self.sent_bytes:
+            log(f"{self.size} bytes are sent as {self.sent_bytes} bytes with {self.method} ({self.size / self.sent_bytes:.2f}x), "
+                f"{self.compressed_packets} of {self.total_packets} packets are compressed")
 
-    # Handle socket errors
-    except socket.error as e:
-        print(f"Error: {e}")
\ No newline at end of file
+"""
+Description:
+    Class to keep the progress of a received file on disk, so a client that sends the same file again only sends the rest
+    The checkpoint is a small JSON file in checkpoint_directory, named after the identity of the file sent by the client,
+    with the output file and how much of it is written in order
+    # NOTE: The checkpoint is saved after the data it counts is written, so the output file holds at least as much as it says
+Parameters:
+    identity: tuple - The identity of the file from the resume option, format: (size, mtime in nanoseconds, hash)
+"""
+class Checkpoint:
+    """
+    Description:
+        Find the file of the checkpoint, nothing is read or written yet
+    Parameters:
+        identity: tuple - The identity of the file
+    Return:
+        None
+    """
+    def __init__(self, identity):
+        self.size, self.mtime, self.hash = identity
+        self.file = os.path.join(checkpoint_directory, f"{self.size}-{self.mtime}-{self.hash.hex()}.json")
+        self.path = None    # The output file, None until the writer opens it
+        self.offset = 0     # Bytes of the file written in order
+
+    """
+    Description:
+        Function to read the checkpoint of an earlier transfer of the file
+    Parameters:
+        None
+    Return:
+        found: bool - True if the output file is still there with the data of the checkpoint
+    """
+    def load(self):
+        try:
+            with open(self.file) as file:
+                saved = json.load(file)
+            path, offset = saved["path"], saved["offset"]
+        except (OSError, ValueError, KeyError):
+            return False
+        if not (0 < offset <= self.size and os.path.isfile(path) and os.path.getsize(path) >= offset):
+            return False
+        self.path, self.offset = path, offset
+        return True
+
+    """
+    Description:
+        Function to save how much of the file is written, the checkpoint is replaced at once so a crash never leaves half of it
+    Parameters:
+        offset: int - Bytes of the file written in order
+    Return:
+        None
+    """
+    def save(self, offset):
+        self.offset = offset
+        os.makedirs(checkpoint_directory, exist_ok=True)
+        with open(self.file + ".tmp", "w") as file:
+            json.dump({"path": self.path, "offset": offset, "size": self.size, "mtime_ns": self.mtime, "hash": self.hash.hex()}, file)
+        os.replace(self.file + ".tmp", self.file)
+
+    """
+    Description:
+        Function to remove the checkpoint when the file is complete
+    Parameters:
+        None
+    Return:
+        None
+    """
+    def remove(self):
+        try:
+            os.remove(self.file)
+        except FileNotFoundError:
+            pass
+
+"""
+Description:
+    Function to remove the checkpoints of an output file that is written again from the start, they do not match it any more
+Parameters:
+    path: str - The output file
+Return:
+    None
+"""
+def discard_checkpoints(path):
+    try:
+        names = os.listdir(checkpoint_directory)
+    except FileNotFoundError:
+        return
+    for name in names:
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(checkpoint_directory, name)) as file:
+                if json.load(file).get("path") == path:
+                    os.remove(os.path.join(checkpoint_directory, name))
+        except (OSError, ValueError):
+            pass
+
+"""
+Description:
+    Class to write a received file to the output directory while the transfer is running
+    The payloads are handed over in the receive buffers they arrived in, and a background thread writes them to disk
+    # NOTE: A buffer is put back in free_buffers when it is written, so the server can reuse it for the next packet
+Parameters:
+    first_payload: memoryview - The payload of the first packet, starting with the filename
+    buffer: bytearray - The receive buffer holding the first payload
+    free_buffers: queue.Queue - The queue to return the receive buffers to, None if the payloads are not in receive buffers
+    flush: str - "buffered" to leave the data to the OS, "fsync" to sync the file to disk at FIN
+    log: function - The function to print messages with
+    file_range: tuple - The part of the file that is received, format: (offset, length, size of the whole file), None for the whole file
+    checkpoint: Checkpoint - The checkpoint saved while the file is written, None for no checkpoint
+"""
+class FileWriter:
+    """
+    Description:
+        Parse the filename from the first payload, open the output file and start the writer thread
+    Parameters:
+        first_payload: memoryview - The payload of the first packet, starting with the filename
+        buffer: bytearray - The receive buffer holding the first payload
+        free_buffers: queue.Queue - The queue to return the receive buffers to
+        flush: str - The flush mode, "buffered" or "fsync"
+        log: function - The function to print messages with
+        file_range: tuple - The part of the file that is received, None for the whole file
+        checkpoint: Checkpoint - The checkpoint of the file, a loaded checkpoint resumes its output file at file_range
+    Return:
+        None
+    """
+    def __init__(self, first_payload, buffer, free_buffers, flush, log=log, file_range=None, checkpoint=None):
+        # Get the filename
+        filename = bytes(first_payload[:max_filename_length]).decode().strip('\0')
+        self.log = log
+        self.log(f"Filename: {filename}")
+
+        # A resumed file is written to the output file of its checkpoint, the checkpoints of a file written from the start are removed
+        resumed = checkpoint is not None and checkpoint.path is not None
+        self.filename = checkpoint.path if resumed else output_path(filename)
+        if not resumed:
+            discard_checkpoints(self.filename)
+            if checkpoint is not None:
+                checkpoint.path = self.filename
+        self.checkpoint = checkpoint
+        self.flush = flush
+        self.free_buffers = free_buffers
+        self.error = None
+        self.allocated = None   # Size the file is allocated to before it is written, None if it is not allocated
+
+        # Create directory if it doesn't exist
+        os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+
+        # The payloads are written with positional writes from the offset of the part
+        # NOTE: The parts of a striped file are written by different connections,
+        # so the file is set to the size of the whole file instead of being truncated
+        if file_range is None:
+            self.fd = os.open(self.filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            self.offset = 0
+        else:
+            self.fd = os.open(self.filename, os.O_WRONLY | os.O_CREAT, 0o644)
+            self.offset = file_range[0]
+            os.ftruncate(self.fd, file_range[2])
+        self.start_writer(first_payload, buffer)
+
+    """
+    Description:
+        Function to allocate the blocks of the whole file before it is written, so the writes do not grow the file
+        # NOTE: The file is cut back to the written data when it is closed, so a file that is not finished keeps its size
+    Parameters:
+        size: int - The size of the file, from the SYN packet
+    Return:
+        None
+    """
+    def preallocate(self, size):
+        try:
+            if size > self.offset:
+                os.posix_fallocate(self.fd, self.offset, size - self.offset)
+                self.allocated = size
+        except (AttributeError, OSError):
+            pass
+
+    """
+    Description:
+        Function to start the writer thread and queue the data of the first payload
+    Parameters:
+        first_payload: memoryview - The payload of the first packet, starting with the filename
+        buffer: bytearray - The receive buffer holding the first payload
+    Return:
+        None
+    """
+    def start_writer(self, first_payload, buffer):
+        self.queue = queue.Queue()
+        self.pending = []
+        self.batch_size = max(1, min(write_batch, receive_buffers // 2)) # Leave free buffers for the server while a batch is filled
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        self.write(first_payload[max_filename_length:], buffer)
+
+    """
+    Description:
+        Function to queue a payload to be written to the file, the payloads are handed to the writer thread in batches
+    Parameters:
+        payload: memoryview - The payload to write
+        buffer: bytearray - The receive buffer holding the payload, returned to free_buffers when written
+    Return:
+        None
+    """
+    def write(self, payload, buffer):
+        self.pending.append((payload, buffer))
+        if len(self.pending) >= self.batch_size:
+            self.queue.put(self.pending)
+            self.pending = []
+
+    """
+    Description:
+        Function to get the number of payloads that are not written yet, each of them holds a receive buffer
+    Parameters:
+        None
+    Return:
+        backlog: int - The payloads queued for the writer thread, about a batch for each queued batch
+    """
+    def backlog(self):
+        return self.queue.qsize() * self.batch_size + len(self.pending)
+
+    """
+    Description:
+        Function run by the writer thread to write the queued payloads to the file
+    Parameters:
+        None
+    Return:
+        None
+    """
+    def run(self):
+        while True:
+            batch = self.queue.get()
+            if batch is None:
+                break
+            try:
+                if self.error is None:
+                    self.write_all([payload for payload, _ in batch if len(payload)])
+                    # NOTE: The checkpoint is read once, release may take it from another thread
+                    checkpoint = self.checkpoint
+                    if checkpoint is not None and self.offset - checkpoint.offset >= checkpoint_interval:
+                        self.save_checkpoint(checkpoint)
+            except OSError as e:
+                self.error = e
+            finally:
+                for payload, buffer in batch:
+                    payload.release()
+                    if buffer is not None:
+                        self.free_buffers.put(buffer)
+
+    """
+    Description:
+        Function to write the payloads of a batch at the current offset with one system call
+    Parameters:
+        payloads: list - The payloads to write, in order
+    Return:
+        None
+    """
+    def write_all(self, payloads):
+        while payloads:
+            written = os.pwritev(self.fd, payloads, self.offset)
+            self.offset += written
+            # Drop the payloads that are written, and the written part of a payload that is not
+            while payloads and written >= len(payloads[0]):
+                written -= len(payloads.pop(0))
+            if payloads and written:
+                payloads[0] = payloads[0][written:]
+
+    """
+    Description:
+        Function to save the checkpoint with the data written so far, the data is synced first in fsync mode
+    Parameters:
+        checkpoint: Checkpoint - The checkpoint of the file
+    Return:
+        None
+    """
+    def save_checkpoint(self, checkpoint):
+        if self.flush == "fsync":
+            os.fsync(self.fd)
+        checkpoint.save(self.offset)
+
+    """
+    Description:
+        Function to give up the output file to a connection that resumes it, the checkpoint is not saved any more
+        # NOTE: The file is not cut back when it is closed, the other connection has set it to the size of the whole file
+    Parameters:
+        None
+    Return:
+        None
+    """
+    def release(self):
+        self.checkpoint = None
+        self.allocated = None
+
+    """
+    Description:
+        Function to wait for the writer thread to write the queued payloads
+    Parameters:
+        None
+    Return:
+        None
+    """
+    def stop_writer(self):
+        if self.pending:
+            self.queue.put(self.pending)
+        self.queue.put(None)
+        self.thread.join()
+
+    """
+    Description:
+        Function to wait for the queued payloads to be written and close the file
+    Parameters:
+        None
+    Return:
+        None - Print where the file is written
+    """
+    def close(self):
+        self.stop_writer()
+        try:
+            if self.allocated is not None and self.offset < self.allocated:
+                os.ftruncate(self.fd, self.offset)
+            if self.flush == "fsync":
+                os.fsync(self.fd)
+            os.close(self.fd)
+        except OSError as e:
+            self.error = self.error or e
+
+        if self.error is not None:
+            self.log(f"Error: {self.error}", SUMMARY)
+        else:
+            self.log(f"File is written to {self.filename}", SUMMARY)
+
+        # Print the size of the file
+        if logger.packets:
+            self.log(f"size of {self.filename}: {os.path.getsize(self.filename)}", DEBUG)
+
+"""
+Description:
+    Class to write the files of a session to the output directory, the payloads are parsed as the stream of records of a SessionReader
+    # NOTE: A record can be split over several payloads, the header of a record is collected until it is complete
+Parameters:
+    The same as FileWriter, file_range and checkpoint are not used
+"""
+class SessionWriter(FileWriter):
+    """
+    Description:
+        Start the writer thread, the files are opened when their records arrive
+    Parameters:
+        first_payload: memoryview - The payload of the first packet, starting with an empty filename field
+        buffer: bytearray - The receive buffer holding the first payload
+        free_buffers: queue.Queue - The queue to return the receive buffers to
+        flush: str - The flush mode, "buffered" or "fsync"
+        log: function - The function to print messages with
+        file_range: tuple - Not used
+        checkpoint: Checkpoint - Not used, a session is not resumed
+    Return:
+        None
+    """
+    def __init__(self, first_payload, buffer, free_buffers, flush, log=log, file_range=None, checkpoint=None):
+        self.log = log
+        self.checkpoint = None
+        self.flush = flush
+        self.free_buffers = free_buffers
+        self.error = None
+        self.filename = "output"
+        self.header = bytearray()   # The header of the next record, until it is complete
+        self.fd = None      # The file of the current record, None between records
+        self.remaining = 0  # Bytes of the current file that are not received yet
+        self.files = 0      # Files that are written
+        self.start_writer(first_payload, buffer)
+
+    """
+    Description:
+        Function to write the payloads of a batch, the records in them are written to their files
+    Parameters:
+        payloads: list - The payloads to write, in order
+    Return:
+        None
+    """
+    def write_all(self, payloads):
+        for payload in payloads:
+            view = memoryview(payload)
+            while len(view):
+                # Collect the header of the next record and open its file
+                if self.fd is None:
+                    needed = session_record_struct.size
+                    if len(self.header) >= needed:
+                        name_length = session_record_struct.unpack_from(self.header)[0]
+                        # NOTE: A record without a name would never be opened, and its header would be waited for forever
+                        if name_length == 0:
+                            self.header = bytearray()
+                            raise OSError("a record of the session has no name")
+                        needed += name_length
+                    taken = min(needed - len(self.header), len(view))
+                    self.header += view[:taken]
+                    view = view[taken:]
+                    if len(self.header) == needed and needed > session_record_struct.size:
+                        self.open_record()
+                    continue
+
+                # Write the data of the current file
+                written = os.write(self.fd, view[:self.remaining])
+                self.remaining -= written
+                view = view[written:]
+                if self.remaining == 0:
+                    self.close_record()
+
+    """
+    Description:
+        Function to open the file of a record when its header is complete
+    Parameters:
+        None
+    Return:
+        None
+    """
+    def open_record(self):
+        name_length, self.remaining = session_record_struct.unpack_from(self.header)
+        self.path = output_path(bytes(self.header[session_record_struct.size:]).decode())
+        self.header = bytearray()
+        discard_checkpoints(self.path)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        if self.remaining == 0:
+            self.close_record()
+
+    """
+    Description:
+        Function to close the file of a record when all its data is written
+    Parameters:
+        None
+    Return:
+        None
+    """
+    def close_record(self):
+        if self.flush == "fsync":
+            os.fsync(self.fd)
+        os.close(self.fd)
+        self.fd = None
+        self.files += 1
+        if logger.events:
+            self.log(f"File is written to {self.path}")
+
+    """
+    Description:
+        Function to wait for the queued payloads to be written, the session must end after a whole record
+    Parameters:
+        None
+    Return:
+        None - Print how many files are written
+    """
+    def close(self):
+        self.stop_writer()
+        if self.fd is not None or self.header:
+            if self.fd is not None:
+                os.close(self.fd)
+            self.error = self.error or OSError("the session ended in the middle of a file")
+
+        if self.error is not None:
+            self.log(f"Error: {self.error}", SUMMARY)
+        else:
+            self.log(f"{self.files} files are written to {self.filename}", SUMMARY)
+
+"""
+Description:
+    Class to rebuild a file in the output directory from a delta against the copy that is there, the payloads are parsed as the
+    instructions of a DeltaReader. The new file is written next to the copy and replaces it when its size and hash are right
+    # NOTE: An instruction can be split over several payloads, the instruction is collected until it is complete as the header of a record
+Parameters:
+    The same as FileWriter, file_range and checkpoint are not used
+"""
+class DeltaWriter(FileWriter):
+    """
+    Description:
+        Open the copy and the new file and start the writer thread
+    Parameters:
+        first_payload: memoryview - The payload of the first packet, starting with the filename
+        buffer: bytearray - The receive buffer holding the first payload
+        free_buffers: queue.Queue - The queue to return the receive buffers to
+        flush: str - The flush mode, "buffered" or "fsync"
+        log: function - The function to print messages with
+        file_range: tuple - Not used
+        checkpoint: Checkpoint - Not used, a delta is not resumed
+    Return:
+        None
+    """
+    def __init__(self, first_payload, buffer, free_buffers, flush, log=log, file_range=None, checkpoint=None):
+        filename = bytes(first_payload[:max_filename_length]).decode().strip('\0')
+        self.log = log
+        self.log(f"Filename: {filename}, rebuilt from a delta")
+        self.filename = output_path(filename)
+        self.checkpoint = None
+        self.flush = flush
+        self.free_buffers = free_buffers
+        self.error = None
+        self.header = bytearray()   # The next instruction, until it is complete
+        self.remaining = 0  # Bytes of the current literal that are not received yet
+        self.offset = 0     # Bytes of the new file that are written
+        self.copied = 0     # Bytes of the new file that are copied from the old one
+        self.end = None     # The size and hash of the new file from the end instruction, None until it is received
+        self.digest = hashlib.blake2b(digest_size=delta_hash_size)
+        self.basis = os.open(self.filename, os.O_RDONLY)
+        self.fd = os.open(self.filename + ".delta", os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        self.start_writer(first_payload, buffer)
+
+    """
+    Description:
+        Function to write the payloads of a batch, the literals are written and the copies are read from the old file
+    Parameters:
+        payloads: list - The payloads to write, in order
+    Return:
+        None
+    """
+    def write_all(self, payloads):
+        for payload in payloads:
+            view = memoryview(payload)
+            while len(view):
+                # Write the data of the current literal
+                if self.remaining:
+                    data = view[:self.remaining]
+                    self.write_data(data)
+                    self.remaining -= len(data)
+                    view = view[len(data):]
+                    continue
+
+                # Collect the next instruction, the end instruction is followed by the hash
+                needed = delta_instruction_struct.size
+                if len(self.header) >= needed and self.header[0] == delta_end:
+                    needed += delta_hash_size
+                taken = min(needed - len(self.header), len(view))
+                self.header += view[:taken]
+                view = view[taken:]
+                if len(self.header) == needed and (self.header[0] != delta_end or needed > delta_instruction_struct.size):
+                    self.instruction()
+
+    """
+    Description:
+        Function to carry out an instruction when it is complete
+    Parameters:
+        None
+    Return:
+        None
+    """
+    def instruction(self):
+        kind, offset, length = delta_instruction_struct.unpack_from(self.header)
+        if self.end is not None:
+            raise OSError("the delta has data after its end")
+        if kind == delta_copy:
+            while length:
+                data = os.pread(self.basis, min(length, compress_block), offset)
+                if not data:
+                    raise OSError(f"the delta copies more than the size of {self.filename}")
+                self.write_data(data)
+                self.copied += len(data)
+                offset += len(data)
+                length -= len(data)
+        elif kind == delta_literal:
+            self.remaining = length
+        elif kind == delta_end:
+            self.end = (offset, bytes(self.header[delta_instruction_struct.size:]))
+        else:
+            raise OSError(f"unknown instruction {kind} in the delta")
+        self.header = bytearray()
+
+    """
+    Description:
+        Function to write data at the end of the new file
+    Parameters:
+        data: bytes - The data
+    Return:
+        None
+    """
+    def write_data(self, data):
+        view = memoryview(data)
+        self.digest.update(view)
+        while len(view):
+            written = os.write(self.fd, view)
+            view = view[written:]
+        self.offset += len(data)
+
+    """
+    Description:
+        Function to wait for the queued payloads to be written and replace the old file with the new one if it is complete
+    Parameters:
+        None
+    Return:
+        None - Print where the file is written and how much of it is copied
+    """
+    def close(self):
+        self.stop_writer()
+        if self.error is None and (self.end is None or self.remaining or self.header):
+            self.error = OSError("the delta ended in the middle")
+        elif self.error is None and self.end != (self.offset, self.digest.digest()):
+            self.error = OSError("the rebuilt file does not match the file of the client")
+        try:
+            if self.error is None and self.flush == "fsync":
+                os.fsync(self.fd)
+            os.close(self.fd)
+            os.close(self.basis)
+            if self.error is None:
+                os.replace(self.filename + ".delta", self.filename)
+                discard_checkpoints(self.filename)
+            else:
+                os.remove(self.filename + ".delta")
+        except OSError as e:
+            self.error = self.error or e
+
+        if self.error is not None:
+            self.log(f"Error: {self.error}, {self.filename} is not changed", SUMMARY)
+        else:
+            self.log(f"File is written to {self.filename}, {self.copied} of {self.offset} bytes are copied from the old file", SUMMARY)
+
+"""
+Description:
+    Send a packet with the given sequence number, acknowledgment number, flags, and optional payload
+Parameters:
+    seq_num: int - The sequence number of the packet
+    ack_num: int - The acknowledgment number of the packet
+    flags: int - The flags of the packet
+    payload: bytes - The payload of the packet (optional)
+    header_struct: struct.Struct - The header format of the connection
+Return:
+    packet: bytes - The packet to send
+"""
+def send_packet(seq_num, ack_num, flags, payload=None, header_struct=DRTP_struct):
+    if not payload:
+        packet = pack_header(seq_num, ack_num, flags, header_struct)
+    else:
+        packet = pack_header(seq_num, ack_num, flags, header_struct) + payload
+    return packet
+
+# UDP generic segmentation offload, the kernel splits one send into several packets of the same size
+# NOTE: The socket module does not define the option, this is its value on Linux
+UDP_SEGMENT = getattr(socket, "UDP_SEGMENT", 103)
+max_segments = 64       # Largest number of packets in one segmented send
+max_datagram = 65507    # Largest UDP payload over IPv4
+segmentation_errors = {errno.EINVAL, errno.EIO, errno.ENOPROTOOPT, errno.EOPNOTSUPP} # Errors of a send the kernel can not segment
+
+"""
+Description:
+    Class to send the packets of a connection without building each packet in a new bytes object
+    # NOTE: The headers are packed into preallocated buffers and sent together with the payloads with sendmsg,
+    # so the payloads are not copied before they are handed to the kernel.
+    # A batch of packets of the same size is sent with one system call with UDP_SEGMENT where the kernel supports it
+Parameters:
+    sock: socket.socket - The connected socket to send with
+    header_struct: struct.Struct - The header format of the connection
+"""
+class PacketSender:
+    """
+    Description:
+        Function to initialize the sender
+    Parameters:
+        sock: socket.socket - The connected socket to send with
+        header_struct: struct.Struct - The header format of the connection
+    Return:
+        None
+    """
+    def __init__(self, sock, header_struct=DRTP_struct):
+        self.socket = sock
+        self.header_struct = header_struct
+        self.header = bytearray(header_struct.size)
+        self.headers = [bytearray(header_struct.size) for _ in range(socket_batch)]
+        self.segmentation = hasattr(socket, "SOL_UDP") # Turned off if the kernel refuses a segmented send
+
+    """
+    Description:
+        Function to send a packet, the header buffer is reused by the next packet
+    Parameters:
+        seq_num: int - The sequence number of the packet
+        ack_num: int - The acknowledgment number of the packet
+        flags: int - The flags of the packet
+        payload: bytes - The payload of the packet (optional)
+    Return:
+        header: bytearray - The header of the sent packet
+    """
+    def send(self, seq_num, ack_num, flags, payload=None):
+        self.header_struct.pack_into(self.header, 0, seq_num, ack_num, flags)
+        if payload:
+            self.socket.sendmsg([self.header, payload])
+        else:
+            self.socket.send(self.header)
+        return self.header
+
+    """
+    Description:
+        Function to send a batch of packets, the packets of the same size are sent together
+    Parameters:
+        ack_num: int - The acknowledgment number of the packets
+        flags: int - The flags of the packets
+        packets: list - The packets to send, at most socket_batch, format: [(seq_num, payload)]
+        compressed: dict - The packets with compressed payloads, they are sent with the COMPRESSED flag as well, None for none
+    Return:
+        headers: list - The headers of the sent packets, reused by the next batch
+    """
+    def send_batch(self, ack_num, flags, packets, compressed=None):
+        compressed = compressed or {}
+        headers = self.headers[:len(packets)]
+        compressed_flags = flags | set_flags(0, 0, 0, 0, compressed=1)
+        for header, (seq_num, _) in zip(headers, packets):
+            self.header_struct.pack_into(header, 0, seq_num, ack_num, compressed_flags if seq_num in compressed else flags)
+
+        index = 0
+        while index < len(packets):
+            # Group the packets of the same size, the last packet of a group may be smaller
+            size = self.header_struct.size + len(packets[index][1])
+            end = index + 1
+            while (self.segmentation and end < len(packets) and end - index < max_segments
+                   and (end - index + 1) * size <= max_datagram):
+                end_size = self.header_struct.size + len(packets[end][1])
+                if end_size > size:
+                    break
+                end += 1
+                if end_size < size:
+                    break
+
+            buffers = []
+            for header, (_, payload) in zip(headers[index:end], packets[index:end]):
+                buffers.append(header)
+                if payload:
+                    buffers.append(payload)
+            if end - index == 1:
+                self.socket.sendmsg(buffers)
+            else:
+                try:
+                    self.socket.sendmsg(buffers, [(socket.SOL_UDP, UDP_SEGMENT, struct.pack("=H", size))])
+                except OSError as e:
+                    # Send the packets one at a time from now on if the kernel or the device does not segment, other errors are raised
+                    if e.errno not in segmentation_errors:
+                        raise
+                    self.segmentation = False
+                    continue
+            index = end
+        return headers
+
+"""
+Description:
+    Function to wait until a packet can be read from a socket
+    # NOTE: The socket must be blocking without a timeout, a socket with a timeout waits for the timeout even with MSG_DONTWAIT,
+    # so the timeout is handled here and the packets are read with MSG_DONTWAIT
+Parameters:
+    sock: socket.socket - The socket to wait on
+    timeout: float - Seconds to wait, None to wait forever
+Return:
+    None - Raises socket.timeout if no packet arrives in time
+"""
+def wait_readable(sock, timeout):
+    if not select.select([sock], [], [], timeout)[0]:
+        raise socket.timeout("timed out")
+
+"""
+Description:
+    Function to wait for a packet and read it with the packets that arrived with it
+Parameters:
+    sock: socket.socket - The socket to read from, blocking without a timeout
+    limit: int - The largest number of packets to read
+    size: int - The largest packet size
+    timeout: float - Seconds to wait for the first packet, None to wait forever
+Return:
+    packets: list - The packets that were waiting, at least one
+"""
+def receive_waiting(sock, limit, size, timeout):
+    wait_readable(sock, timeout)
+    packets = []
+    while len(packets) < limit:
+        try:
+            packets.append(sock.recv(size, socket.MSG_DONTWAIT))
+        except BlockingIOError:
+            break
+    return packets
+
+"""
+Description:
+    Class to estimate the retransmission timeout from measured round trip times (RFC 6298)
+    # NOTE: Only packets that are not retransmitted should be sampled (Karn's rule), since the ACK of a
+    # retransmitted packet can not be matched to the transmission it acknowledges
+Parameters:
+    None
+"""
+class RTTEstimator:
+    """
+    Description:
+        Start with the configured timeout until the first round trip time is measured
+    Parameters:
+        None
+    Return:
+        None
+    """
+    def __init__(self):
+        self.srtt = None    # Smoothed round trip time
+        self.rttvar = None  # Round trip time variation
+        self.rto = timeout  # Retransmission timeout without backoff
+        self.backoff = 1    # Multiplier doubled on every timeout
+        self.ack_delay = 0  # Longest time the receiver delays an ACK, added to the timeout
+
+    """
+    Description:
+        Function to update the estimate with a measured round trip time
+    Parameters:
+        rtt: float - The measured round trip time in seconds
+    Return:
+        None
+    """
+    def sample(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - rtt_beta) * self.rttvar + rtt_beta * abs(self.srtt - rtt)
+            self.srtt = (1 - rtt_alpha) * self.srtt + rtt_alpha * rtt
+        # NOTE: The variation is at least min_rto, the clock granularity of RFC 6298, so a steady RTT does not time out
+        # the packets whose ACK is delayed by the receiver
+        self.rto = min(self.srtt + max(4 * self.rttvar, min_rto) + self.ack_delay, max_rto)
+        self.backoff = 1
+
+    """
+    Description:
+        Function to double the timeout after a retransmission timeout (exponential backoff)
+    Parameters:
+        None
+    Return:
+        None
+    """
+    def on_timeout(self):
+        if self.rto * self.backoff < max_rto:
+            self.backoff *= 2
+
+    """
+    Description:
+        Function to get the current retransmission timeout
+    Parameters:
+        None
+    Return:
+        timeout: float - The retransmission timeout in seconds, including backoff
+    """
+    def timeout(self):
+        return min(self.rto * self.backoff, max_rto)
+
+    """
+    Description:
+        Function to get how long a sender keeps retrying before it gives up, used as the idle timeout of the receiver
+    Parameters:
+        None
+    Return:
+        give_up_time: float - The sum of max_retries backed off timeouts in seconds
+    """
+    def give_up_time(self):
+        return sum(min(self.rto * 2 ** retry, max_rto) for retry in range(max_retries + 1))
+
+"""
+Description:
+    Class for a fixed congestion window, the base class of the congestion control algorithms
+    The sender calls on_ack, on_loss and on_timeout, and never has more than window() packets in flight
+Parameters:
+    max_window: int - The upper bound of the window in packets, None for no bound
+"""
+class FixedWindow:
+    """
+    Description:
+        Start with a window of max_window packets, or the configured window size if there is no bound
+    Parameters:
+        max_window: int - The upper bound of the window in packets, None for no bound
+    Return:
+        None
+    """
+    def __init__(self, max_window):
+        self.max_window = max_window
+        self.cwnd = max_window or window_size
+
+    """
+    Description:
+        Function to get the number of packets the sender may have in flight
+    Parameters:
+        None
+    Return:
+        window: int - The congestion window in packets, at least 1 and at most max_window
+    """
+    def window(self):
+        if self.max_window is not None:
+            return max(1, min(int(self.cwnd), self.max_window))
+        return max(1, int(self.cwnd))
+
+    """
+    Description:
+        Function called when new packets are acknowledged
+    Parameters:
+        acked: int - The number of newly acknowledged packets
+        rtt: float - The measured round trip time, None if the ACK can not be sampled
+    Return:
+        None
+    """
+    def on_ack(self, acked, rtt):
+        pass
+
+    """
+    Description:
+        Function called when a lost packet is detected without a timeout, e.g. by duplicate ACKs
+    Parameters:
+        None
+    Return:
+        None
+    """
+    def on_loss(self):
+        pass
+
+    """
+    Description:
+        Function called on a retransmission timeout
+    Parameters:
+        None
+    Return:
+        None
+    """
+    def on_timeout(self):
+        pass
+
+"""
+Description:
+    Class for Reno-style congestion control with slow start and additive increase, multiplicative decrease (AIMD)
+Parameters:
+    max_window: int - The upper bound of the window in packets, None for no bound
+"""
+class RenoCongestionControl(FixedWindow):
+    """
+    Description:
+        Start in slow start with the initial window
+    Parameters:
+        max_window: int - The upper bound of the window in packets, None for no bound
+    Return:
+        None
+    """
+    def __init__(self, max_window):
+        super().__init__(max_window)
+        self.cwnd = initial_window
+        self.ssthresh = float("inf")
+
+    """
+    Description:
+        Function to grow the window by one packet per ACK in slow start, and one packet per window after
+    Parameters:
+        acked: int - The number of newly acknowledged packets
+        rtt: float - The measured round trip time, not used
+    Return:
+        None
+    """
+    def on_ack(self, acked, rtt):
+        for _ in range(acked):
+            if self.cwnd < self.ssthresh:
+                self.cwnd += 1
+            else:
+                self.cwnd += 1 / self.cwnd
+        # Do not grow past the bound, it would take long to come down again on loss
+        if self.max_window is not None:
+            self.cwnd = min(self.cwnd, self.max_window)
+
+    """
+    Description:
+        Function to halve the window on loss
+    Parameters:
+        None
+    Return:
+        None
+    """
+    def on_loss(self):
+        self.ssthresh = max(self.window() / 2, 2)
+        self.cwnd = self.ssthresh
+
+    """
+    Description:
+        Function to restart slow start from one packet on timeout
+    Parameters:
+        None
+    Return:
+        None
+    """
+    def on_timeout(self):
+        self.ssthresh = max(self.window() / 2, 2)
+        self.cwnd = 1
+
+"""
+Description:
+    Class for delay-based congestion control in the style of TCP Vegas
+    Once per RTT the expected throughput (cwnd / base RTT) is compared with the actual throughput (cwnd / RTT),
+    the difference is the number of packets queued in the network, which is kept between vegas_alpha and vegas_beta
+Parameters:
+    max_window: int - The upper bound of the window in packets, None for no bound
+"""
+class VegasCongestionControl(RenoCongestionControl):
+    """
+    Description:
+        Start in slow start without any RTT measurements
+    Parameters:
+        max_window: int - The upper bound of the window in packets, None for no bound
+    Return:
+        None
+    """
+    def __init__(self, max_window):
+        super().__init__(max_window)
+        self.base_rtt = float("inf")    # Lowest RTT seen, the RTT without queueing
+        self.min_rtt = float("inf")     # Lowest RTT in the current round
+        self.acked_in_round = 0
+
+    """
+    Description:
+        Function to adjust the window once per round of cwnd ACKs from the queueing delay
+    Parameters:
+        acked: int - The number of newly acknowledged packets
+        rtt: float - The measured round trip time, None if the ACK can not be sampled
+    Return:
+        None
+    """
+    def on_ack(self, acked, rtt):
+        if rtt is not None:
+            self.base_rtt = min(self.base_rtt, rtt)
+            self.min_rtt = min(self.min_rtt, rtt)
+        self.acked_in_round += acked
+        if self.acked_in_round < self.window():
+            return
+
+        # End of the round
+        if self.min_rtt != float("inf"):
+            queued = self.cwnd * (self.min_rtt - self.base_rtt) / self.min_rtt
+            if self.cwnd < self.ssthresh:
+                # Leave slow start when packets start to queue
+                if queued > vegas_gamma:
+                    self.ssthresh = self.cwnd
+                else:
+                    self.cwnd *= 2
+            elif queued < vegas_alpha:
+                self.cwnd += 1
+            elif queued > vegas_beta:
+                self.cwnd = max(self.cwnd - 1, 2)
+        if self.max_window is not None:
+            self.cwnd = min(self.cwnd, self.max_window)
+        self.acked_in_round = 0
+        self.min_rtt = float("inf")
+
+# Congestion control algorithms that can be selected
+congestion_algorithms = {
+    "fixed": FixedWindow,
+    "reno": RenoCongestionControl,
+    "vegas": VegasCongestionControl,
+}
+
+"""
+Description:
+    Function to parse a rate with an optional K, M or G suffix, in bits per second
+Parameters:
+    value: str - The rate, e.g. 10M
+Return:
+    rate: float - The rate in bits per second
+"""
+def parse_rate(value):
+    units = {"K": 1e3, "M": 1e6, "G": 1e9}
+    value = value.strip().upper().removesuffix("BPS").removesuffix("BIT")
+    if value and value[-1] in units:
+        rate = float(value[:-1]) * units[value[-1]]
+    else:
+        rate = float(value)
+    if rate <= 0:
+        raise ValueError("the rate must be positive")
+    return rate
+
+"""
+Description:
+    Class to pace the packets of the sender with a token bucket, so the window is spread over the RTT instead of sent in one burst
+    that overflows the queue of a slow router
+    The bucket fills at the pacing rate, pacing_gain * window / RTT (pacing_slow_start_gain in slow start) and at most the send rate,
+    and a packet is sent when the bucket is not empty, its size is taken from the bucket
+    # NOTE: The packets of pacing_quantum at the rate are sent together, so the sender sleeps about once per quantum
+    # instead of once per packet, as the fq qdisc of Linux does
+Parameters:
+    window_pacing: bool - True to pace at the rate of the window, False to only limit the rate to send_rate
+    send_rate: float - The largest rate in bits per second, None for no limit
+    size: int - The size of the largest packets in bytes, the window is paced as packets of this size
+"""
+class Pacer:
+    """
+    Description:
+        Start with a full bucket, the first packets are sent at once
+    Parameters:
+        See the class description
+    Return:
+        None
+    """
+    def __init__(self, window_pacing=True, send_rate=None, size=packet_size):
+        self.window_pacing = window_pacing
+        self.size = size
+        self.max_rate = send_rate / 8 if send_rate else None   # Bytes per second
+        self.rate = self.max_rate or float("inf")   # Bytes per second of the last refill
+        self.tokens = pacing_burst * size   # Bytes that may be sent now, negative after packets sent outside the pacing
+        self.last = None    # Time of the last refill
+
+    """
+    Description:
+        Function to get the largest number of bytes the bucket holds at a rate
+    Parameters:
+        rate: float - The rate in bytes per second
+    Return:
+        size: float - A quantum at the rate, at least pacing_burst packets
+    """
+    def depth(self, rate):
+        return max(pacing_burst * self.size, rate * pacing_quantum)
+
+    """
+    Description:
+        Function to fill the bucket for the time since the last refill at the current pacing rate
+    Parameters:
+        now: float - The current time
+        window: int - The congestion window in packets
+        srtt: float - The smoothed RTT, None if it is not measured
+        slow_start: bool - True if the window is in slow start
+    Return:
+        None
+    """
+    def refill(self, now, window, srtt, slow_start):
+        rate = float("inf")
+        if self.window_pacing and srtt:
+            rate = (pacing_slow_start_gain if slow_start else pacing_gain) * window * self.size / srtt
+        if self.max_rate is not None:
+            rate = min(rate, self.max_rate)
+        if rate == float("inf"):
+            self.tokens = rate
+        elif self.last is not None:
+            self.tokens = min(self.tokens + (now - self.last) * rate, self.depth(rate))
+        self.rate = rate
+        self.last = now
+
+    """
+    Description:
+        Function to take the bytes of a sent packet from the bucket
+    Parameters:
+        size: int - The bytes of the packet
+    Return:
+        None
+    """
+    def consume(self, size):
+        self.tokens -= size
+
+    """
+    Description:
+        Function to get how long to wait until the next quantum of packets may be sent
+    Parameters:
+        None
+    Return:
+        delay: float - Seconds until the bucket holds a quantum of packets, 0 if a packet may be sent now
+    """
+    def delay(self):
+        if self.tokens > 0:
+            return 0.0
+        return (self.rate * pacing_quantum - self.tokens) / self.rate
+
+"""
+Description:
+    Function to format a throughput for printing
+Parameters:
+    total_data: int - The number of bytes received
+    time_in_seconds: float - The time it took to receive the bytes
+Return:
+    throughput: str - The throughput in bps, Kbps or Mbps
+"""
+def format_throughput(total_data, time_in_seconds):
+    throughput = (total_data / max(time_in_seconds, 1e-9)) * 8
+    if throughput > 1_000_000:
+        return f"{throughput / 1_000_000:.2f} Mbps"
+    elif throughput > 1_000:
+        return f"{throughput / 1_000:.2f} Kbps"
+    return f"{throughput:.2f} bps"
+
+"""
+Description:
+    Class to collect the metrics of one transfer: RTT samples, packet counters, and a timeline of the goodput,
+    the window and the retransmissions in buckets of metrics_interval seconds
+    # NOTE: The lists are only appended to, so a snapshot can be taken from another thread while the transfer runs
+Parameters:
+    role: str - "client" or "server"
+    name: str - The name of the transfer, such as the file and the address of the peer
+"""
+class TransferMetrics:
+    """
+    Description:
+        Function to initialize the metrics before the transfer starts
+    Parameters:
+        role: str - "client" or "server"
+        name: str - The name of the transfer
+    Return:
+        None
+    """
+    def __init__(self, role, name=""):
+        self.role = role
+        self.name = name
+        self.start_time = None  # Time the connection is established, from time.monotonic()
+        self.end_time = None
+        self.total_data = 0     # Bytes of the file that are delivered, without headers and the filename
+        self.counters = {}      # format: {name: count}
+        self.rtt_samples = []   # format: [(seconds since the start, rtt)]
+        self.buckets = []       # format: [[goodput bytes, window, retransmissions, rtt sum, rtt samples]]
+
+    """
+    Description:
+        Function to start the clock of the transfer
+    Parameters:
+        now: float - The time the connection is established
+    Return:
+        None
+    """
+    def start(self, now):
+        self.start_time = now
+
+    """
+    Description:
+        Function to get the bucket of a time, the buckets up to it are added
+    Parameters:
+        now: float - The time
+    Return:
+        bucket: list - The bucket of the time
+    """
+    def bucket(self, now):
+        index = max(int((now - self.start_time) / metrics_interval), 0)
+        while len(self.buckets) <= index:
+            self.buckets.append([0, self.buckets[-1][1] if self.buckets else 0, 0, 0.0, 0])
+        return self.buckets[index]
+
+    """
+    Description:
+        Function to count an event, such as a retransmission or a duplicate packet
+    Parameters:
+        name: str - The name of the counter
+        count: int - The number to add
+    Return:
+        None
+    """
+    def count(self, name, count=1):
+        self.counters[name] = self.counters.get(name, 0) + count
+
+    """
+    Description:
+        Function to add bytes of the file that are delivered
+    Parameters:
+        now: float - The time the bytes are delivered, or acknowledged on the client
+        nbytes: int - The number of bytes
+    Return:
+        None
+    """
+    def delivered(self, now, nbytes):
+        self.total_data += nbytes
+        if self.start_time is not None:
+            self.bucket(now)[0] += nbytes
+
+    """
+    Description:
+        Function to add an RTT sample
+    Parameters:
+        now: float - The time of the sample
+        rtt: float - The measured round trip time
+    Return:
+        None
+    """
+    def rtt(self, now, rtt):
+        if self.start_time is None:
+            self.rtt_samples.append((0.0, rtt))
+            return
+        self.rtt_samples.append((now - self.start_time, rtt))
+        bucket = self.bucket(now)
+        bucket[3] += rtt
+        bucket[4] += 1
+
+    """
+    Description:
+        Function to record the window size
+    Parameters:
+        now: float - The time
+        window: float - The window size in packets
+    Return:
+        None
+    """
+    def window(self, now, window):
+        if self.start_time is not None:
+            self.bucket(now)[1] = window
+
+    """
+    Description:
+        Function to count a retransmitted packet
+    Parameters:
+        now: float - The time the packet is resent
+        count: int - The number of packets resent
+    Return:
+        None
+    """
+    def retransmitted(self, now, count=1):
+        self.count("retransmissions", count)
+        if self.start_time is not None:
+            self.bucket(now)[2] += count
+
+    """
+    Description:
+        Function to stop the clock of the transfer
+    Parameters:
+        now: float - The time the transfer is done
+    Return:
+        None
+    """
+    def finish(self, now):
+        self.end_time = now
+
+    """
+    Description:
+        Function to get the time of the transfer
+    Parameters:
+        None
+    Return:
+        seconds: float - Seconds from the start to the end, or to now while the transfer runs
+    """
+    def duration(self):
+        if self.start_time is None:
+            return 0.0
+        return (self.end_time if self.end_time is not None else time.monotonic()) - self.start_time
+
+    """
+    Description:
+        Function to get the timeline of the transfer
+    Parameters:
+        None
+    Return:
+        timeline: list - One row per bucket, format: [{"time", "goodput_bps", "window", "retransmissions", "rtt"}]
+    """
+    def timeline(self):
+        return [{
+            "time": round(index * metrics_interval, 6),
+            "goodput_bps": goodput * 8 / metrics_interval,
+            "window": window,
+            "retransmissions": retransmissions,
+            "rtt": rtt_sum / rtt_count if rtt_count else None,
+        } for index, (goodput, window, retransmissions, rtt_sum, rtt_count) in enumerate(list(self.buckets))]
+
+    """
+    Description:
+        Function to get all the metrics
+    Parameters:
+        None
+    Return:
+        metrics: dict - The metrics, can be written as JSON
+    """
+    def snapshot(self):
+        duration = self.duration()
+        return {
+            "role": self.role,
+            "name": self.name,
+            "done": self.end_time is not None,
+            "duration": duration,
+            "bytes": self.total_data,
+            "goodput_bps": self.total_data * 8 / duration if duration else 0.0,
+            "counters": dict(self.counters),
+            "rtt_samples": list(self.rtt_samples),
+            "timeline": self.timeline(),
+        }
+
+    """
+    Description:
+        Function to write the metrics to a file, CSV writes the timeline and JSON writes all the metrics
+    Parameters:
+        path: str - The file to write, ending with .csv or .json
+    Return:
+        None
+    """
+    def write(self, path):
+        try:
+            with open(path, "w", newline="") as file:
+                if path.endswith(".csv"):
+                    writer = csv.DictWriter(file, fieldnames=["time", "goodput_bps", "window", "retransmissions", "rtt"])
+                    writer.writeheader()
+                    writer.writerows(self.timeline())
+                else:
+                    json.dump(self.snapshot(), file, indent=2)
+            log(f"Metrics are written to {path}")
+        except OSError as e:
+            log(f"Error: {e}", SUMMARY)
+
+"""
+Description:
+    Function to get the metrics file of one of several transfers, the name of the transfer is added before the extension
+Parameters:
+    path: str - The metrics file given on the command line, None for no file
+    name: str - The name of the transfer
+Return:
+    path: str - The metrics file of the transfer, None for no file
+"""
+def metrics_path(path, name):
+    if path is None:
+        return None
+    stem, extension = os.path.splitext(path)
+    return f"{stem}-{name}{extension or '.json'}"
+
+"""
+Description:
+    Class to serve the metrics of the running transfers on a local TCP port, every connection gets one JSON snapshot
+    # NOTE: The server runs in a daemon thread, so it stops with the process
+Parameters:
+    port: int - The port to listen on, on 127.0.0.1
+    transfers: function - Returns the TransferMetrics of the transfers to report
+"""
+class StatsServer:
+    """
+    Description:
+        Function to start listening for scrapers
+    Parameters:
+        port: int - The port to listen on
+        transfers: function - Returns the TransferMetrics of the transfers to report
+    Return:
+        None
+    """
+    def __init__(self, port, transfers):
+        self.transfers = transfers
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind(("127.0.0.1", port))
+        self.socket.listen()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        log(f"Metrics are served on 127.0.0.1:{port}")
+
+    """
+    Description:
+        Function to answer the scrapers, run in the thread
+    Parameters:
+        None
+    Return:
+        None
+    """
+    def run(self):
+        while True:
+            try:
+                connection, _ = self.socket.accept()
+            except OSError:
+                return
+            with connection:
+                try:
+                    snapshot = [metrics.snapshot() for metrics in self.transfers()]
+                    connection.sendall(json.dumps(snapshot).encode() + b"\n")
+                except OSError:
+                    pass
+
+"""
+Description:
+    Function to parse the forward error correction setting of the client
+Parameters:
+    value: str - "none", "N:K" for K parity packets for every N data packets, or "auto" to size the groups from the loss rate
+Return:
+    fec: tuple - format: (data packets in a group, parity packets in a group, True if the groups are sized from the loss rate),
+                 None for no parity packets, raises ValueError if the setting is not valid
+"""
+def parse_fec(value):
+    if value == "none":
+        return None
+    if value == "auto":
+        return (fec_group, 1, True)
+    group, parity = (int(number) for number in value.split(":"))
+    if not 1 <= parity <= group <= fec_max_group:
+        raise ValueError(f"{value} must be N:K with 1 <= K <= N <= {fec_max_group}")
+    return (group, parity, False)
+
+"""
+Description:
+    Function to get the length and the COMPRESSED flag of a payload as one number, a parity packet has the XOR of them in front of its payload
+Parameters:
+    payload: bytes - The payload of a data packet
+    compressed: bool - If the packet is sent with the COMPRESSED flag
+Return:
+    meta: int - The length in the low 15 bits and the flag in the top bit
+"""
+def parity_meta(payload, compressed):
+    return len(payload) | (int(bool(compressed)) << 15)
+
+"""
+Description:
+    Class to make the parity packets of the data packets, so the server can rebuild a lost packet without waiting for a retransmission
+    The packets of a group of N are spread over K lanes, packet i of the group goes to lane i % K, and the parity packet of a lane
+    has the XOR of the payloads of its packets, so the server can rebuild one lost packet in each lane, and a burst of up to K losses
+    # NOTE: The payloads are XORed as little-endian integers, so a shorter payload is padded with zeros. A parity packet has the first packet
+    # of its lane as the sequence number and (K << 16) | packets in the lane as the acknowledgment number, so the server finds the packets it
+    # covers without knowing N and K, and the client can change the group size while it sends
+Parameters:
+    group: int - Data packets in a group
+    parity: int - Parity packets in a group, the number of lanes
+    adaptive: bool - Size the groups from the loss rate, about K * fec_lane_losses / loss rate packets
+"""
+class ParityEncoder:
+    """
+    Description:
+        Start with no open group
+    Parameters:
+        See the class description
+    Return:
+        None
+    """
+    def __init__(self, group, parity, adaptive=False):
+        self.group = group
+        self.parity = parity
+        self.adaptive = adaptive
+        self.start = 1      # First packet of the open group
+        self.lanes = []     # The lanes of the open group, format: [[XOR of the payloads, XOR of the metas, packets, longest payload]]
+        self.packets = []   # Parity packets to send, format: [(seq_num, ack_num, payload)]
+        self.loss_rate = None   # Smoothed loss rate of the auto FEC, None until it is measured
+        self.sent = 0       # Packets sent at the last adjustment of the group size
+        self.lost = 0       # Packets lost at the last adjustment of the group size
+
+    """
+    Description:
+        Function to add a data packet that is sent for the first time, the group is closed when it is full or the packet is the last one
+    Parameters:
+        seq_num: int - The sequence number of the packet
+        payload: bytes - The payload as it is sent
+        compressed: bool - If the packet is sent with the COMPRESSED flag
+        last: bool - If it is the last packet of the file
+    Return:
+        None
+    """
+    def add(self, seq_num, payload, compressed, last):
+        if not self.lanes:
+            self.start = seq_num
+        index = seq_num - self.start
+        while len(self.lanes) <= index % self.parity:
+            self.lanes.append([0, 0, 0, 0])
+        lane = self.lanes[index % self.parity]
+        lane[0] ^= int.from_bytes(payload, "little")
+        lane[1] ^= parity_meta(payload, compressed)
+        lane[2] += 1
+        lane[3] = max(lane[3], len(payload))
+        if index + 1 >= self.group or last:
+            self.close()
+
+    """
+    Description:
+        Function to close the open group and make its parity packets
+    Parameters:
+        None
+    Return:
+        None
+    """
+    def close(self):
+        for number, (value, meta, packets, length) in enumerate(self.lanes):
+            self.packets.append((self.start + number, (self.parity << 16) | packets, struct.pack("!H", meta) + value.to_bytes(length, "little")))
+        self.lanes = []
+
+    """
+    Description:
+        Function to size the groups of the auto FEC from the share of the packets sent since the last adjustment that were lost
+    Parameters:
+        sent: int - Packets sent so far
+        lost: int - Packets lost so far, resent by the client or rebuilt by the server
+    Return:
+        None
+    """
+    def adapt(self, sent, lost):
+        if not self.adaptive or sent - self.sent < fec_adapt_packets:
+            return
+        rate = (lost - self.lost) / (sent - self.sent)
+        self.sent, self.lost = sent, lost
+        self.loss_rate = rate if self.loss_rate is None else self.loss_rate + (rate - self.loss_rate) / 4
+        lane = fec_max_group if self.loss_rate == 0 else fec_lane_losses / self.loss_rate
+        group = max(self.parity, min(fec_max_group, round(lane * self.parity)))
+        if group != self.group and logger.events:
+            log(f"Loss rate {self.loss_rate:.3f}, {self.parity} parity packets for every {group} packets", EVENT, timed=True)
+        self.group = group
+
+"""
+Description:
+    Class for the receiving side of one connection, from the SYN packet to the FIN-ACK packet
+    The connection does not use a socket, the packets are handed to handle_packet and the packets to send back are returned,
+    so the same connection can be run by the single transfer server, the concurrent server and the simulator
+    # NOTE: When a packet is received in a buffer from free_buffers, the connection may keep the buffer until the payload is written,
+    # kept_buffer is set when it does and the buffer must not be reused by the caller
+Parameters:
+    discard: int - The packet to discard, None to not discard any packet
+    flush: str - "buffered" to leave the written file to the OS, "fsync" to sync it to disk at FIN
+    mode: str - "gbn" for Go-Back-N, "sr" for Selective Repeat
+    free_buffers: queue.Queue - The queue to return the receive buffers to, None if the packets are not received in buffers
+    name: str - Printed in front of the messages of the connection
+    metrics_file: str - The file to write the metrics to when the connection closes, None for no file
+    writer_class: class - The class that writes the received file, None for FileWriter or SessionWriter
+"""
+class ReceiverConnection:
+    """
+    Description:
+        Set up a connection waiting for the SYN packet
+    Parameters:
+        discard: int - The packet to discard, None to not discard any packet
+        flush: str - The flush mode, "buffered" or "fsync"
+        mode: str - The reliability mode, "gbn" or "sr"
+        free_buffers: queue.Queue - The queue to return the receive buffers to
+        name: str - Printed in front of the messages of the connection
+        metrics_file: str - The file to write the metrics to when the connection closes, None for no file
+        writer_class: class - The class that writes the received file, with the arguments and methods of FileWriter,
+                              None for FileWriter, or SessionWriter when the client sends a session
+        socket_buffer: int - The size of the kernel receive buffer of the server socket in bytes, None if there is no socket
+    Return:
+        None
+    """
+    def __init__(self, discard=None, flush=flush_mode, mode=default_mode, free_buffers=None, name="", metrics_file=None, writer_class=None,
+                 socket_buffer=None):
+        self.discard = discard
+        self.flush = flush
+        self.mode = mode
+        self.free_buffers = free_buffers
+        self.name = name
+        self.metrics_file = metrics_file
+        self.writer_class = writer_class
+        self.socket_buffer = socket_buffer
+        self.metrics = TransferMetrics("server", name.strip())
+
+        self.state = "listen"   # listen, syn_received, established, fin_received, closed
+        self.options = {}
+        self.syn = None     # The SYN packet, a resent SYN packet is answered with the same SYN-ACK packet
+        self.syn_ack = None
+        self.early_rejected = False # If the client sends data with the SYN packet and the server does not accept it
+        self.file_size = None   # Size of the file from the SYN packet, None if the client does not send it
+        self.header_struct = DRTP_struct
+        self.payload_size = payload_size    # Largest payload of the client, accepted in the handshake
+        self.rtt = RTTEstimator()
+        self.kept_buffer = False
+        self.last_activity = None
+
+        # Receive state
+        self.excpected_ack_num = 1
+        self.writer = None
+        self.checkpoint = None  # The checkpoint of the file when the client can resume it
+        self.signatures = None  # The signatures of the copy of the file when the client sends a delta
+        self.recent = {}    # Payloads of the last packets as they are sent, when the client sends parity packets, format: {seq_num: (meta, payload as an integer)}
+        self.parities = {}  # Parity packets that can not rebuild a packet yet, format: {first seq_num: (stride, packets, meta, payload as an integer)}
+        self.rebuilt = 0    # Packets rebuilt from parity packets
+        self.reorder_buffer = {} # Out-of-order packets in SR mode, format: {seq_num: (payload, buffer, nbytes)}
+        self.unacked = 0    # Packets received in order since the last ACK, when ACKs are delayed
+        self.ack_deadline = None    # Time the delayed ACK must be sent, None if no ACK is delayed
+        self.ack_seq_num = 0    # Sequence number of the ACK packets, from the last data packet
+        self.fin_ack = None
+
+    """
+    Description:
+        Function to print a message of the connection
+    Parameters:
+        message: str - The message to print
+        level: int - The level of the message, SUMMARY, EVENT or DEBUG
+        timed: bool - Print the time since the start in front of the message
+    Return:
+        None
+    """
+    def log(self, message, level=EVENT, timed=False):
+        logger.log(level, message, timed, self.name)
+
+    """
+    Description:
+        Function to get how long the connection waits for a packet before it gives up
+    Parameters:
+        None
+    Return:
+        idle_timeout: float - The idle timeout in seconds, derived from the RTT of the handshake
+    """
+    def idle_timeout(self):
+        return self.rtt.give_up_time()
+
+    """
+    Description:
+        Function to handle a received packet
+    Parameters:
+        packet: memoryview - The received packet
+        buffer: bytearray - The receive buffer holding the packet, None if it is not from free_buffers
+        now: float - The time the packet is received, from time.monotonic()
+    Return:
+        replies: list - The packets to send back to the client
+    """
+    def handle_packet(self, packet, buffer, now):
+        self.kept_buffer = False
+        self.last_activity = now
+        if self.state == "listen":
+            return self.handle_syn(packet, now)
+        if self.state == "syn_received":
+            # The client resends the SYN packet when the SYN-ACK packet is lost, the SYN-ACK packet is resent
+            # NOTE: The round trip time is not measured from a resent SYN-ACK packet, the ACK may answer either of them
+            if len(packet) >= DRTP_struct.size and unpack_header(packet[:DRTP_struct.size])[2][0] == 1:
+                self.log("SYN packet is resent by the client, the SYN-ACK packet is resent", EVENT, timed=True)
+                self.syn_ack_time = None
+                return [self.syn_ack]
+            # The ACK packet of the handshake has the 6-byte header and no payload, a data packet means the ACK is lost
+            if len(packet) == DRTP_struct.size:
+                return self.handle_ack(packet, now)
+            # NOTE: Data sent with the SYN packet has the acknowledgment number 0, it is dropped if it is not accepted
+            if self.early_rejected and len(packet) >= self.header_struct.size and unpack_header(packet[:self.header_struct.size], self.header_struct)[1] == 0:
+                return []
+            self.establish(now)
+        if self.state == "established":
+            # The ACK packet of the handshake can arrive after data sent with the SYN packet, and a SYN packet after the SYN-ACK packet is lost
+            if len(packet) < self.header_struct.size:
+                return []
+            if len(packet) == len(self.syn) and packet == self.syn:
+                return [self.syn_ack]
+            replies = self.handle_data(packet, buffer, now)
+            # Rebuild the lost packets the parity packets have all the other packets of, the buffer of the packet is kept as handle_data left it
+            if self.parities and self.state == "established":
+                kept_buffer = self.kept_buffer
+                replies.extend(self.rebuild(now))
+                self.kept_buffer = kept_buffer
+            return replies
+        # Resend the FIN-ACK packet if it is lost
+        if self.state == "closed" and self.fin_ack is not None and len(packet) >= self.header_struct.size:
+            _, _, flags = unpack_header(packet[:self.header_struct.size], self.header_struct)
+            if flags[2] == 1:
+                return [self.fin_ack]
+        return []
+
+    """
+    Description:
+        Function to get the largest payload of which the kernel receive buffer holds min_socket_packets packets
+        # NOTE: The packets of the client queue in the buffer while the server is busy, a few large packets would fill it and be dropped
+    Parameters:
+        None
+    Return:
+        size: int - The payload size, max_payload_size if there is no socket
+    """
+    def buffer_payload_size(self):
+        if self.socket_buffer is None:
+            return max_payload_size
+        data = self.socket_buffer // min_socket_packets - socket_packet_overhead
+        if data <= 0:
+            return min_payload_size
+        return (1 << (data.bit_length() - 1)) - socket_packet_overhead - DRTP_extended_struct.size - 2
+
+    """
+    Description:
+        Function to handle the SYN packet and reply with the SYN-ACK packet
+    Parameters:
+        packet: memoryview - The received packet
+        now: float - The time the packet is received
+    Return:
+        replies: list - The SYN-ACK packet
+    """
+    def handle_syn(self, packet, now):
+        ack_num, _, flags = unpack_header(packet[:DRTP_struct.size])
+        if flags[0] != 1:
+            return []
+        client_options = unpack_options(packet[DRTP_struct.size:])
+        self.syn = bytes(packet)
+        self.log("SYN packet is received")
+        print_header(packet[:6], False)
+
+        # Accept the options the server supports
+        if client_options.get("seq32"):
+            self.options["seq32"] = 1
+        if "range" in client_options:
+            self.options["range"] = client_options["range"]
+        if client_options.get("sack"):
+            self.options["sack"] = 1
+        if client_options.get("session"):
+            self.options["session"] = 1
+        # NOTE: The server may lower the largest size of a decompressed payload, the client compresses at most that much into a packet
+        if "compress" in client_options and client_options["compress"][0] in compression_names:
+            self.options["compress"] = (client_options["compress"][0], min(client_options["compress"][1], compress_block))
+        # NOTE: The parity packets need the wide acknowledgment numbers, and the ACKs tell the client how many packets are rebuilt
+        if "fec" in client_options and client_options.get("seq32") and client_options.get("sack"):
+            group = min(client_options["fec"][0], fec_max_group)
+            self.options["fec"] = (group, max(1, min(client_options["fec"][1], group)))
+        # NOTE: The meta of a parity packet has 15 bits for the length of a payload
+        if "payload" in client_options:
+            size = max(min_payload_size, min(client_options["payload"], max_payload_size, 0x7FFF if "fec" in self.options else max_payload_size,
+                                             self.buffer_payload_size()))
+            self.options["payload"] = self.payload_size = size
+        if "file" in client_options:
+            self.file_size = session_record_struct.unpack_from(client_options["file"])[1]
+        if client_options.get("rwnd"):
+            self.options["rwnd"] = self.receive_window()
+        # Keep a checkpoint of a whole file, and tell a client that sends it again where the output file ends with the range option
+        if "resume" in client_options and "range" not in client_options and not client_options.get("session"):
+            self.options["resume"] = client_options["resume"]
+            self.checkpoint = Checkpoint(client_options["resume"])
+            if self.checkpoint.load():
+                self.options["range"] = (self.checkpoint.offset, self.checkpoint.size - self.checkpoint.offset, self.checkpoint.size)
+                self.log(f"Resuming {self.checkpoint.path} at byte {self.checkpoint.offset} of {self.checkpoint.size}")
+        # Send the signatures of the copy in the output directory to a client that sends a delta, a file that is resumed is sent as it is
+        # NOTE: The copy is read here, before the SYN-ACK packet, the concurrent server waits for it as well
+        if "delta" in client_options and client_options.get("seq32") and "range" not in self.options and not client_options.get("session"):
+            path = output_path(client_options["delta"].decode(errors="replace"))
+            self.signatures, block_size, size = file_signatures(path)
+            if self.signatures is not None:
+                self.options["delta"] = client_options["delta"]
+                self.options["signatures"] = (block_size, size)
+                self.options.pop("resume", None)
+                self.checkpoint = None
+                self.log(f"Sending the signatures of {path}, {len(self.signatures) // delta_signature_struct.size} blocks of {block_size} bytes")
+        self.header_struct = DRTP_extended_struct if self.options.get("seq32") else DRTP_struct
+
+        # Accept the data sent with the SYN packet if all the options are accepted as they are offered, the data is sent with them
+        # NOTE: A file that is resumed or sent as a delta starts somewhere else, so its data is not accepted
+        if "early" in client_options:
+            offered = {code: value for code, value in client_options.items() if code not in ("early", "resume", "file", "pad", "rwnd")}
+            accepted = {code: value for code, value in self.options.items() if code not in ("resume", "rwnd")}
+            if offered == accepted and offered.get("seq32") and offered.get("sack"):
+                self.options["early"] = 1
+            else:
+                self.early_rejected = True
+                self.log("The data sent with the SYN packet is not accepted")
+
+        # Send SYN-ACK packet
+        seq_num = 0
+        packet = send_packet(seq_num, ack_num + 1, set_flags(1, 1, 0, 0), pack_options(self.options))
+        self.syn_ack = packet
+        self.syn_ack_time = now
+        self.state = "syn_received"
+        self.log("SYN-ACK packet is sent")
+        print_header(packet[:6], True)
+        return [packet]
+
+    """
+    Description:
+        Function to handle the ACK packet of the handshake
+    Parameters:
+        packet: memoryview - The received packet
+        now: float - The time the packet is received
+    Return:
+        replies: list - Nothing is sent back
+    """
+    def handle_ack(self, packet, now):
+        ack_num, seq_num, flags = unpack_header(packet)
+        if ack_num == seq_num + 1 and flags[1] == 1:
+            self.log("ACK packet is received")
+            print_header(packet[:6], False)
+            # Measure the round trip time of the handshake
+            if self.syn_ack_time is not None:
+                self.rtt.sample(now - self.syn_ack_time)
+                self.metrics.rtt(now, now - self.syn_ack_time)
+            self.establish(now)
+        return []
+
+    """
+    Description:
+        Function to start receiving the file
+    Parameters:
+        now: float - The time the connection is established
+    Return:
+        None
+    """
+    def establish(self, now):
+        self.state = "established"
+        self.metrics.start(now)
+        self.log("Connection established\n")
+        if logger.packets:
+            self.log(f"Handshake RTT: {self.rtt.srtt}, idle timeout: {self.idle_timeout():.3f}s, options: {self.options}", DEBUG)
+
+    """
+    Description:
+        Function to handle a data or FIN packet and reply with an ACK packet
+    Parameters:
+        packet: memoryview - The received packet
+        buffer: bytearray - The receive buffer holding the packet
+        now: float - The time the packet is received
+    Return:
+        replies: list - The ACK packet, or nothing
+    """
+    def handle_data(self, packet, buffer, now):
+        header_struct = self.header_struct
+        nbytes = len(packet)
+        ack_num, seq_num, flags = unpack_header(packet[:header_struct.size], header_struct)
+        if flags[6] == 1:
+            return self.send_signatures(ack_num, seq_num)
+        if flags[7] == 1:
+            return self.handle_parity(ack_num, seq_num, packet[header_struct.size:])
+        # Drop the data sent with the SYN packet that is not accepted, the client sends it again
+        if seq_num == 0 and self.early_rejected:
+            return []
+
+        # Discard the packet
+        if ack_num == self.discard and flags[2] == 0:
+            self.discard = None
+            self.metrics.count("discarded")
+            return []
+
+        # Give up when the writer has failed, the rest of the file can not be written
+        if self.writer is not None and self.writer.error is not None:
+            self.abort(f"the file can not be written, {self.writer.error}", now)
+            return []
+
+        print_header(packet[:header_struct.size], False, header_struct)
+        self.metrics.count("packets")
+
+        # Send ACK for the received packet
+        if ack_num <= self.excpected_ack_num and not flags[2] == 1: # Will send ack for packets in order and any previous
+            if logger.packets:
+                self.log(f"packet {ack_num} is received", DEBUG, timed=True)
+            # write the payload if the packet is not a duplicate, the buffer is owned by the writer until it is written
+            if ack_num == self.excpected_ack_num:
+                payload, buffer = self.payload(packet, buffer, flags, now)
+                if payload is None:
+                    return []
+                if "fec" in self.options:
+                    self.keep_payload(ack_num, packet[header_struct.size:], flags[5])
+                in_order = [(payload, buffer, nbytes)]
+                self.kept_buffer = buffer is not None
+                # Packets buffered in SR mode are in order after this packet
+                while self.excpected_ack_num + len(in_order) in self.reorder_buffer:
+                    in_order.append(self.reorder_buffer.pop(self.excpected_ack_num + len(in_order)))
+                for payload, payload_buffer, _ in in_order:
+                    # The goodput is the bytes of the file, without the filename in the first payload
+                    self.metrics.delivered(now, len(payload) - (max_filename_length if self.writer is None else 0))
+                    if self.writer is None:
+                        writer_class = self.writer_class or (SessionWriter if self.options.get("session") else
+                                                             DeltaWriter if "delta" in self.options else FileWriter)
+                        self.writer = writer_class(payload, payload_buffer, self.free_buffers, self.flush, self.log, self.options.get("range"), self.checkpoint)
+                        if type(self.writer) is FileWriter and self.file_size is not None and "range" not in self.options:
+                            self.writer.preallocate(self.file_size)
+                    else:
+                        self.writer.write(payload, payload_buffer)
+                    self.excpected_ack_num += 1
+
+                # Delay the cumulative ACK until ack_every packets are received or the ACK timer expires
+                # NOTE: A packet that fills a gap and the empty last packet are acknowledged at once
+                if self.options.get("sack"):
+                    self.ack_seq_num = seq_num
+                    self.unacked += len(in_order)
+                    if self.unacked < ack_every and len(in_order) == 1 and nbytes > header_struct.size:
+                        if self.ack_deadline is None:
+                            self.ack_deadline = now + ack_delay
+                        return []
+            else:
+                self.log(f"duplicate packet {ack_num} is received", EVENT, timed=True)
+                self.metrics.count("duplicates")
+            return [self.send_ack(seq_num, ack_num)]
+
+        # Buffer out-of-order packets in SR mode and ACK them individually, in GBN mode as well when a lost packet can be rebuilt from parity
+        # NOTE: The window is half of the receive buffers so that the writer always has buffers left to return
+        elif (self.mode == "sr" or "fec" in self.options) and not flags[2] == 1 and ack_num < self.excpected_ack_num + receive_buffers // 2:
+            if ack_num not in self.reorder_buffer:
+                if logger.packets:
+                    self.log(f"out-of-order packet {ack_num} is buffered", DEBUG, timed=True)
+                payload, buffer = self.payload(packet, buffer, flags, now)
+                if payload is None:
+                    return []
+                if "fec" in self.options:
+                    self.keep_payload(ack_num, packet[header_struct.size:], flags[5])
+                self.reorder_buffer[ack_num] = (payload, buffer, nbytes)
+                self.kept_buffer = buffer is not None
+                self.metrics.count("out_of_order")
+            else:
+                self.log(f"duplicate packet {ack_num} is received", EVENT, timed=True)
+                self.metrics.count("duplicates")
+            return [self.send_ack(seq_num, ack_num)]
+
+        # FIN packet is received, the caller writes the rest of the file with finish before the FIN-ACK is sent
+        elif flags[2] == 1:
+            self.log("\nFIN packet is received")
+            print_header(packet[:header_struct.size], False, header_struct)
+            self.fin_ack = send_packet(seq_num, ack_num + 1, set_flags(0, 1, 1, 0), header_struct=header_struct)
+            self.state = "fin_received"
+        else:
+            if logger.packets:
+                self.log(f"out-of-order packet {ack_num} is received", DEBUG, timed=True)
+            self.metrics.count("out_of_order")
+            # Tell the client about the gap at once with the cumulative ACK
+            if self.options.get("sack"):
+                return [self.send_ack(seq_num, ack_num)]
+        return []
+
+    """
+    Description:
+        Function to send the packets of signatures the client requests before it sends a delta
+        # NOTE: One request is answered with at most delta_batch packets, so a small packet can not make the server send much
+    Parameters:
+        first: int - The index of the first packet, the sequence number of the request
+        count: int - The number of packets, the acknowledgment number of the request
+    Return:
+        replies: list - The packets of signatures, each with its index as the sequence number
+    """
+    def send_signatures(self, first, count):
+        if self.signatures is None:
+            return []
+        size = payload_size // delta_signature_struct.size * delta_signature_struct.size
+        packets = -(-len(self.signatures) // size)
+        replies = [send_packet(index, 0, set_flags(0, 0, 0, 0, signature=1), self.signatures[index * size:(index + 1) * size], self.header_struct)
+                   for index in range(first, min(first + min(count, delta_batch), packets))]
+        if logger.packets:
+            self.log(f"sending {len(replies)} packets of signatures from {first}", DEBUG, timed=True)
+        return replies
+
+    """
+    Description:
+        Function to keep the payload of a new data packet as it is sent, for rebuilding a lost packet of its group
+    Parameters:
+        seq_num: int - The sequence number of the packet
+        payload: memoryview - The payload, before it is decompressed
+        compressed: int - If the packet has the COMPRESSED flag
+    Return:
+        None
+    """
+    def keep_payload(self, seq_num, payload, compressed):
+        self.recent[seq_num] = (parity_meta(payload, compressed), int.from_bytes(payload, "little"))
+        self.recent.pop(seq_num - 2 * fec_max_group, None)
+
+    """
+    Description:
+        Function to keep a parity packet until it can rebuild a lost packet or all its packets are received
+    Parameters:
+        first: int - The first packet it covers, the sequence number of the parity packet
+        cover: int - The acknowledgment number of the parity packet, format: (stride << 16) | packets
+        payload: memoryview - The XOR of the metas and the payloads of the packets
+    Return:
+        replies: list - Nothing is sent back, the packets are rebuilt after the packet is handled
+    """
+    def handle_parity(self, first, cover, payload):
+        stride, packets = cover >> 16, cover & 0xFFFF
+        if "fec" not in self.options or len(payload) < 2 or not stride or not packets or (packets - 1) * stride >= 2 * fec_max_group:
+            return []
+        self.metrics.count("parity")
+        self.parities[first] = (stride, packets, struct.unpack_from("!H", payload)[0], int.from_bytes(payload[2:], "little"))
+        if len(self.parities) > 2 * fec_max_group:
+            del self.parities[min(self.parities)]
+        return []
+
+    """
+    Description:
+        Function to rebuild the packets that are the only packet of a parity packet that is not received,
+        each is handled as if it was received
+    Parameters:
+        now: float - The current time
+    Return:
+        replies: list - The ACK packets of the rebuilt packets
+    """
+    def rebuild(self, now):
+        replies = []
+        for first, (stride, packets, meta, value) in list(self.parities.items()):
+            covered = range(first, first + stride * packets, stride)
+            missing = [seq_num for seq_num in covered if seq_num not in self.recent]
+            # Wait while more than one packet is missing, the parity packet is dropped when nothing is lost or the payloads are gone
+            if len(missing) > 1 and missing[0] >= self.excpected_ack_num:
+                continue
+            del self.parities[first]
+            if len(missing) != 1 or missing[0] < self.excpected_ack_num:
+                continue
+            for seq_num in covered:
+                if seq_num != missing[0]:
+                    meta ^= self.recent[seq_num][0]
+                    value ^= self.recent[seq_num][1]
+            length = meta & 0x7FFF
+            if length > self.payload_size or value.bit_length() > 8 * length:
+                continue
+            self.rebuilt += 1
+            self.metrics.count("rebuilt")
+            self.log(f"packet {missing[0]} is rebuilt from parity", EVENT, timed=True)
+            packet = send_packet(missing[0], 0, set_flags(0, 0, 0, 0, compressed=meta >> 15), value.to_bytes(length, "little"), self.header_struct)
+            replies.extend(self.handle_data(memoryview(packet), None, now))
+            if self.state != "established":
+                break
+        return replies
+
+    """
+    Description:
+        Function to get the payload of a new data packet, a payload with the COMPRESSED flag is decompressed
+        # NOTE: A decompressed payload is not in the receive buffer, so the buffer is left to the caller at once
+    Parameters:
+        packet: memoryview - The received packet
+        buffer: bytearray - The receive buffer holding the packet
+        flags: tuple - The flags of the packet
+        now: float - The time the packet is received
+    Return:
+        payload: memoryview - The payload, None if it can not be decompressed and the connection is given up
+        buffer: bytearray - The receive buffer holding the payload, None if it is decompressed
+    """
+    def payload(self, packet, buffer, flags, now):
+        payload = packet[self.header_struct.size:]
+        if flags[5] == 1 and "compress" in self.options:
+            method, max_size = self.options["compress"]
+            try:
+                return memoryview(decompress_payload(compression_names[method], payload, max_size)), None
+            except ValueError as e:
+                self.abort(f"a payload can not be decompressed, {e}", now)
+                return None, None
+        return payload, buffer
+
+    """
+    Description:
+        Function to make the ACK packet for a received packet
+    Parameters:
+        seq_num: int - The acknowledgment number of the received packet
+        ack_num: int - The sequence number of the received packet
+    Return:
+        packet: bytes - The ACK packet
+    """
+    def send_ack(self, seq_num, ack_num):
+        # With SACK the ACK is cumulative, for the last packet in order, and the out-of-order packets are in SACK blocks
+        # NOTE: With parity packets the sequence number of the ACK is the number of rebuilt packets, the client counts them as lost
+        if "fec" in self.options:
+            seq_num = self.rebuilt & 0xFFFFFFFF
+        blocks = None
+        if self.options.get("sack"):
+            ack_num = self.excpected_ack_num - 1
+            blocks = self.sack_blocks()
+            self.unacked = 0
+            self.ack_deadline = None
+        self.metrics.count("acks")
+        # The receive window goes in front of the SACK blocks when the client wants it
+        window = receive_window_struct.pack(self.receive_window()) if "rwnd" in self.options else b""
+        if blocks:
+            packet = send_packet(seq_num, ack_num + 1, set_flags(0, 1, 0, 0, 1), window + pack_sack_blocks(blocks, self.header_struct), self.header_struct)
+            if logger.packets:
+                self.log(f"sending ack for the received {ack_num}, SACK blocks {blocks}", DEBUG, timed=True)
+        else:
+            packet = send_packet(seq_num, ack_num + 1, set_flags(0, 1, 0, 0), window, self.header_struct)
+            if logger.packets:
+                self.log(f"sending ack for the received {ack_num}", DEBUG, timed=True)
+        print_header(packet[:self.header_struct.size], True, self.header_struct)
+        return packet
+
+    """
+    Description:
+        Function to get the receive window the server advertises, the packets after the cumulative ACK it has room for
+        # NOTE: The receive buffers held by the out-of-order packets and by the payloads the writer has not written are not free,
+        # so the window closes when the disk falls behind, before the buffers run out and the kernel drops the packets.
+        # The packets in flight wait in the kernel receive buffer while the server is busy, so the window is at most the packets it holds
+    Parameters:
+        None
+    Return:
+        window: int - The window in packets, 0 when the server has no room
+    """
+    def receive_window(self):
+        held = len(self.reorder_buffer) + (self.writer.backlog() if self.writer is not None else 0)
+        window = receive_buffers - socket_batch - held
+        if self.socket_buffer is not None:
+            window = min(window, self.socket_buffer // packet_truesize(self.header_struct.size + 2 + self.payload_size))
+        return max(0, min(window, 0xFFFF))
+
+    """
+    Description:
+        Function to get the ranges of the out-of-order packets in the reorder buffer
+    Parameters:
+        None
+    Return:
+        blocks: list - The first max_sack_blocks ranges, format: [(first seq_num, last seq_num + 1)]
+    """
+    def sack_blocks(self):
+        blocks = []
+        for buffered_seq in sorted(self.reorder_buffer):
+            if blocks and blocks[-1][1] == buffered_seq:
+                blocks[-1][1] += 1
+            elif len(blocks) < max_sack_blocks:
+                blocks.append([buffered_seq, buffered_seq + 1])
+            else:
+                break
+        return [tuple(block) for block in blocks]
+
+    """
+    Description:
+        Function to send the delayed ACK when its timer has expired
+    Parameters:
+        now: float - The current time
+    Return:
+        replies: list - The ACK packet, or nothing
+    """
+    def delayed_ack(self, now):
+        if self.state != "established":
+            self.ack_deadline = None
+        if self.ack_deadline is None or now < self.ack_deadline:
+            return []
+        return [self.send_ack(self.ack_seq_num, self.excpected_ack_num - 1)]
+
+    """
+    Description:
+        Function to write the rest of the file after the FIN packet and print the throughput
+        # NOTE: This waits for the writer thread, the concurrent server runs it in an executor
+    Parameters:
+        now: float - The time the FIN packet is received
+    Return:
+        replies: list - The FIN-ACK packet
+    """
+    def finish(self, now):
+        # Write the rest of the file before the FIN-ACK is sent, the checkpoint is not needed when the file is complete
+        if self.writer is not None:
+            self.writer.close()
+            if self.checkpoint is not None and self.writer.error is None:
+                self.checkpoint.remove()
+        self.state = "closed"
+        self.log("FIN-ACK packet is sent\n")
+        print_header(self.fin_ack[:self.header_struct.size], True, self.header_struct)
+
+        # Calculate the throughput with the bytes of the file, from the handshake to the FIN packet
+        self.metrics.finish(now)
+        self.log(f"The throughput is {format_throughput(self.metrics.total_data, self.metrics.duration())}", SUMMARY)
+        self.log("Connection Closes\n")
+
+        if logger.packets:
+            self.log(f"total_data: {self.metrics.total_data}", DEBUG)
+            self.log(f"time_in_seconds: {self.metrics.duration()}", DEBUG)
+        if self.metrics_file is not None:
+            self.metrics.write(self.metrics_file)
+        return [self.fin_ack]
+
+    """
+    Description:
+        Function to give up on the connection, the data received so far is written
+    Parameters:
+        reason: str - Why the connection is given up
+        now: float - The current time, None for time.monotonic()
+        keep: bool - Save the checkpoint, False when another connection has taken over the file with its checkpoint
+    Return:
+        None
+    """
+    def abort(self, reason, now=None, keep=True):
+        self.log(f"Error: {reason}", SUMMARY)
+        if not keep:
+            self.checkpoint = None
+            if self.writer is not None:
+                self.writer.release()
+        if self.writer is not None:
+            self.writer.close()
+            self.save_checkpoint()
+        self.state = "closed"
+        self.metrics.finish(time.monotonic() if now is None else now)
+        if self.metrics_file is not None:
+            self.metrics.write(self.metrics_file)
+
+    """
+    Description:
+        Function to save the checkpoint of a file that is not finished, so the client can resume it
+    Parameters:
+        None
+    Return:
+        None
+    """
+    def save_checkpoint(self):
+        if self.checkpoint is None or self.checkpoint.path is None or self.writer.error is not None:
+            return
+        try:
+            self.checkpoint.save(self.writer.offset)
+            self.log(f"{self.writer.offset} bytes of {self.checkpoint.path} are kept, the client can resume the file", SUMMARY)
+        except OSError as e:
+            self.log(f"Error: the checkpoint can not be saved, {e}", SUMMARY)
+
+"""
+Description:
+    Function to run the server to receive one file
+Parameters:
+    ip: str - The IP address of the server
+    port: int - The port of the server
+    discard: int - The packet to discard
+    flush: str - "buffered" to leave the written file to the OS, "fsync" to sync it to disk at FIN
+    mode: str - "gbn" for Go-Back-N, "sr" for Selective Repeat
+    metrics: str - The file to write the metrics of the transfer to, .json or .csv, None for no file
+    stats_port: int - The local TCP port to serve the metrics on while the transfer runs, None for no port
+    receive_buffer: int - The size of the kernel receive buffer of the socket in bytes, None for receive_buffers packets of the largest payload
+Return:
+    None - Run the server
+"""
+def run_server(ip, port, discard, flush=flush_mode, mode=default_mode, metrics=None, stats_port=None, receive_buffer=receive_buffer):
+    connection = None
+    try:
+        # Start connection
+        server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        socket_buffer = set_receive_buffer(server_socket, receive_buffer)
+        server_socket.bind((ip, port))
+        log("Server is listening...\n", SUMMARY)
+
+        # Preallocate the receive buffers, the packets are received directly into them
+        # NOTE: A parity packet has a 2-byte meta in front of its payload, so a buffer holds packet_size bytes.
+        # Until the SYN packet is received there are only the buffers of one batch, of the largest size, for the data sent with it
+        free_buffers = queue.Queue()
+        for _ in range(socket_batch):
+            free_buffers.put(bytearray(packet_size - payload_size + max_payload_size))
+        sized = False
+
+        # Receive the file from the first client
+        connection = ReceiverConnection(discard, flush, mode, free_buffers, metrics_file=metrics, socket_buffer=socket_buffer)
+        if stats_port is not None:
+            StatsServer(stats_port, lambda: [connection.metrics])
+        client_address = None
+        idle_timeout = None
+        buffers = []
+        while connection.state != "fin_received":
+            # Wait for a packet, then read the packets that arrived with it without blocking
+            # NOTE: Each packet is received into its own free buffer, the buffers that are not kept by the connection are reused
+            # Wake up for the delayed ACK if it is sent before the idle timeout
+            ack_wait = None if connection.ack_deadline is None else max(connection.ack_deadline - time.monotonic(), 0)
+            try:
+                wait_readable(server_socket, idle_timeout if ack_wait is None else ack_wait)
+            except socket.timeout:
+                if ack_wait is None:
+                    connection.abort("the client is not responding")
+                    return
+                for reply in connection.delayed_ack(time.monotonic()):
+                    server_socket.sendto(reply, client_address)
+                continue
+            received = []
+            try:
+                while len(received) < socket_batch:
+                    if len(buffers) <= len(received):
+                        buffers.append(free_buffers.get())
+                    buffer = buffers[len(received)]
+                    nbytes, address = server_socket.recvfrom_into(buffer, 0, socket.MSG_DONTWAIT)
+                    received.append((buffer, nbytes, address))
+            except BlockingIOError:
+                pass
+
+            now = time.monotonic()
+            kept = set()
+            for index, (buffer, nbytes, address) in enumerate(received):
+                if connection.state == "fin_received" or (client_address is not None and address != client_address):
+                    continue
+                replies = connection.handle_packet(memoryview(buffer)[:nbytes], buffer, now)
+                if connection.kept_buffer:
+                    kept.add(index)
+                for reply in replies:
+                    server_socket.sendto(reply, address)
+
+                # The client is the first address that sends a SYN packet
+                if client_address is None and connection.state != "listen":
+                    client_address = address
+            buffers = [buffer for index, buffer in enumerate(buffers) if index not in kept]
+
+            # Replace the receive buffers with buffers for the payload size accepted in the handshake, a small file needs fewer of them
+            # NOTE: The buffers kept by the connection are returned to free_buffers when they are written, and used with the new ones
+            if connection.state != "listen" and not sized:
+                sized = True
+                count = receive_buffers
+                if connection.file_size is not None:
+                    count = min(count, connection.file_size // connection.payload_size + 2 + socket_batch)
+                buffers = []
+                while not free_buffers.empty():
+                    free_buffers.get()
+                for _ in range(count):
+                    free_buffers.put(bytearray(packet_size - payload_size + connection.payload_size))
+
+            # Stop when the connection is given up
+            if connection.state == "closed":
+                server_socket.close()
+                return
+
+            # Give up when the client would have given up retransmitting, or resending the SYN packet
+            if connection.state in ("syn_received", "established"):
+                idle_timeout = connection.idle_timeout()
+
+        # Send FIN-ACK packet
+        for reply in connection.finish(time.monotonic()):
+            server_socket.sendto(reply, client_address)
+        server_socket.close()
+
+    # Exit on keyboard interrupt, the file that is not finished is kept for the client to resume
+    except KeyboardInterrupt:
+        log("Server is stopped", SUMMARY)
+        if connection is not None and connection.state == "established":
+            connection.abort("the server is stopped")
+    
+    # Handle socket errors
+    except socket.error as e:
+        log(f"Error: {e}", SUMMARY)
+
+"""
+Description:
+    Class for the asyncio datagram protocol of the concurrent server
+    Packets are demultiplexed by client address into a ReceiverConnection for each client
+Parameters:
+    discard: int - The packet to discard in each connection
+    flush: str - "buffered" to leave the written files to the OS, "fsync" to sync them to disk at FIN
+    mode: str - "gbn" for Go-Back-N, "sr" for Selective Repeat
+    max_sessions: int - The number of connections that can run at the same time
+    name: str - Printed in front of the messages of the connections
+    on_finish: function - Called with each connection that is finished, None to not report the connections
+"""
+class ServerProtocol(asyncio.DatagramProtocol):
+    """
+    Description:
+        Set up the protocol without any connections
+    Parameters:
+        discard: int - The packet to discard in each connection
+        flush: str - The flush mode, "buffered" or "fsync"
+        mode: str - The reliability mode, "gbn" or "sr"
+        max_sessions: int - The number of connections that can run at the same time
+        name: str - Printed in front of the messages of the connections
+        on_finish: function - Called with each connection that is finished
+        metrics: str - The metrics file, each connection writes its metrics to it with the client address added, None for no files
+    Return:
+        None
+    """
+    def __init__(self, discard, flush, mode, max_sessions, name="", on_finish=None, metrics=None):
+        self.discard = discard
+        self.flush = flush
+        self.mode = mode
+        self.max_sessions = max_sessions
+        self.name = name
+        self.on_finish = on_finish
+        self.metrics = metrics
+        self.connections = {} # format: {client_address: ReceiverConnection}
+        self.finishing = {} # Connections writing the rest of the file, format: {client_address: asyncio.Task}
+        self.ack_timers = {} # Timers of the delayed ACKs, format: {client_address: asyncio.TimerHandle}
+        self.transport = None
+        self.socket_buffer = None   # Size of the kernel receive buffer of the socket, set when the socket is bound
+
+    """
+    Description:
+        Function called by asyncio when the socket is bound
+    Parameters:
+        transport: asyncio.DatagramTransport - The transport to send packets with
+    Return:
+        None
+    """
+    def connection_made(self, transport):
+        self.transport = transport
+
+    """
+    Description:
+        Function called by asyncio for every received packet
+    Parameters:
+        data: bytes - The received packet
+        address: tuple - The address of the client
+    Return:
+        None
+    """
+    def datagram_received(self, data, address):
+        now = time.monotonic()
+        connection = self.connections.get(address)
+
+        # A SYN packet starts a new connection, or a new transfer from a client that is done
+        syn = len(data) >= DRTP_struct.size and parse_flags(DRTP_struct.unpack_from(data)[2])[0] == 1
+        if syn:
+            if connection is None or connection.state == "closed":
+                active = sum(1 for other in self.connections.values() if other.state != "closed")
+                if active >= self.max_sessions:
+                    # Refuse the connection with a RST packet
+                    self.transport.sendto(send_packet(0, 0, set_flags(0, 0, 0, 1)), address)
+                    log(f"{self.name}Refused {address[0]}:{address[1]}, {active} sessions are running")
+                    return
+                connection = ReceiverConnection(self.discard, self.flush, self.mode, name=f"{self.name}[{address[0]}:{address[1]}] ",
+                                                metrics_file=metrics_path(self.metrics, f"{address[0]}_{address[1]}"), socket_buffer=self.socket_buffer)
+                self.connections[address] = connection
+        if connection is None:
+            return
+
+        for reply in connection.handle_packet(memoryview(data), None, now):
+            self.transport.sendto(reply, address)
+
+        # A client that resumes a file on a new connection takes it over from its old connection
+        if syn and connection.checkpoint is not None and connection.checkpoint.path is not None:
+            self.take_over(connection, address, now)
+
+        # Start the timer of a delayed ACK
+        if connection.ack_deadline is not None and address not in self.ack_timers:
+            self.ack_timers[address] = asyncio.get_running_loop().call_later(connection.ack_deadline - now, self.send_delayed_ack, connection, address)
+
+        # Write the rest of the file without blocking the other connections, then send the FIN-ACK packet
+        if connection.state == "fin_received" and address not in self.finishing:
+            self.finishing[address] = asyncio.ensure_future(self.finish(connection, address, now))
+
+    """
+    Description:
+        Function to give up the other connections that write the file of a resumed connection, as the client has reconnected
+        # NOTE: Their checkpoint is not saved and their file is not cut back, so they do not undo the resumed transfer when they are closed
+    Parameters:
+        connection: ReceiverConnection - The connection that has loaded the checkpoint
+        address: tuple - The address of the client
+        now: float - The time the SYN packet is received
+    Return:
+        None
+    """
+    def take_over(self, connection, address, now):
+        for other_address, other in list(self.connections.items()):
+            if (other_address == address or other_address in self.finishing or other.state == "closed" or other.checkpoint is None
+                    or other.checkpoint.file != connection.checkpoint.file):
+                continue
+            del self.connections[other_address]
+            timer = self.ack_timers.pop(other_address, None)
+            if timer is not None:
+                timer.cancel()
+            asyncio.get_running_loop().run_in_executor(None, other.abort, f"the file is resumed by {address[0]}:{address[1]}", now, False)
+
+    """
+    Description:
+        Function called by the timer of a delayed ACK to send the ACK
+    Parameters:
+        connection: ReceiverConnection - The connection with the delayed ACK
+        address: tuple - The address of the client
+    Return:
+        None
+    """
+    def send_delayed_ack(self, connection, address):
+        del self.ack_timers[address]
+        now = time.monotonic()
+        for reply in connection.delayed_ack(now):
+            self.transport.sendto(reply, address)
+        # The ACK is already sent, or a new packet has delayed it again
+        if connection.ack_deadline is not None:
+            self.ack_timers[address] = asyncio.get_running_loop().call_later(connection.ack_deadline - now, self.send_delayed_ack, connection, address)
+
+    """
+    Description:
+        Coroutine to finish a connection after the FIN packet, the file is written in an executor
+    Parameters:
+        connection: ReceiverConnection - The connection to finish
+        address: tuple - The address of the client
+        now: float - The time the FIN packet is received
+    Return:
+        None
+    """
+    async def finish(self, connection, address, now):
+        try:
+            replies = await asyncio.get_running_loop().run_in_executor(None, connection.finish, now)
+            for reply in replies:
+                self.transport.sendto(reply, address)
+            if self.on_finish is not None:
+                self.on_finish(connection)
+        finally:
+            del self.finishing[address]
+
+    """
+    Description:
+        Coroutine to remove connections that are idle for longer than their idle timeout, or closed for longer than the linger time
+    Parameters:
+        None
+    Return:
+        None
+    """
+    async def sweep(self):
+        while True:
+            await asyncio.sleep(sweep_interval)
+            now = time.monotonic()
+            for address, connection in list(self.connections.items()):
+                idle = now - connection.last_activity
+                if connection.state == "closed":
+                    # Closed connections are kept to resend a lost FIN-ACK packet
+                    if idle > connection.idle_timeout():
+                        del self.connections[address]
+                elif address not in self.finishing and idle > connection.idle_timeout():
+                    del self.connections[address]
+                    await asyncio.get_running_loop().run_in_executor(None, connection.abort, "the client is not responding")
+
+"""
+Description:
+    Function to run the concurrent server that receives files from many clients on one socket until it is stopped
+Parameters:
+    ip: str - The IP address of the server
+    port: int - The port of the server
+    discard: int - The packet to discard in each connection
+    flush: str - "buffered" to leave the written files to the OS, "fsync" to sync them to disk at FIN
+    mode: str - "gbn" for Go-Back-N, "sr" for Selective Repeat
+    max_sessions: int - The number of connections that can run at the same time
+    reuse_port: bool - Bind with SO_REUSEPORT, so that worker processes can share the port
+    name: str - Printed in front of the messages of the server
+    on_finish: function - Called with each connection that is finished
+    metrics: str - The metrics file, each transfer writes its metrics to it with the client address added, None for no files
+    stats_port: int - The local TCP port to serve the metrics of the connections on, None for no port
+    receive_buffer: int - The size of the kernel receive buffer of the socket in bytes, None for receive_buffers packets of the largest payload
+Return:
+    None - Run the server
+"""
+def run_concurrent_server(ip, port, discard, flush=flush_mode, mode=default_mode, max_sessions=max_sessions, reuse_port=False, name="", on_finish=None,
+                          metrics=None, stats_port=None, receive_buffer=receive_buffer):
+    async def serve():
+        loop = asyncio.get_running_loop()
+        protocol = ServerProtocol(discard, flush, mode, max_sessions, name, on_finish, metrics)
+        if stats_port is not None:
+            StatsServer(stats_port, lambda: [connection.metrics for connection in list(protocol.connections.values())])
+        transport, _ = await loop.create_datagram_endpoint(lambda: protocol, local_addr=(ip, port), reuse_port=reuse_port)
+        protocol.socket_buffer = set_receive_buffer(transport.get_extra_info("socket"), receive_buffer)
+        log(f"{name}Server is listening for up to {max_sessions} clients...\n", SUMMARY)
+        try:
+            await protocol.sweep()
+        finally:
+            transport.close()
+            # Keep the files that are not finished for the clients to resume
+            for connection in protocol.connections.values():
+                if connection.state == "established":
+                    connection.abort("the server is stopped")
+
+    try:
+        asyncio.run(serve())
+
+    # Exit on keyboard interrupt
+    except KeyboardInterrupt:
+        log(f"{name}Server is stopped", SUMMARY)
+
+    # Handle socket errors
+    except socket.error as e:
+        log(f"{name}Error: {e}", SUMMARY)
+
+"""
+Description:
+    Function run by a worker process of the server, a concurrent server that reports each finished transfer to the parent
+Parameters:
+    index: int - The number of the worker
+    stats: multiprocessing.Queue - The queue to report the finished transfers to, format: (index, total_data, start_time, end_time)
+    args: tuple - The arguments of run_concurrent_server before reuse_port
+    metrics: str - The metrics file of the transfers, None for no files
+    stats_port: int - The stats port of the first worker, the other workers use the next ports, None for no port
+    receive_buffer: int - The size of the kernel receive buffer of the socket of the worker in bytes, None for receive_buffers packets of the largest payload
+Return:
+    None - Run the worker
+"""
+def run_worker(index, stats, *args, metrics=None, stats_port=None, receive_buffer=receive_buffer):
+    def report(connection):
+        stats.put((index, connection.metrics.total_data, connection.metrics.start_time, connection.metrics.end_time))
+
+    # NOTE: The messages of a process are written at exit, the atexit handlers do not run in worker processes
+    try:
+        run_concurrent_server(*args, reuse_port=True, name=f"[worker {index}] ", on_finish=report,
+                              metrics=metrics, stats_port=None if stats_port is None else stats_port + index - 1, receive_buffer=receive_buffer)
+    finally:
+        logger.flush()
+
+"""
+Description:
+    Function to run the server as worker processes that share the port with SO_REUSEPORT, so the kernel spreads the clients over the cores
+    The parent process restarts workers that die and prints the combined throughput of the workers
+    # NOTE: time.monotonic is the same clock in all the processes, so the transfer times of the workers can be combined
+Parameters:
+    ip: str - The IP address of the server
+    port: int - The port of the server
+    discard: int - The packet to discard in each connection
+    flush: str - "buffered" to leave the written files to the OS, "fsync" to sync them to disk at FIN
+    mode: str - "gbn" for Go-Back-N, "sr" for Selective Repeat
+    max_sessions: int - The number of connections each worker can run at the same time
+    workers: int - The number of worker processes
+    metrics: str - The metrics file, each transfer writes its metrics to it with the client address added, None for no files
+    stats_port: int - The local TCP port of the metrics of worker 1, worker N uses stats_port + N - 1, None for no port
+    receive_buffer: int - The size of the kernel receive buffer of the socket of each worker in bytes, None for receive_buffers packets of the largest payload
+Return:
+    None - Run the server
+"""
+def run_server_workers(ip, port, discard, flush=flush_mode, mode=default_mode, max_sessions=max_sessions, workers=1, metrics=None, stats_port=None,
+                       receive_buffer=receive_buffer):
+    stats = multiprocessing.Queue()
+    args = (ip, port, discard, flush, mode, max_sessions)
+    worker_options = {"metrics": metrics, "stats_port": stats_port, "receive_buffer": receive_buffer}
+
+    # Start the workers, the messages are written first so that the workers do not inherit them
+    logger.flush()
+    processes = {}
+    for index in range(1, workers + 1):
+        processes[index] = multiprocessing.Process(target=run_worker, args=(index, stats) + args, kwargs=worker_options, daemon=True)
+        processes[index].start()
+
+    # Totals of the finished transfers, format: {index: [transfers, total_data]}
+    totals = {index: [0, 0] for index in processes}
+    first_start = None
+    last_end = None
+    try:
+        while True:
+            # Restart the workers that died
+            for index, process in processes.items():
+                if not process.is_alive():
+                    log(f"Worker {index} died with exit code {process.exitcode}, restarting it", SUMMARY)
+                    processes[index] = multiprocessing.Process(target=run_worker, args=(index, stats) + args, kwargs=worker_options, daemon=True)
+                    processes[index].start()
+
+            # Combine the throughput of the finished transfers
+            try:
+                index, total_data, start_time, end_time = stats.get(timeout=sweep_interval)
+            except queue.Empty:
+                continue
+            totals[index][0] += 1
+            totals[index][1] += total_data
+            first_start = start_time if first_start is None else min(first_start, start_time)
+            last_end = end_time if last_end is None else max(last_end, end_time)
+            transfers = sum(total[0] for total in totals.values())
+            received = sum(total[1] for total in totals.values())
+            log(f"Worker {index} finished a transfer, {transfers} transfers in total")
+            log(f"The combined throughput of the workers is {format_throughput(received, last_end - first_start)}", SUMMARY)
+            if logger.packets:
+                log(f"Transfers and bytes per worker: {totals}", DEBUG)
+
+    # Exit on keyboard interrupt
+    except KeyboardInterrupt:
+        for process in processes.values():
+            process.join(timeout=1)
+            if process.is_alive():
+                process.terminate()
+        log("Server is stopped", SUMMARY)
+
+"""
+Description:
+    Class for the sending side of a connection after the handshake, the sliding window of the client without any socket
+    The caller sends the packets the connection returns, hands it the received ACKs and wakes it up when its timer expires
+    # NOTE: All the times are passed in, so the same connection runs over UDP with time.monotonic() and in the simulator with a virtual clock
+Parameters:
+    reader: FileReader - The reader of the payloads, any object with total_packets, read(seq_num) and close()
+                         # NOTE: total_packets is read again for every packet, a CompressedReader only knows it at the end
+    mode: str - "gbn" for Go-Back-N, "sr" for Selective Repeat
+    congestion: str - The congestion control algorithm, a key of congestion_algorithms
+    max_window: int - The upper bound of the congestion window in packets, None for no bound
+    rtt: RTTEstimator - The estimator with the RTT of the handshake
+    header_struct: struct.Struct - The header format of the connection
+    sack: bool - True if the server sends cumulative ACKs with SACK blocks
+    metrics: TransferMetrics - The metrics of the transfer
+    fec: tuple - The parity packets accepted by the server, format: (data packets in a group, parity packets in a group, auto), None for none
+    pacer: Pacer - The pacer that spreads the packets over the RTT, None to send the packets the window allows at once
+    receive_window: int - The receive window of the SYN-ACK packet, the ACKs carry the window after it, None if the server does not advertise it
+"""
+class SenderConnection:
+    """
+    Description:
+        Set up the sliding window before the first packet is sent
+    Parameters:
+        See the class description
+    Return:
+        None
+    """
+    def __init__(self, reader, mode=default_mode, congestion=congestion_control, max_window=None, rtt=None, header_struct=DRTP_struct, sack=False, metrics=None,
+                 fec=None, pacer=None, receive_window=None):
+        self.reader = reader
+        self.compressed = getattr(reader, "compressed", {}) # Sizes before compression of the compressed payloads, format: {seq_num: size}
+        self.mode = mode
+        self.cc = congestion_algorithms[congestion](max_window)
+        self.rtt = rtt or RTTEstimator()
+        self.header_struct = header_struct
+        self.sack = sack
+        self.metrics = metrics or TransferMetrics("client")
+        if sack:
+            self.rtt.ack_delay = ack_delay
+
+        self.base = 1       # Oldest packet that is not acknowledged
+        self.next_seq = 1   # Next packet to send, moved back to base on timeout in GBN mode
+        self.highest_sent = 0   # Highest packet sent so far
+        self.window_payloads = {}   # Payloads of the packets in the sliding window, kept for retransmission
+        self.send_times = {}    # Send time of the packets in the sliding window that are not retransmitted, used to measure the RTT
+        self.deadlines = {}     # Retransmission deadline for each packet in the sliding window in SR mode
+        self.retries = 0    # Timeouts in a row without an ACK for a new packet
+        self.dup_acks = 0   # ACKs in a row that do not acknowledge the oldest packet
+        self.recover = 0    # Highest packet sent when the window was last reduced, it is reduced once per window of packets
+        self.recovering = False # In loss recovery in SR mode, the holes below the highest SACKed packet are resent
+        self.highest_sacked = 0 # Highest packet acknowledged by an ACK or a SACK block
+        self.rescued = set()    # Holes resent in the current loss recovery, each hole is resent once by the recovery
+        self.fec = ParityEncoder(*fec) if fec else None
+        self.losses = 0     # Packets resent after a timeout or duplicate ACKs
+        self.rebuilt = 0    # Packets the server has rebuilt from parity packets, from the sequence number of its ACKs
+        self.pacer = pacer
+        self.pending = []   # Packets whose timer has expired in SR mode, resent as the pacer allows
+        self.receive_window = receive_window    # Packets the server has room for after the cumulative ACK, None for no limit
+
+    """
+    Description:
+        Function to get the packets that can be in flight, the congestion window or the receive window of the server if it is smaller
+        # NOTE: One packet is always allowed, its ACK brings the new window when a closed window opens again
+    Parameters:
+        None
+    Return:
+        window: float - The window in packets
+    """
+    def window(self):
+        if self.receive_window is None:
+            return self.cc.window()
+        return min(self.cc.window(), max(1, self.receive_window))
+
+    """
+    Description:
+        Function to check if all the packets are acknowledged
+    Parameters:
+        None
+    Return:
+        done: bool - True if the data is sent
+    """
+    def done(self):
+        return self.base > self.reader.total_packets
+
+    """
+    Description:
+        Function to check if the server has stopped responding
+    Parameters:
+        None
+    Return:
+        gave_up: bool - True after more than max_retries timeouts in a row
+    """
+    def gave_up(self):
+        return self.retries > max_retries
+
+    """
+    Description:
+        Function to get the packets the congestion window allows to be sent
+    Parameters:
+        now: float - The time the packets are sent
+        limit: int - The largest number of packets, None for the whole window
+    Return:
+        packets: list - The packets to send, format: [(seq_num, payload)]
+    """
+    def transmit(self, now, limit=None):
+        batch = []
+        pacer = self.pacer
+        if pacer is not None:
+            pacer.refill(now, self.window(), self.rtt.srtt, self.cc.cwnd < getattr(self.cc, "ssthresh", 0))
+
+            # The packets whose timer has expired go first, they are already in the window
+            while self.pending and pacer.tokens > 0 and (limit is None or len(batch) < limit):
+                resend_seq_num = self.pending.pop(0)
+                if resend_seq_num in self.window_payloads:
+                    batch.append(self.resend(resend_seq_num, now))
+
+        while self.next_seq - self.base < self.window() and self.next_seq <= self.reader.total_packets and (limit is None or len(batch) < limit):
+            if pacer is not None and pacer.tokens <= 0:
+                break
+            sent_seq = self.next_seq
+            if sent_seq not in self.window_payloads:
+                self.window_payloads[sent_seq] = self.reader.read(sent_seq)
+            batch.append((sent_seq, self.window_payloads[sent_seq]))
+            if pacer is not None:
+                pacer.consume(self.header_struct.size + len(self.window_payloads[sent_seq]))
+            self.next_seq += 1
+            self.deadlines[sent_seq] = now + self.rtt.timeout()
+            if sent_seq > self.highest_sent:
+                self.send_times[sent_seq] = now
+                self.highest_sent = sent_seq
+                self.metrics.count("packets")
+                if sent_seq in self.compressed:
+                    self.metrics.count("compressed")
+                if self.fec is not None:
+                    self.fec.add(sent_seq, self.window_payloads[sent_seq], sent_seq in self.compressed, sent_seq == self.reader.total_packets)
+                if logger.packets:
+                    log(f"packet with seq = {sent_seq} is sent, sliding window = [{self.base}..{sent_seq}]", DEBUG, timed=True)
+            else:
+                self.metrics.retransmitted(now)
+                log(f"retransmitting packet with seq = {sent_seq}", EVENT, timed=True)
+
+        # Close the group early when the window is full and waits for a packet of the group, its parity packets may rebuild the packet
+        if self.fec is not None and self.fec.lanes and self.next_seq - self.base >= self.window() and self.base >= self.fec.start:
+            self.fec.close()
+        return batch
+
+    """
+    Description:
+        Function to get the parity packets of the groups closed so far, they are sent after the data packets, outside the congestion window
+    Parameters:
+        None
+    Return:
+        packets: list - The parity packets, format: [(seq_num, ack_num, payload)]
+    """
+    def parity_packets(self):
+        if self.fec is None or not self.fec.packets:
+            return []
+        packets, self.fec.packets = self.fec.packets, []
+        self.metrics.count("parity", len(packets))
+        self.fec.adapt(self.highest_sent, self.losses + self.rebuilt)
+        return packets
+
+    """
+    Description:
+        Function to get how long to wait for ACKs before the timer expires
+        # NOTE: SR waits for the oldest timer, the whole window shares one timer in GBN mode
+    Parameters:
+        now: float - The current time
+    Return:
+        timeout: float - The time to wait in seconds
+    """
+    def next_timeout(self, now):
+        if self.mode == "sr" and self.deadlines:
+            return max(min(self.deadlines.values()) - now, 0)
+        return self.rtt.timeout()
+
+    """
+    Description:
+        Function to get how long to wait before the pacer allows the next packets
+    Parameters:
+        now: float - The current time
+    Return:
+        delay: float - The time to wait in seconds, None if there is no pacer or the window allows no packets
+    """
+    def next_send(self, now):
+        if self.pacer is None:
+            return None
+        if not self.pending and (self.next_seq - self.base >= self.window() or self.next_seq > self.reader.total_packets):
+            return None
+        return self.pacer.delay()
+
+    """
+    Description:
+        Function to resend a packet at once, outside the congestion window
+    Parameters:
+        seq_num: int - The packet to resend
+        now: float - The time it is resent
+    Return:
+        packet: tuple - The packet to send, format: (seq_num, payload)
+    """
+    def resend(self, seq_num, now):
+        self.metrics.retransmitted(now)
+        if self.pacer is not None:
+            self.pacer.consume(self.header_struct.size + len(self.window_payloads[seq_num]))
+        self.send_times.pop(seq_num, None)
+        self.deadlines[seq_num] = now + self.rtt.timeout()
+        return (seq_num, self.window_payloads[seq_num])
+
+    """
+    Description:
+        Function to get the packets in flight during loss recovery, as the pipe of RFC 6675
+        # NOTE: A packet below the highest SACKed packet that is not resent is lost, it has left the network
+    Parameters:
+        None
+    Return:
+        pipe: int - The packets above the highest SACKed packet and the resent holes that are not acknowledged
+    """
+    def pipe(self):
+        return sum(1 for sent_seq in self.window_payloads if sent_seq < self.next_seq and (sent_seq > self.highest_sacked or sent_seq in self.rescued))
+
+    """
+    Description:
+        Function to resend the holes below the highest SACKed packet during loss recovery in SR mode, as the window allows
+        # NOTE: Each hole is resent once by the recovery, a resent hole that is lost again waits for its timer
+    Parameters:
+        now: float - The time the holes are resent
+    Return:
+        packets: list - The packets to resend, format: [(seq_num, payload)]
+    """
+    def recover_holes(self, now):
+        if not self.recovering:
+            return []
+        # The recovery ends when the packets sent before it are acknowledged
+        if self.base > self.recover:
+            self.recovering = False
+            self.rescued.clear()
+            return []
+        resent = []
+        pipe = self.pipe()
+        for hole in sorted(sent_seq for sent_seq in self.window_payloads if sent_seq < self.highest_sacked and sent_seq not in self.rescued):
+            if pipe >= self.window():
+                break
+            if hole in self.pending:
+                continue
+            log(f"packet with seq = {hole} is lost below SACKed packet {self.highest_sacked}, retransmitting it", EVENT, timed=True)
+            self.metrics.count("sack_retransmits")
+            self.losses += 1
+            self.rescued.add(hole)
+            pipe += 1
+            resent.append(self.resend(hole, now))
+        return resent
+
+    """
+    Description:
+        Function to handle an ACK packet and move the sliding window
+    Parameters:
+        packet: bytes - The received ACK packet
+        now: float - The time it is received
+    Return:
+        packets: list - The packets to resend at once, format: [(seq_num, payload)]
+    """
+    def handle_ack(self, packet, now):
+        header_struct = self.header_struct
+        rebuilt, check_ack_num, flags = unpack_header(packet[:header_struct.size], header_struct)
+        acked_seq = check_ack_num - 1
+        resent = []
+        if self.fec is not None:
+            self.rebuilt = max(self.rebuilt, rebuilt)
+        payload = packet[header_struct.size:]
+        if self.receive_window is not None and len(payload) >= receive_window_struct.size:
+            window = receive_window_struct.unpack_from(payload)[0]
+            if window == 0 and self.receive_window > 0:
+                self.metrics.count("zero_windows")
+                log("The receive window of the server is closed", EVENT, timed=True)
+            self.receive_window = window
+            payload = payload[receive_window_struct.size:]
+
+        # With SACK the ACK is cumulative and the packets in the SACK blocks are acknowledged as well
+        if self.sack:
+            # The server repeats the cumulative ACK for every packet after a gap, the oldest packet is resent
+            # after dup_ack_threshold of them instead of waiting for the timeout
+            # NOTE: Only one loss per window of packets reduces the congestion window
+            if acked_seq == self.base - 1 and self.base <= self.highest_sent:
+                self.dup_acks += 1
+                self.metrics.count("duplicate_acks")
+                if self.dup_acks == dup_ack_threshold:
+                    self.metrics.count("fast_retransmits")
+                    self.losses += 1
+                    log(f"{self.dup_acks} duplicate ACKs, fast retransmitting packet with seq = {self.base}", EVENT, timed=True)
+                    if self.base > self.recover:
+                        self.cc.on_loss()
+                        self.recover = self.highest_sent
+                    # GBN resends the window from the lost packet, the server has not buffered the packets after it
+                    if self.mode == "gbn":
+                        self.send_times.clear()
+                        self.next_seq = self.base
+                    else:
+                        resent.append(self.resend(self.base, now))
+                        self.recovering = True
+                        self.rescued.add(self.base)
+            elif acked_seq >= self.base:
+                self.dup_acks = 0
+
+            acked = [sacked_seq for sacked_seq in range(self.base, min(acked_seq, self.highest_sent) + 1) if sacked_seq in self.window_payloads]
+            blocks = unpack_sack_blocks(payload, header_struct) if flags[4] == 1 else []
+            for start, end in blocks:
+                acked.extend(sacked_seq for sacked_seq in range(max(start, self.base), min(end, self.highest_sent + 1)) if sacked_seq in self.window_payloads)
+            print_header(packet[:header_struct.size], False, header_struct)
+            if not acked:
+                resent.extend(self.recover_holes(now))
+                return resent
+            self.highest_sacked = max(self.highest_sacked, max(acked))
+
+            # Measure the RTT with the newest packet if it is not retransmitted
+            sample = None
+            if acked[-1] in self.send_times:
+                sample = now - self.send_times[acked[-1]]
+                self.rtt.sample(sample)
+                self.metrics.rtt(now, sample)
+            self.retries = 0
+            for sacked_seq in acked:
+                self.acknowledge(sacked_seq, now)
+            self.cc.on_ack(len(acked), sample)
+            if logger.packets:
+                log(f"ACK for packet = {acked_seq} is received" + (f", SACK blocks {blocks}" if blocks else ""), DEBUG, timed=True)
+            while self.base <= self.highest_sent and self.base not in self.window_payloads:
+                self.base += 1
+            self.next_seq = max(self.next_seq, self.base)
+            resent.extend(self.recover_holes(now))
+            return resent
+
+        # Ignore ACKs for packets outside the sliding window
+        print_header(packet[:header_struct.size], False, header_struct)
+        if not (self.base <= acked_seq <= self.highest_sent and acked_seq in self.window_payloads):
+            return resent
+
+        # Measure the RTT if the packet is not retransmitted
+        sample = None
+        if acked_seq in self.send_times:
+            sample = now - self.send_times[acked_seq]
+            self.rtt.sample(sample)
+            self.metrics.rtt(now, sample)
+        self.retries = 0
+
+        # SR acknowledges each packet, the window moves past the oldest acknowledged packets
+        if self.mode == "sr":
+            self.acknowledge(acked_seq, now)
+            self.cc.on_ack(1, sample)
+            if logger.packets:
+                log(f"ACK for packet = {acked_seq} is received", DEBUG, timed=True)
+            while self.base < self.next_seq and self.base not in self.window_payloads:
+                self.base += 1
+
+        # GBN acknowledges every packet up to the ACK
+        else:
+            self.cc.on_ack(acked_seq - self.base + 1, sample)
+            if acked_seq == self.base and logger.packets:
+                log(f"ACK for packet = {acked_seq} is received", DEBUG, timed=True)
+            while self.base <= acked_seq:
+                if self.base != acked_seq and logger.packets:
+                    log(f"Did not receive ACK for packet = {self.base}, skipping to {acked_seq}", DEBUG, timed=True)
+                self.acknowledge(self.base, now)
+                self.base += 1
+            self.next_seq = max(self.next_seq, self.base)
+        return resent
+
+    """
+    Description:
+        Function to remove an acknowledged packet from the sliding window
+    Parameters:
+        seq_num: int - The acknowledged packet
+        now: float - The time it is acknowledged
+    Return:
+        None
+    """
+    def acknowledge(self, seq_num, now):
+        # The goodput is the bytes of the file, without the filename in the first payload and before compression
+        payload = self.window_payloads.pop(seq_num)
+        size = self.compressed.pop(seq_num, len(payload))
+        self.metrics.delivered(now, size - (max_filename_length if seq_num == 1 else 0))
+        self.deadlines.pop(seq_num, None)
+        self.send_times.pop(seq_num, None)
+
+    """
+    Description:
+        Function to handle the timers after waiting for ACKs
+    Parameters:
+        now: float - The current time
+        timed_out: bool - True if no ACK arrived before next_timeout
+    Return:
+        packets: list - The packets to resend at once, format: [(seq_num, payload)]
+    """
+    def handle_timeout(self, now, timed_out):
+        resent = []
+
+        # Go back to the oldest packet on timeout in GBN mode, the window is resent as the congestion window allows
+        if timed_out and self.mode == "gbn":
+            log("RTO occurred", EVENT, timed=True)
+            self.metrics.count("timeouts")
+            self.losses += 1
+            self.rtt.on_timeout()
+            self.cc.on_timeout()
+            self.retries += 1
+            self.send_times.clear()
+            self.next_seq = self.base
+
+        # Resend only the packets whose timer has expired in SR mode
+        if self.mode == "sr":
+            # NOTE: Only the timer of the oldest packet backs off and counts as a timeout in a row, the other packets of a burst of losses
+            # expire one by one and would make the sender give up after max_retries of them
+            expired = [resend_seq_num for resend_seq_num, deadline in self.deadlines.items() if deadline <= now]
+            self.losses += len(expired)
+            if self.base in expired:
+                self.metrics.count("timeouts")
+                self.rtt.on_timeout()
+                self.cc.on_timeout()
+                self.retries += 1
+                self.recover = self.highest_sent
+                # The holes SACKed packets show after the timeout are resent as they are found, the expired packets are resent here
+                self.recovering = self.sack
+                self.rescued.clear()
+            elif expired and max(expired) > self.recover:
+                self.cc.on_loss()
+                self.recover = self.highest_sent
+            if self.recovering:
+                self.rescued.update(expired)
+            for resend_seq_num in expired:
+                log(f"RTO occurred, retransmitting packet with seq = {resend_seq_num}", EVENT, timed=True)
+                # The pacer spreads the expired packets like new ones, instead of resending the window in one burst
+                if self.pacer is not None:
+                    del self.deadlines[resend_seq_num]
+                    self.pending.append(resend_seq_num)
+                else:
+                    resent.append(self.resend(resend_seq_num, now))
+
+        self.metrics.window(now, self.cc.window())
+        if logger.packets:
+            log(f"cwnd: {self.cc.cwnd:.2f}, rto: {self.rtt.timeout():.6f}", DEBUG)
+        return resent
+
+"""
+Description:
+    Function to run the client to send the file
+Parameters:
+    ip: str - The IP address of the server
+    port: int - The port of the server
+    filename: str - The name of the file to send, or a list of files and directories to send in one session
+    max_window: int - The upper bound of the sliding window in packets, None for no bound
+    mode: str - "gbn" for Go-Back-N, "sr" for Selective Repeat
+    congestion: str - The congestion control algorithm, a key of congestion_algorithms
+    file_range: tuple - The part of the file to send, format: (offset, length, size of the whole file), None for the whole file
+    metrics: str - The file to write the metrics of the transfer to, .json or .csv, None for no file
+    stats_port: int - The local TCP port to serve the metrics on while the transfer runs, None for no port
+    compression: str - The compression method of the payloads, a key of compression_methods, "none" or None for no compression
+    delta: bool - Send a single file as a delta against the copy the server has of it, if it has one
+    fec: tuple - The parity packets to send if the server supports them, format: (data packets in a group, parity packets in a group, auto),
+                 see parse_fec, None for none
+    pacing: str - "window" to spread the packets of the window over the RTT, "none" to send them at once
+    send_rate: float - The largest rate to send at in bits per second, None for no limit
+    offered_payload: int - The payload size to offer the server, "auto" for the largest that fits the MTU of the route, see route_payload_size
+    zero_rtt: bool - Send the first window with the SYN packet, without compression or a delta, the server must support it
+Return:
+    sent: bool - True if the file is sent
+"""
+def run_client(ip, port, filename, max_window=None, mode=default_mode, congestion=congestion_control, file_range=None, metrics=None, stats_port=None,
+               compression=None, delta=False, fec=None, pacing=pacing, send_rate=send_rate, offered_payload=client_payload_size, zero_rtt=False):
+    try:
+        # Start connection
+        client_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        client_socket.connect((ip, port))
+        seq_num = 0
+
+        # Open the file, the chunks are read when they are sent
+        # NOTE: A session sends the files one after the other in the same sliding window, with one handshake and one teardown
+        session = not isinstance(filename, str)
+        try:
+            if session:
+                reader = SessionReader(filename)
+                filename = f"{len(reader.files)} files"
+            else:
+                reader = FileReader(filename, *file_range[:2]) if file_range else FileReader(filename)
+        except OSError as e:
+            log(f"Error: {e}", SUMMARY)
+            exit(1)
+        total_packets = reader.total_packets
+
+        log("Connection Establisht Phase:\n")
+
+        # Send SYN packet with the options of the client, the server that advertises its receive window answers with the window
+        client_options = {"seq32": 1, "sack": 1, "rwnd": 1}
+        if file_range:
+            client_options["range"] = file_range
+        if session:
+            client_options["session"] = 1
+        if compression in compression_methods:
+            client_options["compress"] = (compression_methods[compression], compress_block)
+        if fec:
+            client_options["fec"] = fec[:2]
+        if offered_payload == "auto":
+            offered_payload = route_payload_size(client_socket)
+        # NOTE: The server lowers a payload size with parity packets to 32767 bytes, the data sent with the SYN packet must fit
+        if fec and zero_rtt:
+            offered_payload = min(offered_payload, 0x7FFF)
+        if offered_payload != payload_size:
+            client_options["payload"] = offered_payload
+        # Tell the server the name and size of a single file, so it can allocate the file before the data arrives
+        if not session:
+            name = reader.encoded_filename.rstrip(b'\0')
+            client_options["file"] = session_record_struct.pack(len(name), file_range[2] if file_range else reader.filesize) + name
+        # Offer to resume a whole file, a server with a part of it from an earlier transfer answers with the range to send
+        if not session and not file_range:
+            client_options["resume"] = reader.identity()
+            # Offer to send the file as a delta against the server's copy of it
+            if delta:
+                client_options["delta"] = reader.encoded_filename.rstrip(b'\0')
+        # Probe the path with a SYN packet as large as the data packets, if it is lost the path drops large packets
+        # and the SYN packet is sent again without the payload option, for payloads of payload_size bytes
+        # NOTE: The size is not probed when the first window is sent with the SYN packet, the window is already sent with it
+        if zero_rtt:
+            client_options["early"] = 1
+        probe = offered_payload > payload_size and not zero_rtt
+        options_payload = pack_options(client_options)
+        if probe:
+            options_payload = pad_options(options_payload, DRTP_extended_struct.size + 2 + offered_payload - DRTP_struct.size)
+        packet = send_packet(seq_num, 0, set_flags(1, 0, 0, 0), options_payload)
+        client_socket.send(packet)
+        syn_time = time.monotonic()
+        log("SYN packet is sent" + (f", {len(packet)} bytes to probe the path" if probe else ""))
+        print_header(packet[:6], True)
+        rtt = RTTEstimator()
+        transfer = TransferMetrics("client", f"{filename} to {ip}:{port}")
+        if stats_port is not None:
+            StatsServer(stats_port, lambda: [transfer])
+
+        # Send the first window after the SYN packet without waiting for the SYN-ACK packet, with the options of the SYN packet
+        # NOTE: The packets have the acknowledgment number 0, a server that does not accept all the options as they are offered drops them
+        connection = None
+        pacer = None
+        if zero_rtt:
+            reader.set_payload_size(offered_payload)
+            pacer = Pacer(pacing == "window", send_rate, DRTP_extended_struct.size + offered_payload) if pacing == "window" or send_rate else None
+            connection = SenderConnection(reader, mode, congestion, max_window, rtt, DRTP_extended_struct, True, transfer, None, pacer)
+            sender = PacketSender(client_socket, DRTP_extended_struct)
+            early = connection.transmit(syn_time, socket_batch)
+            for header in sender.send_batch(0, set_flags(0, 0, 0, 0), early, connection.compressed):
+                print_header(header[:DRTP_extended_struct.size], True, DRTP_extended_struct)
+            log(f"{len(early)} packets are sent with the SYN packet")
+
+        # Receive SYN-ACK packet with the options accepted by the server, the SYN packet is resent with backoff until it is received
+        # NOTE: The server resends its SYN-ACK packet for a resent SYN packet, so a lost SYN-ACK packet is resent as well.
+        # The round trip time of the handshake is only measured if the SYN packet is not resent (Karn's rule)
+        retries = 0
+        early_acks = []     # ACKs of the first window that arrive before the SYN-ACK packet
+        while True:
+            client_socket.settimeout(rtt.timeout())
+            try:
+                reply = client_socket.recv(chunk_size)
+            except socket.timeout:
+                rtt.on_timeout()
+                retries += 1
+                if retries > max_retries:
+                    raise socket.timeout("the server is not responding")
+                if probe:
+                    probe = False
+                    log(f"The SYN packet of {len(packet)} bytes is lost, the payloads are {payload_size} bytes")
+                    del client_options["payload"]
+                    packet = send_packet(seq_num, 0, set_flags(1, 0, 0, 0), pack_options(client_options))
+                client_socket.send(packet)
+                log("SYN packet is resent", EVENT, timed=True)
+                print_header(packet[:6], True)
+                continue
+            _, _, flags = unpack_header(reply[:DRTP_struct.size])
+            if flags[0] == 1 or flags[3] == 1:
+                break
+            if connection is not None:
+                early_acks.append(reply)
+        client_socket.settimeout(None)
+        packet = reply
+        if retries == 0:
+            rtt.sample(time.monotonic() - syn_time)
+            transfer.rtt(None, rtt.srtt)
+        ack_num, seq_num, flags = unpack_header(packet[:DRTP_struct.size])
+        options = unpack_options(packet[DRTP_struct.size:])
+        header_struct = DRTP_extended_struct if options.get("seq32") else DRTP_struct
+        sack = options.get("sack")
+        if flags[3] == 1:
+            log("Error: the connection is refused by the server", SUMMARY)
+            client_socket.close()
+            exit(1)
+        log("SYN-ACK packet is received")
+        print_header(packet[:6], False)
+
+        # Go on with the window sent with the SYN packet if the server has accepted it, else the file is sent from the start
+        if connection is not None and not options.get("early"):
+            log("The server does not accept the packets sent with the SYN packet, they are sent again")
+            connection = None
+
+        # A part of the file can only be sent if the server writes it at the right offset
+        if file_range and options.get("range") != file_range:
+            log("Error: the server does not support striped transfers", SUMMARY)
+            client_socket.close()
+            exit(1)
+
+        # The server must parse the records of a session, an old server would write them to one file
+        if session and not options.get("session"):
+            log("Error: the server does not support sessions, send one file at a time", SUMMARY)
+            client_socket.close()
+            exit(1)
+
+        # Send only the rest of the file if the server has the first part of it
+        if "resume" in client_options and options.get("resume") == client_options["resume"] and "range" in options:
+            offset, length, size = options["range"]
+            if size != reader.filesize or not 0 < offset <= size or offset + length != size:
+                log("Error: the server wants to resume the file at a wrong offset", SUMMARY)
+                client_socket.close()
+                exit(1)
+            reader.close()
+            reader = FileReader(filename, offset, length)
+            total_packets = reader.total_packets
+            log(f"Resuming at byte {offset} of {size}")
+
+        # Send the parity packets with the group size and parity packets accepted by the server
+        if fec and "fec" in options:
+            fec = (*options["fec"], fec[2])
+        elif fec:
+            log("The server does not support parity packets, the file is sent without them")
+            fec = None
+
+        # A delta needs the server's copy of the file, else the whole file is sent
+        send_delta = "delta" in client_options and options.get("delta") == client_options["delta"] and "signatures" in options
+        if "delta" in client_options and not send_delta:
+            log("The server has no copy of the file, the whole file is sent")
+
+        # Send ACK packet
+        ack_num += 1
+        packet = send_packet(seq_num, ack_num, set_flags(0, 1, 0, 0))
+        client_socket.send(packet)
+        log("ACK packet is sent")
+        print_header(packet[:6], True)
+
+        # Connection established, the time of a transfer that sends data with the SYN packet starts with the SYN packet
+        log("Connection established\n")
+        transfer.start(time.monotonic() if connection is None else syn_time)
+
+        # Get the signatures of the server's copy and send only the data the server does not have
+        if send_delta:
+            block_size, basis_size = options["signatures"]
+            signatures = fetch_signatures(client_socket, header_struct, rtt, -(-basis_size // block_size))
+            reader.close()
+            reader = DeltaReader(filename, signatures, block_size, basis_size)
+            total_packets = reader.total_packets
+            log(f"Delta: {reader.literal_bytes} of {reader.size} bytes are sent, the rest is copied from the server's copy")
+
+        # Send payloads of the size accepted by the server, the first packets of the handshake show that the path carries them
+        if connection is None:
+            reader.set_payload_size(options["payload"] if "payload" in client_options and "payload" in options else payload_size)
+        total_packets = reader.total_packets
+        if reader.payload_size != payload_size:
+            log(f"Payloads of {reader.payload_size} bytes")
+
+        # Compress the payloads ahead of the sliding window if the server decompresses them, else send the file as it is
+        if compression in compression_methods:
+            method, max_size = options.get("compress", (None, None))
+            if method == compression_methods[compression]:
+                reader = CompressedReader(reader, compression, max_size)
+            else:
+                log("The server does not support compression, the file is sent without it")
+
+        # Send file
+        log("Data Transfer:\n")
+
+        if logger.packets:
+            log(f"Filesize: {reader.filesize}", DEBUG)
+
+        # The sequence numbers of the packets, the FIN packet and its ACK must fit in the header
+        max_seq_num = 0xFFFFFFFF if header_struct is DRTP_extended_struct else 0xFFFF
+        if total_packets + 2 > max_seq_num:
+            log(f"Error: {filename} is too large for the server, it does not support 32-bit sequence numbers", SUMMARY)
+            client_socket.close()
+            exit(1)
+
+        # Send the packets allowed by the congestion window and the pacer in batches of packets sent together,
+        # then wait for the ACKs until the timer of the sliding window expires or the pacer allows more packets
+        if connection is None:
+            pacer = Pacer(pacing == "window", send_rate, header_struct.size + reader.payload_size) if pacing == "window" or send_rate else None
+            connection = SenderConnection(reader, mode, congestion, max_window, rtt, header_struct, sack, transfer, fec, pacer, options.get("rwnd"))
+            sender = PacketSender(client_socket, header_struct)
+        else:
+            # The parity packets start after the window sent with the SYN packet
+            connection.fec = ParityEncoder(*fec) if fec else None
+            connection.receive_window = options.get("rwnd")
+            for packet in early_acks:
+                for resend_seq_num, payload in connection.handle_ack(packet, time.monotonic()):
+                    sender.send(resend_seq_num, ack_num, set_flags(0, 0, 0, 0, compressed=resend_seq_num in connection.compressed), payload)
+        while True:
+            while True:
+                batch = connection.transmit(time.monotonic(), socket_batch)
+                if not batch:
+                    break
+                headers = sender.send_batch(ack_num, set_flags(0, 0, 0, 0), batch, connection.compressed)
+                for packet in headers:
+                    print_header(packet[:header_struct.size], True, header_struct)
+                for parity_seq_num, cover, payload in connection.parity_packets():
+                    sender.send(parity_seq_num, cover, set_flags(0, 0, 0, 0, parity=1), payload)
+
+            # Stop sending when all the packets are acknowledged
+            if connection.done():
+                break
+
+            # Give up when the server stops responding
+            if connection.gave_up():
+                raise socket.timeout("the server is not responding")
+
+            # Receive the ACKs, all the ACKs that have arrived are handled before the window is sent
+            # NOTE: The wait is cut short when the pacer allows the next packets, that is not a timeout
+            now = time.monotonic()
+            wait = connection.next_timeout(now)
+            pace = connection.next_send(now)
+            paced = pace is not None and pace < wait
+            try:
+                packets = receive_waiting(client_socket, socket_batch, chunk_size, pace if paced else wait)
+            except socket.timeout:
+                packets = None
+            now = time.monotonic()
+            resent = []
+            for packet in packets or []:
+                resent.extend(connection.handle_ack(packet, now))
+            resent.extend(connection.handle_timeout(now, packets is None and not paced))
+            for resend_seq_num, payload in resent:
+                sender.send(resend_seq_num, ack_num, set_flags(0, 0, 0, 0, compressed=resend_seq_num in connection.compressed), payload)
+        next_seq = connection.next_seq
+
+        # Send FIN packet after sending all the packets
+        transfer.finish(time.monotonic())
+        reader.close()
+        log("\nDATA Finished\n\nConnection Teardown:\n")
+        retries = 0
+        while True:
+            packet = sender.send(next_seq, ack_num, set_flags(0, 0, 1, 0))
+            log("FIN packet is sent")
+            print_header(packet[:header_struct.size], True, header_struct)
+
+            # Receive FIN-ACK packet, resend the FIN packet on timeout
+            client_socket.settimeout(rtt.timeout())
+            try:
+                packet = client_socket.recv(header_struct.size)
+            except socket.timeout:
+                rtt.on_timeout()
+                retries += 1
+                if retries > max_retries:
+                    raise socket.timeout("the server is not responding")
+                continue
+            _, check_ack_num, flags = unpack_header(packet, header_struct)
+            if flags[2] == 1 and flags[1] == 1:
+                log("FIN-ACK packet is received")
+                log("Connection Closes", SUMMARY)
+                print_header(packet[:header_struct.size], False, header_struct)
+                client_socket.close()
+                if metrics is not None:
+                    transfer.write(metrics)
+                return True
+            else:
+                log("FIN-ACK packet is not received")
+                print_header(packet[:header_struct.size], False, header_struct)
+                
+    # Exit on keyboard interrupt
+    except KeyboardInterrupt:
+        log("Client is stopped", SUMMARY)
+
+    # Handle socket errors
+    except socket.error as e:
+        log(f"Error: {e}", SUMMARY)
+    return False
+
+
+"""
+Description:
+    Function to send a part of a file in a client process, the exit code tells if the part is sent
+Parameters:
+    *args: tuple - The arguments of run_client
+Return:
+    None
+"""
+def run_stream(*args):
+    try:
+        sent = run_client(*args)
+    finally:
+        logger.flush()
+    exit(0 if sent else 1)
+
+
+"""
+Description:
+    Function to send a file over several DRTP connections at the same time, each connection sends one part of the file
+    # NOTE: The server must handle several connections at the same time, with --concurrent or --workers
+Parameters:
+    ip: str - The IP address of the server
+    port: int - The port of the server
+    filename: str - The name of the file to send
+    streams: int - The number of connections
+    max_window: int - The largest congestion window, None for no limit
+    mode: str - The reliability mode, "gbn" or "sr"
+    congestion: str - The name of the congestion control algorithm
+    metrics: str - The file to write the metrics to, each stream writes its own file with the stream number added, None for no file
+    stats_port: int - The first local TCP port to serve the metrics on, stream N uses stats_port + N, None for no port
+    compression: str - The compression method of the payloads, each stream compresses its own part, "none" or None for no compression
+    fec: tuple - The parity packets of each stream, see parse_fec, None for none
+    pacing: str - The pacing of each stream, see run_client
+    send_rate: float - The largest rate of all the streams together in bits per second, each stream gets an equal share, None for no limit
+    offered_payload: int - The payload size each stream offers, see run_client
+Return:
+    None
+"""
+def run_client_striped(ip, port, filename, streams, max_window=None, mode=default_mode, congestion=congestion_control, metrics=None, stats_port=None,
+                       compression=None, fec=None, pacing=pacing, send_rate=send_rate, offered_payload=client_payload_size):
+    try:
+        filesize = os.path.getsize(filename)
+    except OSError as e:
+        log(f"Error: {e}", SUMMARY)
+        exit(1)
+
+    # Split the file in parts of at least one packet, small files use fewer connections
+    stripe_size = max(payload_size, -(-filesize // streams))
+    ranges = [(offset, min(stripe_size, filesize - offset), filesize) for offset in range(0, filesize, stripe_size)] or [(0, 0, 0)]
+
+    # Send each part in its own process
+    start_time = time.monotonic()
+    stream_rate = send_rate / len(ranges) if send_rate else None
+    processes = [multiprocessing.Process(target=run_stream, args=(ip, port, filename, max_window, mode, congestion, file_range,
+                                                                  metrics_path(metrics, f"stream{index}"),
+                                                                  None if stats_port is None else stats_port + index, compression, False, fec,
+                                                                  pacing, stream_rate, offered_payload))
+                 for index, file_range in enumerate(ranges)]
+    logger.flush()
+    try:
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+        log("Client is stopped", SUMMARY)
+        return
+    elapsed_time = time.monotonic() - start_time
+
+    failed = [index for index, process in enumerate(processes) if process.exitcode != 0]
+    if failed:
+        log(f"Error: stream {', '.join(map(str, failed))} of {len(processes)} failed, the file is not complete", SUMMARY)
+        exit(1)
+    log(f"\n{filename} is sent over {len(processes)} streams in {elapsed_time:.3f} seconds", SUMMARY)
+    log(f"The throughput is {format_throughput(filesize, elapsed_time)}", SUMMARY)
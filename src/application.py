@@ -27,7 +27,7 @@ Return:
 def main():
     """
     Description:
-        Function to check if a file exists and is a valid file
+        Function to check if a file or a directory exists
     Parameters:
         filename: str - The name of the file to check
     Return:
@@ -36,11 +36,7 @@ def main():
     def check_file(filename):
         error_message = None
         try:
-            test_filename = filename.encode('utf-8')
-            if max_filename_length < len(test_filename):
-                error_message = f"{filename} is too long, the file name must be less than {max_filename_length} characters"
-                raise ValueError
-            if not os.path.isfile(filename):
+            if not os.path.isfile(filename) and not os.path.isdir(filename):
                 error_message = f"{filename} does not exist"
                 raise ValueError
         except ValueError:
@@ -109,6 +105,54 @@ def main():
             exit(1)
         return value
     
+    """
+    Description:
+        Function to check if a forward error correction setting is valid
+    Parameters:
+        value: str - The setting to check, "none", "N:K" or "auto"
+    Return:
+        fec: tuple - The parsed setting, see DRTP.parse_fec, else exit with error message
+    """
+    def check_fec(value):
+        try:
+            return DRTP.parse_fec(value)
+        except ValueError as error_message:
+            print_error(f"{value} is not none, auto or N:K, {error_message}")
+            parser.print_help()
+            exit(1)
+    
+    """
+    Description:
+        Function to check if a send rate is valid
+    Parameters:
+        value: str - The rate to check, in bits per second with an optional K, M or G suffix
+    Return:
+        rate: float - The rate in bits per second, else exit with error message
+    """
+    def check_rate(value):
+        try:
+            return DRTP.parse_rate(value)
+        except ValueError:
+            print_error(f"{value} is not a positive rate, e.g. 10M")
+            parser.print_help()
+            exit(1)
+    
+    """
+    Description:
+        Function to check if a payload size setting is valid
+    Parameters:
+        value: str - The setting to check, "auto" or a number of bytes
+    Return:
+        size: int - The size, or "auto", else exit with error message
+    """
+    def check_payload_size(value):
+        try:
+            return DRTP.parse_payload_size(value)
+        except ValueError as error_message:
+            print_error(f"{value} is not auto or a payload size, {error_message}")
+            parser.print_help()
+            exit(1)
+    
     # Create the argument parser and description of the application
     parser = argparse.ArgumentParser(description="DRTP file transfer application", epilog="end of help")
 
@@ -120,22 +164,79 @@ def main():
     # Server arguments
     server_group = parser.add_argument_group('Server')
     server_group.add_argument('-d', '--discard', type=check_positive_integer, help="Discard a packet with the given sequence number")
+    server_group.add_argument('--concurrent', action="store_true", help="Keep running and receive files from many clients at the same time")
+    server_group.add_argument('--max-sessions', type=check_positive_integer, default=max_sessions, help="Number of clients the concurrent server receives from at the same time, default %(default)s")
+    server_group.add_argument('--workers', type=check_positive_integer, help="Run the concurrent server in this many processes sharing the port with SO_REUSEPORT")
+    server_group.add_argument('--flush', choices=["buffered", "fsync"], default=flush_mode, help="Leave the written file to the OS or sync it to disk at FIN, default %(default)s")
+    server_group.add_argument('--rcvbuf', type=check_positive_integer, default=receive_buffer,
+                              help=f"Bytes of the kernel receive buffer of the server socket, the packets wait in it while the server is busy. Default room for {receive_buffers} packets of the largest payload, within net.core.rmem_max. A given size goes above net.core.rmem_max when the server runs as root")
 
     # Client arguments
     client_group = parser.add_argument_group('Client')
-    client_group.add_argument('-f', '--file', type=check_file, required='-c' in sys.argv or '--client' in sys.argv, help="Name of the file to send")
-    client_group.add_argument('-w', '--window', type=check_positive_integer, default=window_size, help="Set the window size, default %(default)s packets per window")
+    client_group.add_argument('-f', '--file', type=check_file, nargs="+", required='-c' in sys.argv or '--client' in sys.argv,
+                              help="Name of the file to send, several files or a directory are sent in one session")
+    client_group.add_argument('-w', '--window', type=check_positive_integer, help="Set the upper bound of the window size in packets, default no bound (%(default)s)")
+    client_group.add_argument('--cc', choices=sorted(DRTP.congestion_algorithms), default=congestion_control, help="Congestion control algorithm, default %(default)s. fixed uses the window size, or " + str(window_size) + " packets")
+    client_group.add_argument('--compress', choices=["none"] + sorted(DRTP.compression_methods), default=compression,
+                              help="Compress the payloads if the server supports it, data that does not compress is sent as it is. Default %(default)s")
+    client_group.add_argument('--fec', type=check_fec, default=fec, help="Send K parity packets for every N data packets with N:K, or auto to size the groups from the loss rate, "
+                              "so the server rebuilds a lost packet without waiting for it to be resent. Default %(default)s")
+    client_group.add_argument('--pacing', choices=["none", "window"], default=pacing, help="Spread the packets of the window evenly over the RTT, or send them at once. Default %(default)s")
+    client_group.add_argument('--rate', type=check_rate, default=send_rate, help="Largest rate to send at in bits per second, with K, M or G, e.g. 10M. Default no limit")
+    client_group.add_argument('--payload-size', type=check_payload_size, default=client_payload_size,
+                              help="Bytes of the file in each packet, the server may lower it. auto sends the largest payloads that fit the MTU of the route. Default %(default)s")
+    client_group.add_argument('--delta', action='store_true', help="Send only the parts of the file that differ from the copy the server has, if it has one")
+    client_group.add_argument('--zero-rtt', action='store_true', help="Send the first window with the SYN packet instead of after the handshake, the server must run this version. "
+                              "Not with --compress or --delta")
+    client_group.add_argument('--streams', type=check_positive_integer, default=1, help="Send the file in parts over this many connections at the same time, the server must run with --concurrent or --workers. Default %(default)s")
 
     # Common arguments
     parser.add_argument('-i', '--ip', type=check_ipaddress, default=default_ip, help="IP address to connect/bind to, in dotted decimal notation. Default %(default)s")
     parser.add_argument('-p', '--port', type=check_port, default=default_port, help="Port to use, default %(default)s")
+    parser.add_argument('-m', '--mode', choices=["gbn", "sr"], default=default_mode, help="Reliability mode, Go-Back-N or Selective Repeat, default %(default)s")
+    parser.add_argument('--metrics', metavar="FILE", help="Write the RTT samples, retransmissions and goodput timeline of each transfer to this file, .json for all the metrics or .csv for the timeline")
+    parser.add_argument('--stats-port', type=check_port, help="Serve the metrics of the running transfers as JSON on this local TCP port")
+    parser.add_argument('-l', '--log-level', choices=list(DRTP.log_levels), default=log_level, help="Messages to print: summary prints the results and errors, event adds the connection events and retransmissions, debug adds every packet. Default %(default)s")
 
     # Parse the command line arguments and run the application
     args = parser.parse_args()
+    DRTP.logger.set_level(args.log_level)
     if args.server:
-        DRTP.run_server(args.ip, args.port, args.discard)
+        if args.workers:
+            DRTP.run_server_workers(args.ip, args.port, args.discard, args.flush, args.mode, args.max_sessions, args.workers, args.metrics, args.stats_port, args.rcvbuf)
+        elif args.concurrent:
+            DRTP.run_concurrent_server(args.ip, args.port, args.discard, args.flush, args.mode, args.max_sessions, metrics=args.metrics, stats_port=args.stats_port,
+                                       receive_buffer=args.rcvbuf)
+        else:
+            DRTP.run_server(args.ip, args.port, args.discard, args.flush, args.mode, args.metrics, args.stats_port, args.rcvbuf)
     elif args.client:
-        DRTP.run_client(args.ip, args.port, args.file, args.window)
+        # The data sent with the SYN packet is the file as it is, before the server has answered
+        if args.zero_rtt and (args.compress != "none" or args.delta or args.streams > 1):
+            print_error(f"--zero-rtt can not be used with {'--compress' if args.compress != 'none' else '--delta' if args.delta else '--streams'}")
+            exit(1)
+        # Several files or a directory are sent in one session, a single file is sent with its name in the first packet
+        if len(args.file) > 1 or os.path.isdir(args.file[0]):
+            if args.streams > 1 or args.delta:
+                print_error(f"{'--streams' if args.streams > 1 else '--delta'} can only send one file")
+                exit(1)
+            DRTP.run_client(args.ip, args.port, args.file, args.window, args.mode, args.cc, metrics=args.metrics, stats_port=args.stats_port,
+                            compression=args.compress, fec=args.fec, pacing=args.pacing, send_rate=args.rate,
+                            offered_payload=args.payload_size, zero_rtt=args.zero_rtt)
+            return
+        args.file = args.file[0]
+        if max_filename_length < len(args.file.encode('utf-8')):
+            print_error(f"{args.file} is too long, the file name must be less than {max_filename_length} characters")
+            exit(1)
+        if args.streams > 1 and args.delta:
+            print_error("--delta can only send the file over one stream")
+            exit(1)
+        if args.streams > 1:
+            DRTP.run_client_striped(args.ip, args.port, args.file, args.streams, args.window, args.mode, args.cc, args.metrics, args.stats_port, args.compress, args.fec,
+                                    args.pacing, args.rate, args.payload_size)
+        else:
+            DRTP.run_client(args.ip, args.port, args.file, args.window, args.mode, args.cc, metrics=args.metrics, stats_port=args.stats_port,
+                            compression=args.compress, delta=args.delta, fec=args.fec, pacing=args.pacing, send_rate=args.rate,
+                            offered_payload=args.payload_size, zero_rtt=args.zero_rtt)
 
 # Run the main function if this script is executed
 if __name__ == "__main__":
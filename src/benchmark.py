@@ -0,0 +1,306 @@
+import argparse     # For the command line arguments
+import csv          # For writing the results
+import filecmp      # For checking the received files
+import itertools    # For the combinations of the sweep
+import json         # For reading the metrics of the client
+import os           # For the files and paths
+import random       # For the content of the test files
+import socket       # For finding free ports
+import subprocess   # For running the server and the client
+import sys          # For the Python interpreter
+import tempfile     # For the directory of the runs
+import time         # For timing the runs
+from proxy import ImpairmentProxy, add_link_arguments, link_from_args    # The impairments between the client and the server
+from config import *    # Import the configuration
+
+application = os.path.join(os.path.dirname(os.path.abspath(__file__)), "application.py")
+columns = ["mode", "cc", "window", "size", "loss", "status", "client_exit", "seconds", "throughput_mbps", "retransmissions", "timeouts", "overhead_percent", "proxy_drops",
+           "kernel_drops"]
+
+"""
+Description:
+    Function to get the UDP packets the kernel has dropped because a receive buffer was full, from /proc/net/snmp
+    # NOTE: The counter is for the whole system, so the runs are compared while nothing else sends on the machine
+Parameters:
+    None
+Return:
+    drops: int - The RcvbufErrors counter, None if the system does not have it
+"""
+def kernel_drops():
+    try:
+        with open("/proc/net/snmp") as file:
+            udp = [line.split() for line in file if line.startswith("Udp:")]
+        return int(udp[1][udp[0].index("RcvbufErrors")])
+    except (OSError, IndexError, ValueError):
+        return None
+
+"""
+Description:
+    Function to get a free UDP port on the loopback interface
+Parameters:
+    None
+Return:
+    port: int - The port
+"""
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+"""
+Description:
+    Function to parse a size with an optional K, M or G suffix, in bytes
+Parameters:
+    value: str - The size, e.g. 100K
+Return:
+    size: int - The size in bytes
+"""
+def parse_size(value):
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+    value = value.strip().upper().removesuffix("B")
+    try:
+        if value and value[-1] in units:
+            return int(float(value[:-1]) * units[value[-1]])
+        return int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"{value} is not a size, e.g. 100K")
+
+"""
+Description:
+    Function to make an argument type for a comma separated list
+Parameters:
+    item_type: function - The type of each item
+Return:
+    parse: function - Parses the list
+"""
+def list_of(item_type):
+    return lambda value: [item_type(item) for item in value.split(",") if item.strip()]
+
+"""
+Description:
+    Function to format a size in bytes with a K or M suffix
+Parameters:
+    size: int - The size in bytes
+Return:
+    text: str - The formatted size
+"""
+def format_size(size):
+    for unit, factor in (("G", 1 << 30), ("M", 1 << 20), ("K", 1 << 10)):
+        if size >= factor and size % factor == 0:
+            return f"{size // factor}{unit}"
+    return str(size)
+
+"""
+Description:
+    Function to make a test file of random bytes, the same size always gets the same content
+Parameters:
+    directory: str - The directory of the file
+    size: int - The size in bytes
+Return:
+    filename: str - The path of the file
+"""
+def make_file(directory, size):
+    filename = os.path.join(directory, f"bench-{format_size(size)}.bin")
+    if not os.path.exists(filename):
+        rng = random.Random(size)
+        with open(filename, "wb") as file:
+            remaining = size
+            while remaining:
+                block = min(remaining, 1 << 20)
+                file.write(rng.randbytes(block))
+                remaining -= block
+    return filename
+
+"""
+Description:
+    Function to transfer one file through the proxy and measure it
+    # NOTE: A fresh server, proxy and port is used for every run, so no state is carried between the runs
+Parameters:
+    args: argparse.Namespace - The parsed arguments, with the impairments of the proxy
+    directory: str - The directory of the runs, the server writes to its output directory
+    filename: str - The file to send
+    mode: str - The reliability mode
+    cc: str - The congestion control algorithm
+    window: int - The window size
+    loss: float - The loss of the proxy in each direction
+    run: int - The number of the run, used in the seed of the proxy
+    discard: int - The packet the server discards once with -d, None to not discard any packet
+Return:
+    result: dict - The row of the results, format: {column: value}
+"""
+def run_transfer(args, directory, filename, mode, cc, window, loss, run, discard=None):
+    server_port, proxy_port = free_port(), free_port()
+    server_metrics = os.path.join(directory, "server.json")
+    client_metrics = os.path.join(directory, "client.json")
+    output = os.path.join(directory, "output", os.path.basename(filename))
+    for stale in (server_metrics, client_metrics, output):
+        if os.path.exists(stale):
+            os.remove(stale)
+
+    seed = None if args.seed is None else args.seed + run
+    proxy = ImpairmentProxy(("127.0.0.1", proxy_port), ("127.0.0.1", server_port),
+                            link_from_args(args, loss), link_from_args(args, loss), seed)
+    common = [sys.executable, application, "-m", mode, "-l", "summary"]
+    server_command = common + ["-s", "-p", str(server_port), "--metrics", server_metrics] + (["-d", str(discard)] if discard is not None else [])
+    server = subprocess.Popen(server_command,
+                              cwd=directory, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    proxy.start()
+    time.sleep(args.startup)
+
+    # The client sends the name as given, so it is given relative to the directory of the runs
+    client_command = common + ["-c", "-f", os.path.basename(filename), "-p", str(proxy_port), "--cc", cc, "-w", str(window), "--metrics", client_metrics]
+    start_drops = kernel_drops()
+    start_time = time.monotonic()
+    status = "ok"
+    client_exit = None
+    try:
+        client = subprocess.run(client_command, cwd=directory, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=args.timeout)
+        client_exit = client.returncode
+        if client_exit != 0:
+            status = "failed"
+    except subprocess.TimeoutExpired:
+        status = "timeout"
+    elapsed_time = time.monotonic() - start_time
+
+    # The server stops after the FIN, or after its own timeout if the FIN is lost
+    try:
+        server.wait(timeout=args.timeout)
+    except subprocess.TimeoutExpired:
+        server.kill()
+        server.wait()
+    proxy.stop()
+    end_drops = kernel_drops()
+
+    # A run counts if the client exits with 0 and the file is complete
+    if status != "timeout" and not (os.path.exists(output) and filecmp.cmp(filename, output, shallow=False)):
+        status = "corrupt" if os.path.exists(output) else "failed"
+
+    # The throughput is measured over the data transfer of the client, without starting Python and the handshake
+    counters = {}
+    duration = None
+    try:
+        with open(client_metrics) as file:
+            metrics = json.load(file)
+            counters, duration = metrics["counters"], metrics["duration"]
+    except (OSError, ValueError, KeyError):
+        pass
+    size = os.path.getsize(filename)
+    sent = counters.get("packets", 0)
+    retransmissions = counters.get("retransmissions", 0)
+    done = status == "ok"
+    return {
+        "mode": mode,
+        "cc": cc,
+        "window": window,
+        "size": format_size(size),
+        "loss": loss,
+        "status": status,
+        "client_exit": client_exit,
+        "seconds": round(elapsed_time, 3) if done else None,
+        "throughput_mbps": round(size * 8 / duration / 1e6, 2) if done and duration else None,
+        "retransmissions": retransmissions if counters else None,
+        "timeouts": counters.get("timeouts", 0) if counters else None,
+        "overhead_percent": round(retransmissions * 100 / sent, 2) if sent else None,
+        "proxy_drops": sum(stats["dropped"] + stats["queue_drops"] for stats in proxy.stats().values()),
+        "kernel_drops": end_drops - start_drops if start_drops is not None and end_drops is not None else None,
+    }
+
+"""
+Description:
+    Function to check with the real client and server that a packet discarded by the server with -d is resent after about one RTT
+    The same transfer through the proxy is run without and with the discarded packet, in GBN and SR mode
+    # NOTE: The discarded packet is the first of the second window, the rest of the window brings the duplicate ACKs
+Parameters:
+    args: argparse.Namespace - The parsed arguments, the largest window and the first size are used, and --delay with 50 ms if it is not given
+    directory: str - The directory of the runs
+Return:
+    ok: bool - True if every transfer finished without a timeout and at most 1.5 RTT later than without the discarded packet
+"""
+def check_discard(args, directory):
+    if not args.delay:
+        args.delay = 50.0
+    rtt = 2 * args.delay / 1000
+    size, window = args.sizes[0], max(args.windows)
+    filename = make_file(directory, size)
+    ok = True
+    for mode in ("gbn", "sr"):
+        rows = [run_transfer(args, directory, filename, mode, "fixed", window, 0.0, 0, discard) for discard in (None, window + 1)]
+        if all(row["status"] == "ok" and row["throughput_mbps"] for row in rows):
+            # The transfer times of the client, from the throughput over its data transfer
+            baseline, discarded = (size * 8 / row["throughput_mbps"] / 1e6 for row in rows)
+            delay = discarded - baseline
+            passed = rows[1]["timeouts"] == 0 and delay <= 1.5 * rtt
+            result = f"{delay * 1000:.1f} ms longer than without it, {rows[1]['timeouts']} timeouts, {rows[1]['retransmissions']} retransmissions"
+        else:
+            passed = False
+            result = f"the transfers are {rows[0]['status']} and {rows[1]['status']}"
+        ok = ok and passed
+        print(f"{mode} discard {window + 1} with a {rtt * 1000:.0f} ms RTT: {'ok' if passed else 'FAILED'}, {result}")
+    return ok
+
+"""
+Description:
+    Function to print the results as an aligned table
+Parameters:
+    rows: list - The rows of the results, format: [{column: value}]
+    columns: list - The columns to print, in order
+Return:
+    None
+"""
+def print_table(rows, columns=columns):
+    cells = [columns] + [["-" if row[column] is None else str(row[column]) for column in columns] for row in rows]
+    widths = [max(len(line[index]) for line in cells) for index in range(len(columns))]
+    for number, line in enumerate(cells):
+        print("  ".join(cell.rjust(width) for cell, width in zip(line, widths)))
+        if number == 0:
+            print("  ".join("-" * width for width in widths))
+
+"""
+Description:
+    Function to run the sweep of window sizes, file sizes and loss rates through the proxy and print the results
+Parameters:
+    None
+Return:
+    None
+"""
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of DRTP transfers on the loopback interface through an impairment proxy")
+    parser.add_argument('-w', '--windows', type=list_of(int), default=[3, 5, 10], help="Comma separated window sizes, default 3,5,10")
+    parser.add_argument('-s', '--sizes', type=list_of(parse_size), default=[parse_size("1M")], help="Comma separated file sizes with K, M or G, default 1M")
+    parser.add_argument('--losses', type=list_of(float), default=[0.0], help="Comma separated loss rates in each direction, default 0 (or --loss)")
+    parser.add_argument('-m', '--modes', type=list_of(str), default=[default_mode], help=f"Comma separated reliability modes, gbn and sr, default {default_mode}")
+    parser.add_argument('--cc', type=list_of(str), default=["fixed"], help="Comma separated congestion control algorithms, default fixed so the window is the window size")
+    parser.add_argument('-r', '--repeat', type=int, default=1, help="Runs of each combination, default %(default)s")
+    parser.add_argument('--timeout', type=float, default=120, help="Seconds before a run is stopped, default %(default)s")
+    parser.add_argument('--startup', type=float, default=0.3, help="Seconds to wait for the server to start, default %(default)s")
+    parser.add_argument('-o', '--output', help="Write the results to this CSV file as well")
+    parser.add_argument('--check', action="store_true", help="Check that a packet the server discards is resent after about one RTT without a timeout, exit with 1 if it is not")
+    add_link_arguments(parser)
+    args = parser.parse_args()
+    if args.loss and args.losses == [0.0]:
+        args.losses = [args.loss]
+
+    if args.check:
+        with tempfile.TemporaryDirectory(prefix="drtp-bench-") as directory:
+            sys.exit(0 if check_discard(args, directory) else 1)
+
+    rows = []
+    with tempfile.TemporaryDirectory(prefix="drtp-bench-") as directory:
+        files = {size: make_file(directory, size) for size in args.sizes}
+        sweep = itertools.product(args.modes, args.cc, args.windows, args.sizes, args.losses, range(args.repeat))
+        for mode, cc, window, size, loss, run in sweep:
+            row = run_transfer(args, directory, files[size], mode, cc, window, loss, run)
+            rows.append(row)
+            print(f"{mode} {cc} window {window} size {format_size(size)} loss {loss}: {row['status']}"
+                  + (f", {row['throughput_mbps']} Mbps" if row["throughput_mbps"] is not None else ""), file=sys.stderr)
+
+    print_table(rows)
+    if args.output:
+        with open(args.output, "w", newline="") as file:
+            writer = csv.DictWriter(file, fieldnames=columns)
+            writer.writeheader()
+            writer.writerows(rows)
+
+# Run the main function if this script is executed
+if __name__ == "__main__":
+    main()
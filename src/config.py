@@ -4,13 +4,77 @@ import struct
 max_filename_length = 32
 default_ip = "127.0.0.1"
 default_port = 8088
-window_size = 3
+window_size = 3 # Window of the fixed congestion control when no window is given
+congestion_control = "reno" # "fixed", "reno" or "vegas"
+initial_window = 2  # Congestion window at the start of slow start
+vegas_alpha = 2     # Vegas grows the window when fewer packets than this are queued
+vegas_beta = 4      # Vegas shrinks the window when more packets than this are queued
+vegas_gamma = 1     # Vegas leaves slow start when more packets than this are queued
+default_mode = "gbn"    # "gbn" for Go-Back-N, "sr" for Selective Repeat
 DRTP_struct = struct.Struct("!HHH") # 2 bytes for sequence number, 2 bytes for ack number, 2 bytes for flags
+DRTP_extended_struct = struct.Struct("!IIH") # 4 bytes for sequence number, 4 bytes for ack number, 2 bytes for flags, negotiated in the handshake
 packet_size = 1000
 chunk_size = packet_size - DRTP_struct.size # 994 bytes for data
-timeout = 0.5   # 500ms
+payload_size = chunk_size - DRTP_struct.size # 988 bytes of the file in each packet, the first packet holds the filename as well
+min_payload_size = 256  # Smallest payload the client can be set to send, the first payload holds the filename as well
+max_payload_size = 65000    # Largest payload the server accepts, a UDP datagram holds at most 65507 bytes
+client_payload_size = "auto"    # Payload size the client offers: "auto" for the largest that fits the MTU of the route to the server, or a number of bytes, payload_size for the packets of earlier versions
+session_record_struct = struct.Struct("!HQ") # 2 bytes for the length of the name, 8 bytes for the size of the file, in front of each file of a session
+receive_window_struct = struct.Struct("!H") # 2 bytes for the receive window in packets, in front of the SACK blocks of an ACK when the server advertises it
+session_open_files = 64 # Files of a session the client keeps open for retransmissions
+compression = "none"    # "none", "zlib" or "lzma", compression of the payloads when the server supports it
+compress_level = 6      # Level of zlib and preset of lzma, 1 is the fastest and 9 the smallest
+compress_block = 65536  # 64KB, largest part of the file compressed into one packet
+compress_sample = 4096  # Bytes compressed to check if the data compresses
+compress_skip = 262144  # 256KB, data sent without compressing it after a sample that does not compress, until the next sample
+compress_min_ratio = 1.1    # Smallest ratio of a sample that is compressed
+compress_ahead = 1024   # Payloads compressed ahead of the sliding window
+checkpoint_directory = ".checkpoints"   # Directory of the checkpoints of the files that are not finished, next to the output directory
+checkpoint_interval = 1 << 20   # 1MB, data written between the saves of a checkpoint
+resume_hash_size = 1 << 20  # 1MB, bytes at the start and the end of a file that are hashed to tell if the file has changed
+delta_block = 2048  # Smallest block of the signatures of a delta transfer, files of more than 4MB use blocks of about the square root of their size
+delta_signature_struct = struct.Struct("!I8s")   # 4 bytes for the rolling checksum, 8 bytes for the strong hash, of each block of the server's file
+delta_instruction_struct = struct.Struct("!BQQ") # 1 byte for the kind, 8 bytes for the offset, 8 bytes for the length, of each instruction of a delta
+delta_search = 1 << 20  # 1MB, data without a match before the checksum of a delta is only rolled over one block in every delta_resync
+delta_resync = 16   # Blocks of a long run of data without a match for each block the checksum is rolled over
+delta_batch = 32    # Packets of signatures the server sends for one request of the client
+delta_window = 256  # Packets of signatures the client requests at a time
+fec = "none"    # "none", "N:K" for K parity packets for every N data packets, or "auto" to size the groups from the loss rate
+fec_group = 16  # Data packets in a group of the auto FEC until the loss rate is measured
+fec_max_group = 64  # Largest group of data packets, the server keeps the payloads of twice as many packets to rebuild a lost one
+fec_lane_losses = 0.1   # Losses for each parity packet the auto FEC aims for, a group is about K * fec_lane_losses / loss rate packets
+fec_adapt_packets = 200 # Packets sent between the adjustments of the auto FEC
+pacing = "window"   # "none" sends the packets the window allows at once, "window" spreads them over the RTT
+send_rate = None    # Bits per second the client sends at most, None for no limit
+pacing_gain = 1.25  # Multiple of window / RTT the packets are paced at, above 1 so the pacing does not hold back the window
+pacing_slow_start_gain = 2  # Multiple of window / RTT in slow start, where the window doubles every RTT
+pacing_quantum = 0.001  # 1ms, packets of this much time at the pacing rate are sent together, the client sleeps in between
+pacing_burst = 4    # Packets that are always sent together, at low rates and after an idle time
+timeout = 0.5   # 500ms, retransmission timeout until the RTT is measured
+min_rto = 0.002 # 2ms, lower bound of the retransmission timeout
+max_rto = 2.0   # 2s, upper bound of the retransmission timeout with backoff
+rtt_alpha = 1 / 8   # Gain of the smoothed RTT
+rtt_beta = 1 / 4    # Gain of the RTT variation
+max_retries = 10    # Timeouts in a row before the sender gives up, the receiver waits as long before it gives up
+receive_buffers = 256   # Number of preallocated receive buffers on the server
+receive_buffer = None   # Bytes of the kernel receive buffer of the server socket (SO_RCVBUF), None for receive_buffers packets of the largest payload
+socket_packet_overhead = 512    # Bytes the kernel counts for a queued packet besides its data, which it rounds up to a power of two
+min_socket_packets = 32 # Packets the kernel receive buffer holds at least, a larger payload is refused in the handshake
+write_batch = 16        # Number of received payloads handed to the writer thread at a time
+socket_batch = 64       # Number of packets read from the socket at a time before they are handled
+ack_every = 2           # Number of packets received in order before the ACK is sent, when the client supports SACK
+ack_delay = 0.001       # 1ms, longest time an ACK is delayed
+max_sack_blocks = 4     # Number of ranges of out-of-order packets in an ACK
+dup_ack_threshold = 3   # Duplicate ACKs that make the client resend the oldest packet without waiting for the timeout
+max_sessions = 100  # Number of clients the concurrent server receives from at the same time
+sweep_interval = 1  # Seconds between the checks for idle connections in the concurrent server
+flush_mode = "buffered" # "buffered" leaves the written file to the OS, "fsync" syncs it to disk at FIN
+metrics_interval = 0.1  # 100ms, length of the time buckets of the goodput and window timeline
 
-# Debugging lines
-debug = False
+# Messages to print: "summary" prints the results and errors, "event" adds the connection events and retransmissions,
+# "debug" adds every packet and header
+log_level = "event"
+log_batch = 256     # Messages kept before they are written, results and errors are written at once
+log_interval = 0.5  # 500ms, longest time a message is kept before it is written
 # File transfer packets only
 show_packets = False
\ No newline at end of file
@@ -0,0 +1,154 @@
+import argparse     # For the command line arguments
+import socket       # For the loopback sockets
+import time         # For timing the runs
+import DRTP         # The send and receive paths to measure
+from config import *    # Import the configuration
+
+"""
+Description:
+    Function to make a sending socket connected to a receiving socket on the loopback interface
+Parameters:
+    None
+Return:
+    sender: socket.socket - The connected sending socket
+    receiver: socket.socket - The receiving socket
+"""
+def socket_pair():
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.bind(("127.0.0.1", 0))
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sender.connect(receiver.getsockname())
+    return sender, receiver
+
+"""
+Description:
+    Function to measure sending packets built with send_packet, one new bytes object per packet
+Parameters:
+    count: int - The number of packets to send
+    payload: bytes - The payload of the packets
+Return:
+    seconds: float - The time it took
+"""
+def send_copy(count, payload):
+    sender, receiver = socket_pair()
+    start = time.perf_counter()
+    for seq_num in range(count):
+        sender.send(DRTP.send_packet(seq_num & 0xFFFF, 0, 0, payload))
+    seconds = time.perf_counter() - start
+    sender.close()
+    receiver.close()
+    return seconds
+
+"""
+Description:
+    Function to measure sending packets with PacketSender, the header is packed into a reused buffer and sent with sendmsg
+Parameters:
+    count: int - The number of packets to send
+    payload: bytes - The payload of the packets
+Return:
+    seconds: float - The time it took
+"""
+def send_copy_free(count, payload):
+    sender, receiver = socket_pair()
+    packet_sender = DRTP.PacketSender(sender)
+    payload = memoryview(payload)
+    start = time.perf_counter()
+    for seq_num in range(count):
+        packet_sender.send(seq_num & 0xFFFF, 0, 0, payload)
+    seconds = time.perf_counter() - start
+    sender.close()
+    receiver.close()
+    return seconds
+
+"""
+Description:
+    Function to measure sending packets in batches with PacketSender.send_batch, one system call per batch with UDP_SEGMENT
+Parameters:
+    count: int - The number of packets to send
+    payload: bytes - The payload of the packets
+Return:
+    seconds: float - The time it took
+"""
+def send_batched(count, payload):
+    sender, receiver = socket_pair()
+    packet_sender = DRTP.PacketSender(sender)
+    payload = memoryview(payload)
+    start = time.perf_counter()
+    for seq_num in range(0, count, socket_batch):
+        packet_sender.send_batch(0, 0, [((seq_num + index) & 0xFFFF, payload) for index in range(socket_batch)])
+    seconds = time.perf_counter() - start
+    segmentation = packet_sender.segmentation
+    sender.close()
+    receiver.close()
+    return seconds, segmentation
+
+"""
+Description:
+    Function to measure receiving packets, a batch of packets is sent and then received
+    # NOTE: Only the receiving is timed, the batch fits in the socket buffer so no packet is lost
+Parameters:
+    count: int - The number of packets to receive
+    payload: bytes - The payload of the packets
+    batched: bool - True to read the batch into preallocated buffers after one wait,
+                    False to read one packet per recvfrom on a socket with a timeout, as the server did before
+Return:
+    seconds: float - The time it took
+"""
+def receive(count, payload, batched):
+    sender, receiver = socket_pair()
+    packet = DRTP.send_packet(1, 0, 0, payload)
+    buffers = [bytearray(DRTP_extended_struct.size + payload_size) for _ in range(socket_batch)]
+    if not batched:
+        receiver.settimeout(timeout)
+    seconds = 0
+    for _ in range(count // socket_batch):
+        for _ in range(socket_batch):
+            sender.send(packet)
+        start = time.perf_counter()
+        if batched:
+            received = 0
+            while received < socket_batch:
+                DRTP.wait_readable(receiver, None)
+                try:
+                    while received < socket_batch:
+                        receiver.recvfrom_into(buffers[received], 0, socket.MSG_DONTWAIT)
+                        received += 1
+                except BlockingIOError:
+                    pass
+        else:
+            for _ in range(socket_batch):
+                receiver.recvfrom(chunk_size)
+        seconds += time.perf_counter() - start
+    sender.close()
+    receiver.close()
+    return seconds
+
+"""
+Description:
+    Function to run the benchmarks and print the packets per second of each path
+Parameters:
+    None
+Return:
+    None
+"""
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmark of the DRTP send and receive paths on the loopback interface")
+    parser.add_argument('-n', '--count', type=int, default=200_000, help="Number of packets in each run, default %(default)s")
+    args = parser.parse_args()
+    count = args.count - args.count % socket_batch
+    payload = bytes(payload_size)
+
+    batch_seconds, segmentation = send_batched(count, payload)
+    runs = [
+        ("send, send_packet + send", send_copy(count, payload)),
+        ("send, PacketSender (pack_into + sendmsg)", send_copy_free(count, payload)),
+        (f"send, batches of {socket_batch}" + (" with UDP_SEGMENT" if segmentation else " (no UDP_SEGMENT)"), batch_seconds),
+        ("receive, recvfrom per packet with a timeout", receive(count, payload, False)),
+        (f"receive, recvfrom_into batches of {socket_batch}", receive(count, payload, True)),
+    ]
+    for name, seconds in runs:
+        print(f"{name:<45} {count / seconds:>12,.0f} packets/s")
+
+# Run the main function if this script is executed
+if __name__ == "__main__":
+    main()
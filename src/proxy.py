@@ -0,0 +1,317 @@
+import argparse     # For the command line arguments
+import collections  # For the queue of the rate limited link
+import heapq        # For the queue of delayed packets, ordered by the time they are forwarded
+import random       # For the loss, jitter, reordering and duplication
+import select       # For waiting on all the sockets at once
+import socket       # For the UDP sockets
+import threading    # For running the proxy next to the benchmark
+import time         # For the delays and the rate limit
+from DRTP import parse_rate, set_receive_buffer  # For the rate of the link, and room for the large datagrams of the client
+
+"""
+Description:
+    Class to hold the impairments of one direction of the link
+Parameters:
+    delay: float - Seconds every packet is delayed
+    jitter: float - Largest random extra delay in seconds, packets may be reordered by it
+    loss: float - Probability that a packet is dropped
+    reorder: float - Probability that a packet is held back by reorder_delay, so the packets after it overtake it
+    reorder_delay: float - Seconds a reordered packet is held back
+    duplicate: float - Probability that a packet is forwarded twice
+    rate: float - Bits per second of the link, None for no limit
+    queue: int - Packets waiting for the rate limit before new packets are dropped, as in a router buffer
+"""
+class Link:
+    """
+    Description:
+        Function to initialize the impairments of the link
+    Parameters:
+        See the class description
+    Return:
+        None
+    """
+    def __init__(self, delay=0.0, jitter=0.0, loss=0.0, reorder=0.0, reorder_delay=0.002, duplicate=0.0, rate=None, queue=100):
+        self.delay = delay
+        self.jitter = jitter
+        self.loss = loss
+        self.reorder = reorder
+        self.reorder_delay = reorder_delay
+        self.duplicate = duplicate
+        self.rate = rate
+        self.queue = queue
+        self.busy_until = 0.0   # Time the rate limited link has sent the packets queued on it
+        self.queued = collections.deque()   # Times the queued packets leave the rate limited link, oldest first
+        self.stats = {"packets": 0, "bytes": 0, "dropped": 0, "queue_drops": 0, "reordered": 0, "duplicated": 0}
+
+    """
+    Description:
+        Function to decide when a packet arriving on the link is forwarded
+        # NOTE: The packet is serialized at the rate first, then delayed, as on a router with a slow outgoing link
+    Parameters:
+        now: float - The time the packet arrived
+        size: int - The size of the packet in bytes
+        rng: random.Random - The random number generator
+    Return:
+        times: list - The times to forward the packet, empty if it is dropped and two times if it is duplicated
+    """
+    def schedule(self, now, size, rng):
+        self.stats["packets"] += 1
+        if rng.random() < self.loss:
+            self.stats["dropped"] += 1
+            return []
+
+        # Wait for the packets in front of it on the rate limited link, drop it if the queue is full
+        departure = now
+        if self.rate:
+            while self.queued and self.queued[0] <= now:
+                self.queued.popleft()
+            if len(self.queued) >= self.queue:
+                self.stats["queue_drops"] += 1
+                return []
+            departure = max(now, self.busy_until) + size * 8 / self.rate
+            self.busy_until = departure
+            self.queued.append(departure)
+
+        self.stats["bytes"] += size
+        times = [departure + self.delay + rng.uniform(0, self.jitter)]
+        if rng.random() < self.reorder:
+            self.stats["reordered"] += 1
+            times[0] += self.reorder_delay
+        if rng.random() < self.duplicate:
+            self.stats["duplicated"] += 1
+            times.append(times[0])
+        return times
+
+
+"""
+Description:
+    Class to forward UDP packets between clients and a server with loss, delay, jitter, reordering, duplication and a rate limit
+    # NOTE: Each client gets its own socket to the server, so the server sees one address for each client as without the proxy
+Parameters:
+    listen: tuple - The address the clients send to, format: (ip, port)
+    target: tuple - The address of the server, format: (ip, port)
+    uplink: Link - The impairments of the packets from the clients to the server
+    downlink: Link - The impairments of the packets from the server to the clients
+    seed: int - The seed of the random number generator, the same seed drops the same packets
+"""
+class ImpairmentProxy:
+    """
+    Description:
+        Function to bind the proxy to its address
+    Parameters:
+        See the class description
+    Return:
+        None
+    """
+    def __init__(self, listen, target, uplink=None, downlink=None, seed=None):
+        self.target = target
+        self.uplink = uplink or Link()
+        self.downlink = downlink or Link()
+        self.rng = random.Random(seed)
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # NOTE: The default buffer holds only a few datagrams of 65000 bytes, the kernel would drop the packets of a window at the proxy
+        set_receive_buffer(self.socket, None)
+        self.socket.bind(listen)
+        self.address = self.socket.getsockname()
+        self.upstream = {}  # Socket to the server of each client, format: {client address: socket}
+        self.clients = {}   # Client of each socket to the server, format: {socket: client address}
+        self.pending = []   # Packets to forward, format: [(time, order, socket, address, data)]
+        self.order = 0      # Arrival order, keeps packets with the same time in order
+        self.running = False
+        self.thread = None
+
+    """
+    Description:
+        Function to get the socket to the server of a client, a new one is connected for a new client
+    Parameters:
+        client: tuple - The address of the client
+    Return:
+        upstream: socket.socket - The socket to the server
+    """
+    def upstream_socket(self, client):
+        upstream = self.upstream.get(client)
+        if upstream is None:
+            upstream = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            set_receive_buffer(upstream, None)
+            upstream.connect(self.target)
+            self.upstream[client] = upstream
+            self.clients[upstream] = client
+        return upstream
+
+    """
+    Description:
+        Function to read a packet and queue it to be forwarded
+    Parameters:
+        sock: socket.socket - The socket that is readable
+        now: float - The time
+    Return:
+        None
+    """
+    def receive(self, sock, now):
+        try:
+            data, address = sock.recvfrom(65535)
+        except OSError:
+            return
+        if sock is self.socket:
+            link, out_socket, out_address = self.uplink, self.upstream_socket(address), None
+        else:
+            link, out_socket, out_address = self.downlink, self.socket, self.clients[sock]
+        for forward_time in link.schedule(now, len(data), self.rng):
+            self.order += 1
+            heapq.heappush(self.pending, (forward_time, self.order, out_socket, out_address, data))
+
+    """
+    Description:
+        Function to forward the queued packets that are due
+    Parameters:
+        now: float - The time
+    Return:
+        None
+    """
+    def forward(self, now):
+        while self.pending and self.pending[0][0] <= now:
+            _, _, out_socket, out_address, data = heapq.heappop(self.pending)
+            try:
+                if out_address is None:
+                    out_socket.send(data)
+                else:
+                    out_socket.sendto(data, out_address)
+            except OSError:
+                # The server is not listening, the packet is lost as on a real network
+                pass
+
+    """
+    Description:
+        Function to forward packets until stop is called
+    Parameters:
+        None
+    Return:
+        None
+    """
+    def run(self):
+        self.running = True
+        while self.running:
+            wait = 0.1
+            if self.pending:
+                wait = min(max(self.pending[0][0] - time.monotonic(), 0), wait)
+            readable, _, _ = select.select([self.socket, *self.clients], [], [], wait)
+            now = time.monotonic()
+            for sock in readable:
+                self.receive(sock, now)
+            self.forward(time.monotonic())
+        self.socket.close()
+        for upstream in self.clients:
+            upstream.close()
+
+    """
+    Description:
+        Function to run the proxy in a daemon thread
+    Parameters:
+        None
+    Return:
+        None
+    """
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    """
+    Description:
+        Function to stop the proxy and close its sockets
+    Parameters:
+        None
+    Return:
+        None
+    """
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+
+    """
+    Description:
+        Function to get the counters of both directions
+    Parameters:
+        None
+    Return:
+        stats: dict - format: {"uplink": {counter: count}, "downlink": {counter: count}}
+    """
+    def stats(self):
+        return {"uplink": dict(self.uplink.stats), "downlink": dict(self.downlink.stats)}
+
+
+"""
+Description:
+    Function to add the impairment arguments to a parser, used by the proxy and the benchmark
+Parameters:
+    parser: argparse.ArgumentParser - The parser
+Return:
+    None
+"""
+def add_link_arguments(parser):
+    """
+    Description:
+        Function to parse the rate of the link for argparse
+    Parameters:
+        value: str - The rate, e.g. 10M
+    Return:
+        rate: float - The rate in bits per second
+    """
+    def check_rate(value):
+        try:
+            return parse_rate(value)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"{value} is not a positive rate, e.g. 10M")
+
+    parser.add_argument('--delay', type=float, default=0.0, help="One-way delay in milliseconds, default %(default)s")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Largest random extra delay in milliseconds, default %(default)s")
+    parser.add_argument('--loss', type=float, default=0.0, help="Probability that a packet is dropped, in both directions, default %(default)s")
+    parser.add_argument('--reorder', type=float, default=0.0, help="Probability that a packet is held back so the next packets overtake it, default %(default)s")
+    parser.add_argument('--reorder-delay', type=float, default=2.0, help="Milliseconds a reordered packet is held back, default %(default)s")
+    parser.add_argument('--duplicate', type=float, default=0.0, help="Probability that a packet is forwarded twice, default %(default)s")
+    parser.add_argument('--rate', type=check_rate, help="Rate of the link in bits per second, with K, M or G, e.g. 10M. Default no limit")
+    parser.add_argument('--queue', type=int, default=100, help="Packets queued at the rate limit before packets are dropped, default %(default)s")
+    parser.add_argument('--seed', type=int, help="Seed of the random number generator, for repeatable runs")
+
+"""
+Description:
+    Function to make the link of one direction from the parsed arguments
+    # NOTE: The loss applies to both directions, so ACKs are lost as well
+Parameters:
+    args: argparse.Namespace - The parsed arguments
+    loss: float - The loss of the link, the loss argument if None
+Return:
+    link: Link - The link
+"""
+def link_from_args(args, loss=None):
+    return Link(args.delay / 1000, args.jitter / 1000, args.loss if loss is None else loss, args.reorder,
+                args.reorder_delay / 1000, args.duplicate, args.rate, args.queue)
+
+"""
+Description:
+    Function to run the proxy from the command line until Ctrl+C, then print the counters
+Parameters:
+    None
+Return:
+    None
+"""
+def main():
+    parser = argparse.ArgumentParser(description="UDP proxy that adds loss, delay, jitter, reordering, duplication and a rate limit between a DRTP client and server")
+    parser.add_argument('-l', '--listen', type=int, required=True, help="Port the client sends to")
+    parser.add_argument('-t', '--target', type=int, required=True, help="Port of the server")
+    parser.add_argument('-i', '--ip', default="127.0.0.1", help="IP address of the proxy and the server, default %(default)s")
+    add_link_arguments(parser)
+    args = parser.parse_args()
+
+    proxy = ImpairmentProxy((args.ip, args.listen), (args.ip, args.target), link_from_args(args), link_from_args(args), args.seed)
+    print(f"Proxy is forwarding {args.ip}:{args.listen} to {args.ip}:{args.target}")
+    try:
+        proxy.run()
+    except KeyboardInterrupt:
+        pass
+    for direction, stats in proxy.stats().items():
+        print(f"{direction}: " + ", ".join(f"{name} {count}" for name, count in stats.items()))
+
+# Run the main function if this script is executed
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,627 @@
+import argparse     # For the command line arguments
+import csv          # For writing the results
+import hashlib      # For checking the received data
+import heapq        # For the queue of events, ordered by their virtual time
+import itertools    # For the combinations of the sweep
+import os           # For discarding the messages of the connections
+import random       # For the loss, jitter, reordering and duplication
+import sys          # For the exit status of the check
+import time         # For timing the whole sweep
+import DRTP         # The state machines of the sender and the receiver
+from DRTP import send_packet, set_flags, unpack_header, pack_options, unpack_options
+from proxy import Link  # The impairments of the simulated links
+from benchmark import list_of, parse_size, format_size, print_table
+from config import *    # Import the configuration
+
+columns = ["mode", "cc", "window", "fec", "pacing", "size", "rtt_ms", "loss", "runs", "ok", "seconds", "max_seconds", "throughput_mbps", "overhead_percent"]
+
+"""
+Description:
+    Class to make the payloads of a file of a given size without reading a file, the same packet always gets the same bytes
+    It can be used in place of a FileReader
+Parameters:
+    size: int - The size of the simulated file in bytes
+    name: str - The filename sent in the first payload
+"""
+class SyntheticReader:
+    """
+    Description:
+        Function to calculate the number of packets of the file
+    Parameters:
+        size: int - The size of the simulated file
+        name: str - The filename sent in the first payload
+    Return:
+        None
+    """
+    def __init__(self, size, name="simulated.bin"):
+        self.encoded_filename = name.encode().ljust(max_filename_length, b'\0')
+        self.filesize = size
+        self.first_payload_size = payload_size - max_filename_length
+        remaining = max(0, size - self.first_payload_size)
+        self.total_packets = 2 + (remaining + payload_size - 1) // payload_size
+
+    """
+    Description:
+        Function to get the file data of a packet, a pattern made from the sequence number
+    Parameters:
+        seq_num: int - The sequence number of the packet, starting at 1
+    Return:
+        data: bytes - The file data in the packet
+    """
+    def data(self, seq_num):
+        if seq_num == 1:
+            offset, size = 0, min(self.first_payload_size, self.filesize)
+        else:
+            offset = self.first_payload_size + (seq_num - 2) * payload_size
+            size = max(0, min(payload_size, self.filesize - offset))
+        return (seq_num.to_bytes(4, "big") * (size // 4 + 1))[:size]
+
+    """
+    Description:
+        Function to read the payload of a packet, as FileReader.read
+    Parameters:
+        seq_num: int - The sequence number of the packet, starting at 1
+    Return:
+        payload: bytes - The payload of the packet, the first one starts with the filename
+    """
+    def read(self, seq_num):
+        if seq_num == 1:
+            return self.encoded_filename + self.data(1)
+        return self.data(seq_num)
+
+    """
+    Description:
+        Function to get the digest of the whole file, to compare with what the receiver got
+    Parameters:
+        None
+    Return:
+        digest: bytes - The BLAKE2b digest of the file data
+    """
+    def digest(self):
+        digest = hashlib.blake2b()
+        for seq_num in range(1, self.total_packets + 1):
+            digest.update(self.data(seq_num))
+        return digest.digest()
+
+    """
+    Description:
+        Function to close the reader, nothing is open
+    Parameters:
+        None
+    Return:
+        None
+    """
+    def close(self):
+        pass
+
+"""
+Description:
+    Class to take the received file in place of a FileWriter, only the size and a digest of the data are kept
+Parameters:
+    The same as FileWriter, the buffers and the flush mode are not used
+"""
+class DigestWriter:
+    """
+    Description:
+        Function to start the digest with the first payload
+    Parameters:
+        first_payload: memoryview - The payload of the first packet, starting with the filename
+        buffer: bytearray - Not used
+        free_buffers: queue.Queue - Not used
+        flush: str - Not used
+        log: function - Not used
+        file_range: tuple - Not used
+        checkpoint: Checkpoint - Not used
+    Return:
+        None
+    """
+    def __init__(self, first_payload, buffer, free_buffers, flush, log=None, file_range=None, checkpoint=None):
+        self.filename = bytes(first_payload[:max_filename_length]).decode().strip('\0')
+        self.error = None
+        self.size = 0
+        self.hash = hashlib.blake2b()
+        self.write(first_payload[max_filename_length:], buffer)
+
+    """
+    Description:
+        Function to add a payload to the digest
+    Parameters:
+        payload: memoryview - The payload
+        buffer: bytearray - Not used
+    Return:
+        None
+    """
+    def write(self, payload, buffer):
+        self.size += len(payload)
+        self.hash.update(payload)
+
+    """
+    Description:
+        Function to finish the file, nothing is written
+    Parameters:
+        None
+    Return:
+        None
+    """
+    def close(self):
+        pass
+
+    """
+    Description:
+        Function to get the number of payloads that are not written yet, the digest is updated at once
+    Parameters:
+        None
+    Return:
+        backlog: int - Always 0
+    """
+    def backlog(self):
+        return 0
+
+"""
+Description:
+    Class to run one transfer between a SenderConnection and a ReceiverConnection over simulated links with a virtual clock
+    The packets and timers are events in a queue ordered by their virtual time, so no time is spent waiting
+    # NOTE: The client side follows run_client: SYN, SYN-ACK and ACK, the sliding window of the SenderConnection, then FIN and FIN-ACK
+Parameters:
+    size: int - The size of the simulated file in bytes
+    mode: str - "gbn" for Go-Back-N, "sr" for Selective Repeat
+    congestion: str - The congestion control algorithm
+    window: int - The upper bound of the window in packets, None for no bound
+    uplink: Link - The link from the client to the server
+    downlink: Link - The link from the server to the client
+    seed: int - The seed of the random number generator of the links
+    sack: bool - True if the client offers SACK, as run_client does
+    fec: tuple - The parity packets the client sends, see DRTP.parse_fec, None for none
+    pacing: str - "window" to pace the packets of the client over the RTT, "none" to send the window at once
+    discard: int - The packet the server discards once, as the -d option of the server, None to not discard any packet
+    drops: set - The data packets the uplink loses the first time they are sent, None to not lose any
+"""
+class Simulation:
+    """
+    Description:
+        Function to set up the client, the server and the links at time 0
+    Parameters:
+        See the class description
+    Return:
+        None
+    """
+    def __init__(self, size, mode=default_mode, congestion=congestion_control, window=None, uplink=None, downlink=None, seed=None, sack=True, fec=None,
+                 pacing=pacing, discard=None, drops=None):
+        self.reader = SyntheticReader(size)
+        self.mode = mode
+        self.congestion = congestion
+        self.window = window
+        self.sack = sack
+        self.fec = fec
+        self.pacing = pacing
+        self.drops = set(drops or ())
+        self.uplink = uplink or Link()
+        self.downlink = downlink or Link()
+        self.rng = random.Random(seed)
+        self.now = 0.0
+        self.events = []    # format: [(time, order, function, arguments)]
+        self.order = 0
+
+        # Client side
+        self.state = "syn_sent"     # syn_sent, established, fin_sent, closed, failed
+        self.client_timer = 0       # Number of the current client timer, older timers are ignored
+        self.retries = 0
+        self.syn_time = None
+        self.rtt = DRTP.RTTEstimator()
+        self.connection = None
+        self.header_struct = DRTP_struct
+        self.ack_num = 0
+        self.end_time = None
+        self.pace_timer = None  # Time of the pending pacing event, None if there is none
+
+        # Server side
+        self.receiver = DRTP.ReceiverConnection(discard, mode=mode, writer_class=DigestWriter)
+        self.ack_timer = None   # Time of the pending delayed ACK event, None if there is none
+
+    """
+    Description:
+        Function to add an event to the queue
+    Parameters:
+        at: float - The virtual time of the event
+        function: function - Called with the arguments at that time
+        args: tuple - The arguments
+    Return:
+        None
+    """
+    def schedule(self, at, function, *args):
+        self.order += 1
+        heapq.heappush(self.events, (at, self.order, function, args))
+
+    """
+    Description:
+        Function to send a packet over a link, it arrives at the other side after the impairments of the link
+    Parameters:
+        link: Link - The link to send on
+        packet: bytes - The packet
+        deliver: function - Called with the packet when it arrives
+    Return:
+        None
+    """
+    def transmit(self, link, packet, deliver):
+        for at in link.schedule(self.now, len(packet), self.rng):
+            self.schedule(at, deliver, packet)
+
+    """
+    Description:
+        Function to start the client timer, a new timer replaces the running one
+    Parameters:
+        delay: float - Seconds until the timer expires
+    Return:
+        None
+    """
+    def start_timer(self, delay):
+        self.client_timer += 1
+        self.schedule(self.now + delay, self.client_timeout, self.client_timer)
+
+    """
+    Description:
+        Function to run the transfer until the client is done or gives up
+    Parameters:
+        limit: float - The longest virtual time to run, in seconds
+    Return:
+        result: dict - format: {"ok", "seconds", "packets", "retransmissions", "metrics"}
+    """
+    def run(self, limit=3600):
+        self.send_syn()
+        while self.events and self.state not in ("closed", "failed"):
+            at, _, function, args = heapq.heappop(self.events)
+            if at > limit:
+                self.state = "failed"
+                break
+            self.now = at
+            function(*args)
+
+        writer = self.receiver.writer
+        ok = (self.state == "closed" and writer is not None and writer.size == self.reader.filesize
+              and writer.hash.digest() == self.reader.digest())
+        metrics = self.connection.metrics if self.connection is not None else DRTP.TransferMetrics("client")
+        return {
+            "ok": ok,
+            "seconds": self.end_time,
+            "packets": metrics.counters.get("packets", 0),
+            "retransmissions": metrics.counters.get("retransmissions", 0),
+            "parity": metrics.counters.get("parity", 0),
+            "metrics": metrics,
+        }
+
+    """
+    Description:
+        Function to send the SYN packet with the options of run_client, it is resent with the same options
+    Parameters:
+        None
+    Return:
+        None
+    """
+    def send_syn(self):
+        options = {"seq32": 1, "rwnd": 1}
+        if self.sack:
+            options["sack"] = 1
+        if self.fec:
+            options["fec"] = self.fec[:2]
+        if self.syn_time is None:
+            self.syn_time = self.now
+        self.transmit(self.uplink, send_packet(0, 0, set_flags(1, 0, 0, 0), pack_options(options)), self.server_receive)
+        self.start_timer(self.rtt.timeout())
+
+    """
+    Description:
+        Function called when the client timer expires, the SYN or FIN packet is resent or the sliding window times out
+    Parameters:
+        timer: int - The number of the timer, ignored if it is not the current timer
+    Return:
+        None
+    """
+    def client_timeout(self, timer):
+        if timer != self.client_timer:
+            return
+        if self.state == "established":
+            self.send_resends(self.connection.handle_timeout(self.now, True))
+            self.pump()
+            return
+        self.rtt.on_timeout()
+        self.retries += 1
+        if self.retries > max_retries:
+            self.state = "failed"
+        elif self.state == "syn_sent":
+            self.send_syn()
+        elif self.state == "fin_sent":
+            self.send_fin()
+
+    """
+    Description:
+        Function called when a packet arrives at the client
+    Parameters:
+        packet: bytes - The packet
+    Return:
+        None
+    """
+    def client_receive(self, packet):
+        if self.state == "syn_sent":
+            ack_num, seq_num, flags = unpack_header(packet[:DRTP_struct.size])
+            if not (flags[0] == 1 and flags[1] == 1):
+                return
+            options = unpack_options(packet[DRTP_struct.size:])
+            self.header_struct = DRTP_extended_struct if options.get("seq32") else DRTP_struct
+            # NOTE: The round trip time is only measured if the SYN packet is not resent, as in run_client
+            if self.retries == 0:
+                self.rtt.sample(self.now - self.syn_time)
+            self.retries = 0
+            self.ack_num = ack_num + 1
+            self.transmit(self.uplink, send_packet(seq_num, self.ack_num, set_flags(0, 1, 0, 0)), self.server_receive)
+
+            metrics = DRTP.TransferMetrics("client", "simulated")
+            if self.rtt.srtt is not None:
+                metrics.rtt(None, self.rtt.srtt)
+            metrics.start(self.now)
+            fec = (*options["fec"], self.fec[2]) if self.fec and "fec" in options else None
+            pacer = DRTP.Pacer() if self.pacing == "window" else None
+            self.connection = DRTP.SenderConnection(self.reader, self.mode, self.congestion, self.window, self.rtt,
+                                                    self.header_struct, bool(options.get("sack")), metrics, fec, pacer, options.get("rwnd"))
+            self.state = "established"
+            self.pump()
+        elif self.state == "established":
+            resent = self.connection.handle_ack(packet, self.now)
+            resent.extend(self.connection.handle_timeout(self.now, False))
+            self.send_resends(resent)
+            self.pump()
+        elif self.state == "fin_sent":
+            _, _, flags = unpack_header(packet[:self.header_struct.size], self.header_struct)
+            if flags[1] == 1 and flags[2] == 1:
+                self.state = "closed"
+                self.client_timer += 1
+
+    """
+    Description:
+        Function to send the packets the sliding window allows, then wait for the ACKs or start the teardown
+    Parameters:
+        None
+    Return:
+        None
+    """
+    def pump(self):
+        connection = self.connection
+        for seq_num, payload in connection.transmit(self.now):
+            self.send_data(seq_num, payload)
+        for seq_num, cover, payload in connection.parity_packets():
+            self.transmit(self.uplink, send_packet(seq_num, cover, set_flags(0, 0, 0, 0, parity=1), payload, self.header_struct), self.server_receive)
+        if connection.done():
+            connection.metrics.finish(self.now)
+            self.end_time = self.now
+            self.state = "fin_sent"
+            self.retries = 0
+            self.send_fin()
+        elif connection.gave_up():
+            self.state = "failed"
+        else:
+            self.start_timer(connection.next_timeout(self.now))
+            # Send the next packets when the pacer allows them, the timer of the window keeps running
+            pace = connection.next_send(self.now)
+            if pace is not None and self.pace_timer is None:
+                self.pace_timer = self.now + pace
+                self.schedule(self.pace_timer, self.pace_timeout)
+
+    """
+    Description:
+        Function called when the pacer allows the next packets
+    Parameters:
+        None
+    Return:
+        None
+    """
+    def pace_timeout(self):
+        self.pace_timer = None
+        if self.state == "established":
+            self.pump()
+
+    """
+    Description:
+        Function to send a data packet
+    Parameters:
+        seq_num: int - The sequence number
+        payload: bytes - The payload
+    Return:
+        None
+    """
+    def send_data(self, seq_num, payload):
+        if seq_num in self.drops:
+            self.drops.discard(seq_num)
+            return
+        self.transmit(self.uplink, send_packet(seq_num, self.ack_num, set_flags(0, 0, 0, 0), payload, self.header_struct), self.server_receive)
+
+    """
+    Description:
+        Function to send the packets that are resent at once
+    Parameters:
+        packets: list - format: [(seq_num, payload)]
+    Return:
+        None
+    """
+    def send_resends(self, packets):
+        for seq_num, payload in packets:
+            self.send_data(seq_num, payload)
+
+    """
+    Description:
+        Function to send the FIN packet and wait for the FIN-ACK packet
+    Parameters:
+        None
+    Return:
+        None
+    """
+    def send_fin(self):
+        self.transmit(self.uplink, send_packet(self.connection.next_seq, self.ack_num, set_flags(0, 0, 1, 0), header_struct=self.header_struct),
+                      self.server_receive)
+        self.start_timer(self.rtt.timeout())
+
+    """
+    Description:
+        Function called when a packet arrives at the server, it is handled by the ReceiverConnection
+    Parameters:
+        packet: bytes - The packet
+    Return:
+        None
+    """
+    def server_receive(self, packet):
+        receiver = self.receiver
+        for reply in receiver.handle_packet(memoryview(packet), None, self.now):
+            self.transmit(self.downlink, reply, self.client_receive)
+        if receiver.state == "fin_received":
+            for reply in receiver.finish(self.now):
+                self.transmit(self.downlink, reply, self.client_receive)
+        if receiver.ack_deadline is not None and self.ack_timer is None:
+            self.ack_timer = receiver.ack_deadline
+            self.schedule(receiver.ack_deadline, self.server_ack_timeout)
+
+    """
+    Description:
+        Function called when the timer of a delayed ACK expires
+    Parameters:
+        None
+    Return:
+        None
+    """
+    def server_ack_timeout(self):
+        self.ack_timer = None
+        receiver = self.receiver
+        for reply in receiver.delayed_ack(self.now):
+            self.transmit(self.downlink, reply, self.client_receive)
+        if receiver.ack_deadline is not None:
+            self.ack_timer = receiver.ack_deadline
+            self.schedule(receiver.ack_deadline, self.server_ack_timeout)
+
+"""
+Description:
+    Function to run the seeded transfers of one combination and summarize them
+Parameters:
+    args: argparse.Namespace - The parsed arguments
+    mode, cc, window, fec, pacing, size, rtt, loss: The combination, fec is the setting of --fec
+    writer: csv.DictWriter - The writer of the single runs, None to not write them
+Return:
+    row: dict - The summary, format: {column: value}
+"""
+def run_scenarios(args, mode, cc, window, fec, pacing, size, rtt, loss, writer=None):
+    results = []
+    for seed in range(args.seed, args.seed + args.seeds):
+        links = [Link(rtt / 2000, args.jitter / 1000, loss, args.reorder, args.reorder_delay / 1000, args.duplicate, args.rate, args.queue)
+                 for _ in range(2)]
+        result = Simulation(size, mode, cc, window, links[0], links[1], seed, fec=DRTP.parse_fec(fec), pacing=pacing).run(args.limit)
+        results.append(result)
+        if writer is not None:
+            writer.writerow({"mode": mode, "cc": cc, "window": window, "fec": fec, "pacing": pacing, "size": size, "rtt_ms": rtt, "loss": loss, "seed": seed,
+                             "ok": result["ok"], "seconds": result["seconds"], "packets": result["packets"], "retransmissions": result["retransmissions"],
+                             "parity": result["parity"]})
+    done = [result for result in results if result["ok"]]
+    seconds = [result["seconds"] for result in done]
+    sent = sum(result["packets"] for result in done)
+    return {
+        "mode": mode,
+        "cc": cc,
+        "window": window,
+        "fec": fec,
+        "pacing": pacing,
+        "size": format_size(size),
+        "rtt_ms": rtt,
+        "loss": loss,
+        "runs": len(results),
+        "ok": len(done),
+        "seconds": round(sum(seconds) / len(seconds), 3) if seconds else None,
+        "max_seconds": round(max(seconds), 3) if seconds else None,
+        "throughput_mbps": round(size * 8 * len(seconds) / sum(seconds) / 1e6, 2) if seconds and sum(seconds) else None,
+        "overhead_percent": round(sum(result["retransmissions"] + result["parity"] for result in done) * 100 / sent, 2) if sent else None,
+    }
+
+"""
+Description:
+    Function to check that the client recovers from lost packets within about one RTT and without a timeout
+    A packet the server discards and a burst of packets the uplink loses are compared with the same transfer without losses
+    # NOTE: The fixed window keeps the window the same after the loss, so the transfer is only longer by the time of the recovery
+Parameters:
+    args: argparse.Namespace - The parsed arguments, the first size, RTT and window are used
+Return:
+    ok: bool - True if every check passed
+"""
+def check_recovery(args):
+    size, rtt, window = args.sizes[0], args.rtts[0], args.windows[0]
+    # The first packet of the second window, the rest of the window brings the duplicate ACKs
+    lost = window + 1
+    cases = [("gbn", "discard", {"discard": lost}), ("sr", "discard", {"discard": lost}),
+             ("sr", "burst", {"drops": range(lost, lost + window // 2)})]
+    ok = True
+    for mode, name, losses in cases:
+        simulate = lambda **losses: Simulation(size, mode, "fixed", window, Link(rtt / 2000), Link(rtt / 2000), args.seed, pacing="none", **losses).run(args.limit)
+        baseline = simulate()
+        result = simulate(**losses)
+        timeouts = result["metrics"].counters.get("timeouts", 0)
+        delay = (result["seconds"] - baseline["seconds"]) * 1000 if result["ok"] and baseline["ok"] else None
+        # One RTT for the duplicate ACKs and the resent packets, with some slack for the delayed ACKs
+        passed = delay is not None and timeouts == 0 and delay <= rtt * 1.5
+        ok = ok and passed
+        delay = f"{delay:.1f} ms" if delay is not None else "not done"
+        print(f"{mode} {name}: {'ok' if passed else 'FAILED'}, {delay} longer than without losses, {timeouts} timeouts, "
+              f"{result['retransmissions']} retransmissions")
+    return ok
+
+"""
+Description:
+    Function to run the seeded scenarios of every combination and print a table of the mean results in virtual time
+Parameters:
+    None
+Return:
+    None
+"""
+def main():
+    parser = argparse.ArgumentParser(description="Discrete-event simulation of DRTP transfers, the real sender and receiver state machines over simulated links")
+    parser.add_argument('-w', '--windows', type=list_of(int), default=[10], help="Comma separated upper bounds of the window, default 10")
+    parser.add_argument('-s', '--sizes', type=list_of(parse_size), default=[parse_size("1M")], help="Comma separated file sizes with K, M or G, default 1M")
+    parser.add_argument('--rtts', type=list_of(float), default=[100.0], help="Comma separated round trip times in milliseconds, default 100")
+    parser.add_argument('--losses', type=list_of(float), default=[0.0, 0.02], help="Comma separated loss rates in each direction, default 0,0.02")
+    parser.add_argument('-m', '--modes', type=list_of(str), default=["gbn", "sr"], help="Comma separated reliability modes, default gbn,sr")
+    parser.add_argument('--cc', type=list_of(str), default=[congestion_control], help=f"Comma separated congestion control algorithms, default {congestion_control}")
+    parser.add_argument('--fec', type=list_of(str), default=["none"], help="Comma separated parity settings of the client, none, auto or N:K, default none")
+    parser.add_argument('--pacing', type=list_of(str), default=[pacing], help=f"Comma separated pacing of the client, none or window, default {pacing}")
+    parser.add_argument('-n', '--seeds', type=int, default=100, help="Seeded runs of each combination, default %(default)s")
+    parser.add_argument('--seed', type=int, default=1, help="First seed, default %(default)s")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Largest random extra delay in milliseconds, default %(default)s")
+    parser.add_argument('--reorder', type=float, default=0.0, help="Probability that a packet is held back, default %(default)s")
+    parser.add_argument('--reorder-delay', type=float, default=2.0, help="Milliseconds a reordered packet is held back, default %(default)s")
+    parser.add_argument('--duplicate', type=float, default=0.0, help="Probability that a packet is delivered twice, default %(default)s")
+    parser.add_argument('--rate', type=float, help="Rate of the links in bits per second, default no limit")
+    parser.add_argument('--queue', type=int, default=100, help="Packets queued at the rate limit, default %(default)s")
+    parser.add_argument('--limit', type=float, default=3600, help="Virtual seconds before a run fails, default %(default)s")
+    parser.add_argument('-o', '--output', help="Write every run to this CSV file")
+    parser.add_argument('-v', '--verbose', action="store_true", help="Print the messages of the connections")
+    parser.add_argument('--check', action="store_true", help="Check the recovery from a discarded packet and a burst of losses, exit with 1 if it fails")
+    args = parser.parse_args()
+
+    # The messages of thousands of connections are not printed
+    if not args.verbose:
+        DRTP.logger.set_level("summary")
+        DRTP.logger.stream = open(os.devnull, "w")
+
+    if args.check:
+        sys.exit(0 if check_recovery(args) else 1)
+
+    output = open(args.output, "w", newline="") if args.output else None
+    writer = None
+    if output is not None:
+        writer = csv.DictWriter(output, fieldnames=["mode", "cc", "window", "fec", "pacing", "size", "rtt_ms", "loss", "seed", "ok", "seconds", "packets", "retransmissions", "parity"])
+        writer.writeheader()
+
+    start_time = time.perf_counter()
+    rows = [run_scenarios(args, *combination, writer)
+            for combination in itertools.product(args.modes, args.cc, args.windows, args.fec, args.pacing, args.sizes, args.rtts, args.losses)]
+    elapsed_time = time.perf_counter() - start_time
+    if output is not None:
+        output.close()
+
+    print_table(rows, columns)
+    print(f"\n{sum(row['runs'] for row in rows)} transfers simulated in {elapsed_time:.2f} seconds")
+
+# Run the main function if this script is executed
+if __name__ == "__main__":
+    main()